@@ -1,21 +1,38 @@
 """
 Smart Agriculture AI Service - Version 1.0.1 (Stable)
 """
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, Dict, List, Any
+from typing import Optional, Dict, List, Any, AsyncIterator, Union
 import os
+import json
+import time
 import asyncio
-from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
+from datetime import datetime
 from dotenv import load_dotenv
-import httpx
 
 # Import AI models
-from models.irrigation_predictor import IrrigationPredictor
+from models.irrigation_predictor import IrrigationPredictor, forecast_dates, history_to_columns, train_irrigation_model
 from models.fertilizer_predictor import FertilizerPredictor
 from models.zone_optimizer import ZoneOptimizer
+from models.pump_scheduler import PumpScheduler
+from models.prophet_forecaster import WeatherAwareMoisturePredictor, training_resolution
+from models.prophet_registry import ProphetModelRegistry
 from utils.data_processor import SensorDataProcessor
+from utils.weather_service import WeatherService, parse_locations
+from utils.weather_cache import WeatherCache
+from utils.http_clients import http_clients
+from utils.model_router import ModelRouter
+from utils.response_cache import ResponseCache
+from utils.forecast_pool import ForecastPool, PoolSaturated
+from utils.device_state import DeviceStateStore, WINDOW_FIELDS, to_epoch
+from utils.sensor_history import SensorHistoryStore, ROLLUP_RESOLUTIONS, columns_to_json
+from utils.pump_state import PumpStateStore
+from utils.shared_state import create_shared_store
+from utils.rule_engine import RuleEngine
 
 # Load environment variables
 load_dotenv()
@@ -45,10 +62,26 @@ GEMINI_MODELS = [
     "gemini-pro",
 ]
 
-# Track state
+GEMINI_API_VERSIONS = ["v1beta", "v1"]  # v1beta first (works for gemini-2.5-flash), then v1 as fallback
+GEMINI_BASE_URL = "https://generativelanguage.googleapis.com"
+
+# State shared by every worker process (memory:// = this process only):
+# Gemini quota and routing, the weather cache and pump state
+shared_store = create_shared_store(os.getenv("SHARED_STATE_URL") or os.getenv("PUMP_STATE_URL", "memory://"))
+
+# Track state (per worker; quota and model selection live in shared_store)
 working_model: Optional[str] = None
 last_gemini_error: Optional[str] = None
-quota_reset_time: Optional[datetime] = None
+QUOTA_RESET_KEY = "gemini:quota_reset"
+
+# Remembers the last working model/version and cools down failing ones
+model_router = ModelRouter(
+    GEMINI_MODELS,
+    GEMINI_API_VERSIONS,
+    base_cooldown=float(os.getenv("GEMINI_COOLDOWN_BASE", 30)),
+    max_cooldown=float(os.getenv("GEMINI_COOLDOWN_MAX", 1800)),
+    shared=shared_store
+)
 
 print("\n" + "=" * 50)
 print("SMART AGRICULTURE AI SERVICE")
@@ -60,96 +93,377 @@ else:
 print("=" * 50 + "\n")
 
 
-async def call_gemini(prompt: str) -> Optional[str]:
-    """Call Gemini API with correct models and error handling"""
-    global last_gemini_error, working_model, quota_reset_time
+def gemini_request_body(prompt: str) -> Dict[str, Any]:
+    """generateContent / streamGenerateContent payload"""
+    return {
+        "contents": [{"parts": [{"text": prompt}]}],
+        "generationConfig": {
+            "temperature": 0.5,
+            "maxOutputTokens": 4096,
+            "topP": 0.95
+        },
+        "safetySettings": [
+            {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
+            {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
+            {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
+            {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"}
+        ]
+    }
+
+
+async def quota_wait_seconds() -> Optional[int]:
+    """Seconds until the Gemini quota resets (set by any worker), None if not limited"""
+    reset_at = await shared_store.aget(QUOTA_RESET_KEY)
+    if reset_at is None or float(reset_at) <= time.time():
+        return None
+    return int(float(reset_at) - time.time())
+
+
+def retry_delay_seconds(error_data: Dict[str, Any]) -> Optional[float]:
+    """RetryInfo delay ("37s") from a Gemini 429 error body, if present"""
+    for detail in error_data.get("error", {}).get("details", []) or []:
+        delay = detail.get("retryDelay")
+        if isinstance(delay, str) and delay.endswith("s"):
+            try:
+                return float(delay[:-1])
+            except ValueError:
+                return None
+    return None
+
+
+async def gemini_candidates() -> List[tuple]:
+    """
+    Endpoints to try for this request, or [] (with last_gemini_error set)
+    when Gemini can't be used right now
+    """
+    global last_gemini_error
     last_gemini_error = None
     
     if not has_gemini:
         last_gemini_error = "No API key configured"
-        return None
+        return []
     
     # Check if we're in quota cooldown
-    if quota_reset_time and datetime.now() < quota_reset_time:
-        wait_seconds = (quota_reset_time - datetime.now()).seconds
+    wait_seconds = await quota_wait_seconds()
+    if wait_seconds is not None:
         last_gemini_error = f"Quota exceeded. Retry in {wait_seconds}s"
-        return None
+        return []
     
-    # Try each model
-    for model in GEMINI_MODELS:
-        # Try v1beta first (works for gemini-2.5-flash), then v1 as fallback
-        api_versions = ["v1beta", "v1"]
+    candidates = await model_router.candidates()
+    if not candidates:
+        last_gemini_error = "All Gemini models are cooling down after errors"
+    return candidates
+
+
+async def record_gemini_error(endpoint: tuple, status_code: int, error_data: Dict[str, Any], latency: float, failed_models: set):
+    """Log a non-200 Gemini response and feed it to the router"""
+    model, api_version = endpoint
+    if status_code == 429:
+        # Rate limited
+        print(f"⚠️ {model} ({api_version}): Rate limited")
+        await model_router.record_failure(endpoint, "rate_limited", latency)
+        delay = retry_delay_seconds(error_data)
+        if delay:
+            # Quota exhausted - every worker skips Gemini until it resets
+            await shared_store.aset(QUOTA_RESET_KEY, str(time.time() + delay), ttl=delay)
+        failed_models.add(model) # Try NEXT model if one version is rate limited
+    elif status_code == 404:
+        # Model not found on this version
+        print(f"⚠️ {model} ({api_version}): Not found")
+        await model_router.record_failure(endpoint, "not_found", latency)
+        # Try NEXT api_version for same model
+    else:
+        error_msg = error_data.get("error", {}).get("message", f"HTTP {status_code}")
+        print(f"❌ {model} ({api_version}): {error_msg[:100]}")
+        await model_router.record_failure(endpoint, "error", latency, error_msg[:100])
+        failed_models.add(model) # Try NEXT model
+
+
+def candidate_text(data: Dict[str, Any]) -> tuple:
+    """(text, finish_reason) of the first candidate in a Gemini response chunk"""
+    candidates = data.get("candidates", [])
+    if not candidates:
+        return "", None
+    candidate = candidates[0]
+    parts = candidate.get("content", {}).get("parts", [])
+    return "".join([p.get("text", "") for p in parts if "text" in p]), candidate.get("finishReason")
+
+
+async def call_gemini(prompt: str) -> Optional[str]:
+    """Call Gemini API with correct models and error handling"""
+    global working_model
+    
+    # Try each model, last working one first
+    failed_models = set()
+    for model, api_version in await gemini_candidates():
+        if model in failed_models:
+            continue # A version of this model already failed on this request
+        endpoint = (model, api_version)
+        url = f"{GEMINI_BASE_URL}/{api_version}/models/{model}:generateContent"
+        start = time.monotonic()
         
-        for api_version in api_versions:
-            url = f"https://generativelanguage.googleapis.com/{api_version}/models/{model}:generateContent"
+        try:
+            client = http_clients.get("gemini")
+            response = await client.post(
+                f"{url}?key={GEMINI_API_KEY}",
+                json=gemini_request_body(prompt),
+                headers={"Content-Type": "application/json"}
+            )
+            latency = time.monotonic() - start
             
-            try:
-                async with httpx.AsyncClient() as client:
-                    response = await client.post(
-                        f"{url}?key={GEMINI_API_KEY}",
-                        json={
-                            "contents": [{"parts": [{"text": prompt}]}],
-                            "generationConfig": {
-                                "temperature": 0.5,
-                                "maxOutputTokens": 4096,
-                                "topP": 0.95
-                            },
-                            "safetySettings": [
-                                {"category": "HARM_CATEGORY_HARASSMENT", "threshold": "BLOCK_NONE"},
-                                {"category": "HARM_CATEGORY_HATE_SPEECH", "threshold": "BLOCK_NONE"},
-                                {"category": "HARM_CATEGORY_SEXUALLY_EXPLICIT", "threshold": "BLOCK_NONE"},
-                                {"category": "HARM_CATEGORY_DANGEROUS_CONTENT", "threshold": "BLOCK_NONE"}
-                            ]
-                        },
-                        timeout=30.0,
-                        headers={"Content-Type": "application/json"}
-                    )
-                    
-                    if response.status_code == 200:
-                        data = response.json()
-                        candidates = data.get("candidates", [])
-                        if candidates:
-                            candidate = candidates[0]
-                            parts = candidate.get("content", {}).get("parts", [])
-                            finish_reason = candidate.get("finishReason")
-                            
-                            if parts:
-                                full_text = "".join([p.get("text", "") for p in parts if "text" in p])
-                                working_model = model
-                                print(f"✅ Success with {model} ({api_version}) (Length: {len(full_text)}, FinishReason: {finish_reason})")
-                                return full_text
-                    
-                    elif response.status_code == 429:
-                        # Rate limited
-                        print(f"⚠️ {model} ({api_version}): Rate limited")
-                        break # Try NEXT model if one version is rate limited
-                    
-                    elif response.status_code == 404:
-                        # Model not found on this version
-                        print(f"⚠️ {model} ({api_version}): Not found")
-                        continue # Try NEXT api_version for same model
+            if response.status_code == 200:
+                full_text, finish_reason = candidate_text(response.json())
+                if full_text:
+                    working_model = model
+                    await model_router.record_success(endpoint, latency)
+                    print(f"✅ Success with {model} ({api_version}) (Length: {len(full_text)}, FinishReason: {finish_reason})")
+                    return full_text
+                # Empty answer (e.g. blocked prompt) - not the endpoint's fault
+                model_router.observe(endpoint, "empty", latency)
+            else:
+                await record_gemini_error(endpoint, response.status_code, response.json(), latency, failed_models)
                     
-                    else:
-                        error_data = response.json()
-                        error_msg = error_data.get("error", {}).get("message", f"HTTP {response.status_code}")
-                        print(f"❌ {model} ({api_version}): {error_msg[:100]}")
-                        break # Try NEXT model
-                        
-            except Exception as e:
-                print(f"💥 {model} ({api_version}) Error: {str(e)[:50]}")
-                break
+        except Exception as e:
+            print(f"💥 {model} ({api_version}) Error: {str(e)[:50]}")
+            await model_router.record_failure(endpoint, "exception", time.monotonic() - start, str(e)[:100])
+            failed_models.add(model)
                     
     return None
 
 
+class GeminiStreamInterrupted(Exception):
+    """Gemini stopped after part of the answer had been relayed"""
+
+
+async def stream_gemini(prompt: str) -> AsyncIterator[str]:
+    """
+    Stream Gemini text chunks via streamGenerateContent (SSE).
+    Falls through models like call_gemini until one starts producing text;
+    once text has been relayed, an error (or a stream that ends without a
+    finish reason) raises GeminiStreamInterrupted instead of switching model
+    """
+    global working_model
+    
+    failed_models = set()
+    for model, api_version in await gemini_candidates():
+        if model in failed_models:
+            continue
+        endpoint = (model, api_version)
+        url = f"{GEMINI_BASE_URL}/{api_version}/models/{model}:streamGenerateContent"
+        start = time.monotonic()
+        streamed = False
+        finish_reason = None
+        
+        try:
+            client = http_clients.get("gemini")
+            async with client.stream(
+                "POST",
+                f"{url}?alt=sse&key={GEMINI_API_KEY}",
+                json=gemini_request_body(prompt),
+                headers={"Content-Type": "application/json"}
+            ) as response:
+                if response.status_code != 200:
+                    await response.aread()
+                    await record_gemini_error(endpoint, response.status_code, response.json(), time.monotonic() - start, failed_models)
+                    continue
+                
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    text, reason = candidate_text(json.loads(line[5:]))
+                    finish_reason = reason or finish_reason
+                    if not text:
+                        continue
+                    if not streamed:
+                        streamed = True
+                        working_model = model
+                        await model_router.record_success(endpoint, time.monotonic() - start)
+                    yield text
+            
+            if streamed:
+                if finish_reason is None:
+                    raise GeminiStreamInterrupted(f"{model} stream ended without a finish reason")
+                print(f"✅ Streamed from {model} ({api_version})")
+                return
+            model_router.observe(endpoint, "empty", time.monotonic() - start)
+        
+        except GeminiStreamInterrupted:
+            raise
+        except Exception as e:
+            print(f"💥 {model} ({api_version}) Stream error: {str(e)[:50]}")
+            if streamed:
+                raise GeminiStreamInterrupted(f"{model} stream failed: {str(e)[:100]}") from e
+            await model_router.record_failure(endpoint, "exception", time.monotonic() - start, str(e)[:100])
+            failed_models.add(model)
+
+
+async def probe_gemini_endpoint(endpoint) -> Optional[bool]:
+    """Cheap model-metadata lookup used by the router's background probe"""
+    model, api_version = endpoint
+    client = http_clients.get("gemini")
+    response = await client.get(f"{GEMINI_BASE_URL}/{api_version}/models/{model}?key={GEMINI_API_KEY}")
+    if response.status_code == 200:
+        return True
+    if response.status_code == 404:
+        return False
+    return None # Quota/transient errors are left to live traffic
+
+
+# ============================================
+# MODEL TRAINING (off the request path)
+# ============================================
+
+async def retrain_irrigation_model(columns: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """
+    Fit the irrigation model in the forecast pool and swap it in. Default
+    data: hourly rollups over the last HISTORY_TRAIN_DAYS of the history
+    store (read by the pool worker straight from disk), or every device
+    window without one
+    """
+    if columns is None and history_store is not None and history_store.devices():
+        # The model predicts the hourly moisture change, so it fits on hourly means
+        columns = await asyncio.to_thread(
+            history_store.reference, start=time.time() - HISTORY_TRAIN_DAYS * 86400,
+            fields=('moisture', 'temperature', 'humidity'), resolution="hourly"
+        )
+    elif columns is None:
+        columns = device_states.training_columns()
+        if len(columns["timestamp"]) == 0:
+            return None
+    try:
+        result = await forecast_pool.run("train:irrigation", train_irrigation_model, IRRIGATION_MODEL_PATH, columns)
+    except Exception as e:
+        print(f"⚠️ Irrigation model training failed: {e}")
+        return None
+    if result.get("trained") and irrigation_model.load_model(IRRIGATION_MODEL_PATH):
+        print(f"✅ Irrigation model retrained on {result['n_samples']} intervals (rmse {result['rmse']})")
+    return result
+
+
+async def irrigation_retrain_loop(interval: float):
+    """
+    Background task: periodically refit the irrigation model on the ingested
+    windows. With several workers only the one that takes the shared lease
+    retrains; the others reload IRRIGATION_MODEL_PATH on their own passes
+    """
+    while True:
+        await asyncio.sleep(interval)
+        if await shared_store.acompare_and_set("train:irrigation:lease", None, str(os.getpid()), ttl=interval * 0.9):
+            await retrain_irrigation_model()
+        elif irrigation_model.load_model(IRRIGATION_MODEL_PATH):
+            print("✅ Reloaded irrigation model trained by another worker")
+
+
+async def history_flush_loop(interval: float):
+    """Background task: write open history chunks so restarts and other workers see recent readings"""
+    while True:
+        await asyncio.sleep(interval)
+        await asyncio.to_thread(history_store.flush)
+
+
+async def fertilizer_save_loop(interval: float):
+    """
+    Background task: persist the NPK depletion table when it has changed, so
+    a crash loses at most one interval. Each worker learns from the readings
+    it receives; saving merges with the table on disk, under a short shared
+    lock so workers don't read and overwrite it at the same time
+    """
+    while True:
+        await asyncio.sleep(interval)
+        if not fertilizer_model.unsaved:
+            continue
+        owner = str(os.getpid())
+        if not await shared_store.acompare_and_set("fertilizer:save:lock", None, owner, ttl=60):
+            continue  # another worker is saving - merge on the next pass
+        try:
+            fertilizer_model.save_model(FERTILIZER_TABLE_PATH)
+        except OSError as e:
+            print(f"⚠️ Could not save NPK depletion table: {e}")
+        finally:
+            await shared_store.acompare_and_set("fertilizer:save:lock", owner, None)
+
+
+async def prefetch_weather(interval: float):
+    """
+    One prefetch pass: refetch the backend forecast and every known Open-Meteo
+    cell that could be past its TTL before the pass after next (staggered bulk requests)
+    """
+    age = await weather_cache.age("backend")
+    if age is None or age + 2 * interval >= weather_cache.ttl:
+        await weather_cache.prefetch("backend", _fetch_backend_weather)
+    await weather_service.prefetch(interval)
+
+
+async def weather_prefetch_loop(interval: float):
+    """
+    Background task: keep forecasts warm so request handlers read them from
+    the cache instead of waiting on the upstream. With several workers only
+    the one that takes the shared lease fetches; the others adopt its results
+    from the shared store
+    """
+    while True:
+        started = time.monotonic()
+        if await shared_store.acompare_and_set("weather:prefetch:lease", None, str(os.getpid()), ttl=interval * 0.9):
+            try:
+                await prefetch_weather(interval)
+            except Exception as e:
+                print(f"⚠️ Weather prefetch failed: {e}")
+        await asyncio.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+
 # ============================================
 # FASTAPI APP SETUP
 # ============================================
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    probe_task = None
+    if has_gemini:
+        probe_task = asyncio.create_task(
+            model_router.probe_loop(probe_gemini_endpoint, float(os.getenv("GEMINI_PROBE_INTERVAL", 60)))
+        )
+    retrain_task = None
+    retrain_interval = float(os.getenv("IRRIGATION_RETRAIN_INTERVAL", 21600))
+    if retrain_interval > 0:
+        retrain_task = asyncio.create_task(irrigation_retrain_loop(retrain_interval))
+    fertilizer_save_task = None
+    fertilizer_save_interval = float(os.getenv("FERTILIZER_SAVE_INTERVAL", 300))
+    if fertilizer_save_interval > 0:
+        fertilizer_save_task = asyncio.create_task(fertilizer_save_loop(fertilizer_save_interval))
+    prefetch_task = None
+    prefetch_interval = float(os.getenv("WEATHER_PREFETCH_INTERVAL", 600))
+    if prefetch_interval > 0:
+        prefetch_task = asyncio.create_task(weather_prefetch_loop(prefetch_interval))
+    flush_task = None
+    if history_store is not None:
+        flush_task = asyncio.create_task(history_flush_loop(float(os.getenv("HISTORY_FLUSH_INTERVAL", 30))))
+    yield
+    if probe_task:
+        probe_task.cancel()
+    if retrain_task:
+        retrain_task.cancel()
+    if prefetch_task:
+        prefetch_task.cancel()
+    if fertilizer_save_task:
+        fertilizer_save_task.cancel()
+    if flush_task:
+        flush_task.cancel()
+    if history_store is not None:
+        history_store.close()
+    chat_cache.save()
+    shared_store.close()
+    if fertilizer_model.unsaved:
+        fertilizer_model.save_model(FERTILIZER_TABLE_PATH)
+    forecast_pool.shutdown()
+    # Release pooled upstream connections on shutdown
+    await http_clients.aclose()
+
+
 app = FastAPI(
     title="Smart Agriculture AI Service",
     description="AI/ML service for predictive agriculture",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 app.add_middleware(
@@ -160,15 +474,111 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+MODEL_DIR = os.getenv("MODEL_DIR", "./models/trained")
+IRRIGATION_MODEL_PATH = os.path.join(MODEL_DIR, "irrigation.json")
+FERTILIZER_TABLE_PATH = os.path.join(MODEL_DIR, "npk_depletion.npz")
+
 # Initialize models
 irrigation_model = IrrigationPredictor()
-fertilizer_model = FertilizerPredictor()
-zone_optimizer = ZoneOptimizer()
+if irrigation_model.load_model(IRRIGATION_MODEL_PATH):
+    print(f"✅ Loaded irrigation model ({irrigation_model.model['n_samples']} samples)")
+fertilizer_model = FertilizerPredictor(half_life_days=float(os.getenv("FERTILIZER_HALF_LIFE_DAYS", 14)))
+if fertilizer_model.load_model(FERTILIZER_TABLE_PATH):
+    print(f"✅ Loaded NPK depletion table ({len(fertilizer_model.table)} zones)")
+zone_optimizer = ZoneOptimizer(
+    water_budget=float(os.getenv("ZONE_WATER_BUDGET", 1000)),
+    default_flow_rate=float(os.getenv("PUMP_FLOW_RATE", 5)),
+    window_minutes=float(os.getenv("IRRIGATION_WINDOW_MINUTES", 120))
+)
+pump_scheduler = PumpScheduler(
+    max_concurrent=int(os.getenv("MAX_CONCURRENT_PUMPS", 2)),
+    window_start=os.getenv("IRRIGATION_WINDOW_START", "06:00"),
+    window_minutes=float(os.getenv("IRRIGATION_WINDOW_MINUTES", 120))
+)
 data_processor = SensorDataProcessor()
+# Open-Meteo forecasts per grid cell, shared across zones, requests and workers;
+# the last good one per cell is kept under WEATHER_FORECAST_DIR for restarts and outages.
+# WEATHER_LOCATIONS ("lat,lon;lat,lon") are prefetched from startup, along with up to WEATHER_MAX_CELLS
+# cells requested within the last WEATHER_CELL_IDLE_HOURS
+weather_service = WeatherService(
+    cache=WeatherCache(
+        ttl_seconds=float(os.getenv("OPEN_METEO_CACHE_TTL", 3600)),
+        stale_seconds=float(os.getenv("WEATHER_CACHE_STALE", 3600)),
+        shared=shared_store
+    ),
+    grid_degrees=float(os.getenv("WEATHER_GRID_DEGREES", 0.05)),
+    forecast_dir=os.getenv("WEATHER_FORECAST_DIR", "./data/weather") or None,
+    bulk_size=int(os.getenv("WEATHER_BULK_SIZE", 100)),
+    locations=parse_locations(os.getenv("WEATHER_LOCATIONS", "11.5564,104.9282")),
+    max_cells=int(os.getenv("WEATHER_MAX_CELLS", 2000)),
+    idle_seconds=float(os.getenv("WEATHER_CELL_IDLE_HOURS", 72)) * 3600
+)
+
+# Fitted Prophet models per zone, persisted under MODEL_DIR and loaded lazily
+prophet_registry = ProphetModelRegistry(
+    MODEL_DIR,
+    min_new_points=int(os.getenv("PROPHET_MIN_NEW_POINTS", 48)),
+    max_age_hours=float(os.getenv("PROPHET_MAX_AGE_HOURS", 24))
+)
+# Prophet fitting/prediction runs in worker processes, off the event loop
+forecast_pool = ForecastPool(
+    workers=int(os.getenv("FORECAST_POOL_WORKERS", 0)) or None,
+    max_queue=int(os.getenv("FORECAST_POOL_MAX_QUEUE", 8))
+)
+moisture_predictor = WeatherAwareMoisturePredictor(weather_service, prophet_registry, forecast_pool)
 
-# Track active pump cycles to prevent alert spamming
-# Structure: { device_id: { "fertilizer_end": datetime, "water_end": datetime } }
-device_pump_states = {}
+# Track active pump cycles to prevent alert spamming; shared by all workers
+# unless SHARED_STATE_URL is memory:// (keys: pump:<device_id>:<fertilizer|water>)
+pump_states = PumpStateStore(shared_store)
+
+# Backend forecast changes hourly at most - share one copy across requests and workers
+weather_cache = WeatherCache(
+    ttl_seconds=float(os.getenv("WEATHER_CACHE_TTL", 900)),
+    stale_seconds=float(os.getenv("WEATHER_CACHE_STALE", 3600)),
+    shared=shared_store
+)
+
+# Seconds to wait for Gemini's first streamed token before using the rule-based answer
+CHAT_FIRST_TOKEN_DEADLINE = float(os.getenv("CHAT_FIRST_TOKEN_DEADLINE", 6))
+
+# Chatbot answers keyed on normalized question + bucketed readings (served before Gemini)
+chat_cache = ResponseCache(
+    max_entries=int(os.getenv("CHAT_CACHE_MAX_ENTRIES", 500)),
+    ttl_seconds=float(os.getenv("CHAT_CACHE_TTL", 6 * 3600)),
+    path=os.getenv("CHAT_CACHE_PATH") or None
+)
+
+# Rolling window of recent readings per device, fed by the interpret and ingest endpoints;
+# each window also tracks the device's observed drying rate
+device_states = DeviceStateStore(
+    window_size=int(os.getenv("DEVICE_WINDOW_SIZE", 1440)),
+    max_devices=int(os.getenv("DEVICE_MAX_TRACKED", 5000)),
+    drying_half_life_hours=float(os.getenv("DRYING_RATE_HALF_LIFE_HOURS", 6))
+)
+
+# Every ingested reading, appended to per-device columnar chunks under HISTORY_DIR
+# (empty = rolling windows only); forecasts and irrigation training read it memory-mapped
+HISTORY_DIR = os.getenv("HISTORY_DIR", "./data/history")
+history_store = SensorHistoryStore(HISTORY_DIR, chunk_rows=int(os.getenv("HISTORY_CHUNK_ROWS", 4096))) if HISTORY_DIR else None
+HISTORY_TRAIN_DAYS = float(os.getenv("HISTORY_TRAIN_DAYS", 90))
+# Upper bound on rows returned by /api/ai/devices/{id}/history
+HISTORY_QUERY_MAX_ROWS = int(os.getenv("HISTORY_QUERY_MAX_ROWS", 100000))
+
+# Interpretation thresholds/alerts as a per-crop rule table, compiled at startup and
+# recompiled when the file changes (checked every RULES_RELOAD_INTERVAL seconds, 0 = never)
+rule_engine = RuleEngine(
+    os.getenv("RULES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules", "interpret_rules.json")),
+    reload_interval=float(os.getenv("RULES_RELOAD_INTERVAL", 5))
+)
+
+# Upper bound on zones accepted by /api/ai/predict/batch
+PREDICT_BATCH_MAX = int(os.getenv("PREDICT_BATCH_MAX", 1000))
+
+# Upper bound on readings accepted by /api/ai/interpret/batch
+INTERPRET_BATCH_MAX = int(os.getenv("INTERPRET_BATCH_MAX", 500))
+
+# Sensor fields consumed by the SensorDataProcessor scores
+SCORED_FIELDS = ('moisture', 'temperature', 'humidity', 'pH', 'nitrogen', 'phosphorus', 'potassium', 'lightIntensity')
 
 # ============================================
 # PYDANTIC MODELS
@@ -209,6 +619,8 @@ class SensorData(BaseModel):
 class InterpretRequest(BaseModel):
     deviceId: str
     sensorData: Dict[str, Any] # Use dict to allow the custom validation above
+    timestamp: Optional[Any] = None # Epoch seconds/ms or ISO string; defaults to now
+    crop: Optional[str] = None # Rule table crop; defaults to the table's default_crop
 
 class InterpretResponse(BaseModel):
     soilHealth: str
@@ -220,14 +632,60 @@ class InterpretResponse(BaseModel):
     action: Optional[Dict[str, Any]] = None # Deprecated: use actions instead
     actions: List[Dict[str, Any]] = [] # Support for simultaneous actions
 
+class BatchInterpretRequest(BaseModel):
+    readings: List[Any] # Validated per item so one bad reading can't fail the batch
+
+class BatchInterpretItem(BaseModel):
+    index: int
+    deviceId: Optional[str] = None
+    result: Optional[InterpretResponse] = None
+    error: Optional[str] = None
+
+class BatchInterpretResponse(BaseModel):
+    results: List[BatchInterpretItem]
+    succeeded: int
+    failed: int
+    weatherAvailable: bool
+
 class IrrigationPredictionRequest(BaseModel):
     zoneId: str
     days: int = 7
 
+class IrrigationTrainingRequest(BaseModel):
+    # [{"zoneId", "timestamp", "moisture", "temperature", "humidity", "irrigation_events"}]
+    history: List[Dict[str, Any]] = []
+
 class FertilizerPredictionRequest(BaseModel):
     zoneId: str
     days: int = 14
 
+class BatchPredictionRequest(BaseModel):
+    zoneIds: List[str]
+    irrigationDays: int = 7
+    fertilizerDays: int = 14
+    include: List[str] = ["irrigation", "fertilizer"]
+
+class MoisturePredictionRequest(BaseModel):
+    zoneId: str
+    sensorHistory: List[Dict[str, Any]] = [] # [{"timestamp": ..., "moisture": ...}]
+    deviceId: Optional[str] = None # Use this device's ingested window when sensorHistory is empty
+    lat: float = 11.5564 # Phnom Penh
+    lon: float = 104.9282
+    days: int = 7
+    resolution: Optional[str] = None # Stored history to train on: raw | hourly | daily (default: by horizon)
+
+class ZoneOptimizationRequest(BaseModel):
+    zones: List[Dict[str, Any]]
+    waterBudget: Optional[float] = None # Liters; defaults to ZONE_WATER_BUDGET
+    pumps: Dict[str, Dict[str, Any]] = {} # {pumpId: {"flowRate": L/min}}
+    windowMinutes: Optional[float] = None # Run time per pump; defaults to IRRIGATION_WINDOW_MINUTES
+
+class PumpScheduleRequest(ZoneOptimizationRequest):
+    # pumps may also carry {"circuit": name} to share a power circuit
+    circuits: Dict[str, Dict[str, Any]] = {} # {name: {"maxConcurrent": n}}
+    maxConcurrent: Optional[int] = None # Pumps running at once; defaults to MAX_CONCURRENT_PUMPS
+    windowStart: Optional[str] = None # "HH:MM"; defaults to IRRIGATION_WINDOW_START
+
 class ChatRequest(BaseModel):
     message: str
     context: Optional[Dict[str, Any]] = None
@@ -249,14 +707,29 @@ async def root():
 
 @app.get("/api/health")
 async def health_check():
+    await model_router.sync()
     return {
         "status": "healthy",
         "gemini": {
             "configured": has_gemini,
-            "working_model": working_model,
+            "working_model": model_router.sticky[0] if model_router.sticky else working_model,
             "last_error": last_gemini_error,
-            "quota_reset": quota_reset_time.isoformat() if quota_reset_time else None
+            "quota_reset_in": await quota_wait_seconds(),
+            "router": model_router.stats()
         },
+        "weather_cache": weather_cache.stats(),
+        "open_meteo": weather_service.stats(),
+        "http_clients": http_clients.stats(),
+        "chat_cache": chat_cache.stats(),
+        "prophet_models": prophet_registry.stats(),
+        "forecast_pool": forecast_pool.stats(),
+        "device_states": device_states.stats(),
+        "history": history_store.stats() if history_store is not None else None,
+        "irrigation_model": irrigation_model.stats(),
+        "fertilizer_model": fertilizer_model.stats(),
+        "pump_states": await shared_store.run(pump_states.stats),
+        "shared_state": {**await shared_store.run(shared_store.stats), "pid": os.getpid()},
+        "rules": rule_engine.stats(),
         "timestamp": datetime.now().isoformat()
     }
 
@@ -265,39 +738,127 @@ async def health_check():
 # SENSOR INTERPRETATION ENDPOINT
 # ============================================
 
+async def fetch_weather_forecast() -> Optional[List[Dict[str, Any]]]:
+    """Daily forecast from the Node backend, served from the shared weather cache (kept warm by weather_prefetch_loop)"""
+    return await weather_cache.get("backend", _fetch_backend_weather)
+
+
+async def _fetch_backend_weather() -> Optional[List[Dict[str, Any]]]:
+    """Fetch the daily forecast from the Node backend (None if unavailable)"""
+    try:
+        backend_url = os.getenv("NODE_BACKEND_URL") or os.getenv("BACKEND_URL", "http://localhost:5000")
+        # Ensure https:// prefix
+        if backend_url and not backend_url.startswith("http"):
+            backend_url = f"https://{backend_url}"
+        client = http_clients.get("backend")
+        weather_response = await client.get(f"{backend_url}/api/weather")
+        if weather_response.status_code == 200:
+            weather_data = weather_response.json()
+            return weather_data.get('forecast', [])
+    except Exception as e:
+        print(f"⚠️ Weather API unavailable: {e}")
+    return None
+
+
+def get_rain_probability(weather_forecast: Optional[List[Dict[str, Any]]]) -> float:
+    """Tomorrow's rain probability (%) from the backend forecast"""
+    if weather_forecast and len(weather_forecast) > 0:
+        tomorrow = weather_forecast[0]
+        return tomorrow.get('rainProbability', 0)
+    return 0
+
+
+async def build_interpretation(
+    device_id: str,
+    sensor_data: Dict[str, Any],
+    soil_health: str,
+    stress_level: float,
+    moisture_loss_rate: float,
+    tomorrow_rain_probability: float,
+    crop: Optional[str] = None
+) -> InterpretResponse:
+    """Apply the threshold rules (rules/interpret_rules.json) to one cleaned reading"""
+    # Pump checks hit the shared store, which may block (SQLite/Redis)
+    decision = await shared_store.run(
+        rule_engine.evaluate, device_id, sensor_data, stress_level, tomorrow_rain_probability,
+        crop=crop, pumps=pump_states
+    )
+    return interpretation_response(decision, soil_health, stress_level, moisture_loss_rate, tomorrow_rain_probability)
+
+
+def interpretation_response(
+    decision: Dict[str, Any],
+    soil_health: str,
+    stress_level: float,
+    moisture_loss_rate: float,
+    tomorrow_rain_probability: float
+) -> InterpretResponse:
+    """Wrap a rule engine decision with the recommendation text"""
+    alerts = decision["alerts"]
+    actions = decision["actions"]
+    recommendation = data_processor.generate_recommendation(
+        soil_health=soil_health,
+        stress_level=stress_level,
+        alerts=alerts
+    )
+    
+    # Add weather context to recommendation
+    if decision["facts"].get("skip_irrigation"):
+        recommendation += f"\n\n🌧️ AI detected {tomorrow_rain_probability}% rain probability tomorrow and optimized water usage accordingly."
+    
+    return InterpretResponse(
+        soilHealth=soil_health,
+        stressLevel=stress_level,
+        moistureLossRate=moisture_loss_rate,
+        recommendation=recommendation,
+        alerts=alerts,
+        recommendAction=decision["recommend_action"],
+        action=actions[0] if actions else None, # Backwards compatibility
+        actions=actions
+    )
+
+
+def record_reading(device_id: str, sensor_data: Dict[str, Any], timestamp: Any = None):
+    """
+    Append a reading to the device's rolling window and on-disk history and
+    fold its NPK values into the depletion table (non-numeric values count as missing)
+    """
+    numeric = {k: v for k, v in sensor_data.items() if isinstance(v, (int, float))}
+    epoch = to_epoch(timestamp)
+    device_states.append(device_id, numeric, epoch)
+    if history_store is not None and history_store.append(device_id, numeric, epoch):
+        # A chunk's worth of unsaved readings: write them out now, off the event loop
+        asyncio.get_running_loop().run_in_executor(None, history_store.flush, device_id)
+    fertilizer_model.update(device_id, epoch, numeric)
+
+
+def observed_loss_rate(device_id: str, estimated: float) -> float:
+    """Drying rate measured from the device's own readings, else the weather-based estimate"""
+    observed = device_states.loss_rate(device_id)
+    return estimated if observed is None else observed
+
+
 @app.post("/api/ai/interpret", response_model=InterpretResponse)
 async def interpret_sensor_data(request: InterpretRequest):
     """Real-time interpretation of sensor data with weather-aware irrigation"""
+    try:
+        timestamp = to_epoch(request.timestamp)
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=422, detail=f"Invalid timestamp {request.timestamp!r}: {e}")
     try:
         # CLEAN AND VALIDATE DATA
         clean_data = SensorData.model_validate(request.sensorData)
         sensor_data = clean_data.model_dump()
         device_id = request.deviceId
+        record_reading(device_id, sensor_data, timestamp)
         
         # ============================================
         # FETCH WEATHER FORECAST
         # ============================================
-        weather_forecast = None
-        tomorrow_rain_probability = 0
-        
-        try:
-            backend_url = os.getenv("NODE_BACKEND_URL") or os.getenv("BACKEND_URL", "http://localhost:5000")
-            # Ensure https:// prefix
-            if backend_url and not backend_url.startswith("http"):
-                backend_url = f"https://{backend_url}"
-            async with httpx.AsyncClient() as client:
-                weather_response = await client.get(f"{backend_url}/api/weather", timeout=5.0)
-                if weather_response.status_code == 200:
-                    weather_data = weather_response.json()
-                    weather_forecast = weather_data.get('forecast', [])
-                    
-                    # Get tomorrow's rain probability
-                    if weather_forecast and len(weather_forecast) > 0:
-                        tomorrow = weather_forecast[0]
-                        tomorrow_rain_probability = tomorrow.get('rainProbability', 0)
-                        print(f"🌦️ Weather Check: Tomorrow's rain probability = {tomorrow_rain_probability}%")
-        except Exception as e:
-            print(f"⚠️ Weather API unavailable: {e}")
+        weather_forecast = await fetch_weather_forecast()
+        tomorrow_rain_probability = get_rain_probability(weather_forecast)
+        if weather_forecast:
+            print(f"🌦️ Weather Check: Tomorrow's rain probability = {tomorrow_rain_probability}%")
         
         # ============================================
         # SENSOR DATA ANALYSIS
@@ -316,224 +877,316 @@ async def interpret_sensor_data(request: InterpretRequest):
             humidity=sensor_data.get('humidity')
         )
         
-        moisture_loss_rate = data_processor.estimate_moisture_loss_rate(
+        moisture_loss_rate = observed_loss_rate(device_id, data_processor.estimate_moisture_loss_rate(
             temperature=sensor_data.get('temperature'),
             humidity=sensor_data.get('humidity'),
             light_intensity=sensor_data.get('lightIntensity')
-        )
-        
-        alerts = []
-        recommend_action = False
-        actions = []
+        ))
         
-        # ============================================
-        # MOISTURE THRESHOLDS WITH WEATHER INTELLIGENCE
-        # ============================================
-        moisture = sensor_data.get('moisture', 100)
-        rain_detected = sensor_data.get('rain', 0) > 20  # Current rain from sensor
-        
-        # Check if we should skip irrigation due to rain forecast OR current rain
-        skip_irrigation_due_to_rain = tomorrow_rain_probability > 50 or rain_detected
-        
-        # 🌧️ IMMEDIATE RAIN ALERT (New)
-        if rain_detected:
-            # Check intensity (simple logic: > 80% is heavy rain)
-            is_heavy_rain = sensor_data.get('rain', 0) > 80
-            
-            alerts.append({
-                "severity": "WARNING",
-                "type": "WEATHER_ALERT",
-                "title": "⛈ ភ្លៀងកម្រិតខ្លាំង" if is_heavy_rain else "🌧 មេឃកំពុងភ្លៀងហើយ ម៉ូទ័រត្រូវបានបិទ",
-                "message": "ការស្រោចទឹក និងការផ្គត់ផ្គង់ជីត្រូវបានផ្អាកជាបណ្តោះអាសន្ន ដើម្បីការពារសុខភាពដំណាំ។" if is_heavy_rain else "ប្រព័ន្ធបានបញ្ឈប់ម៉ូទ័របូមទឹក និងម៉ូទ័របូមជី ដើម្បីជៀសវាងការស្រោចទឹកលើសកម្រិត។"
-            })
-        
-        if moisture < 50 or stress_level > 80:
-            # Critical situation - needs immediate action
-            if skip_irrigation_due_to_rain:
-                # Rain detected or expected - add info alert instead of triggering pump
-                alerts.append({
-                    "severity": "INFO",
-                    "type": "WEATHER_ALERT",
-                    "title": "⚠️ សំណើមដីខ្ពស់ (ដោយសារភ្លៀង)",
-                    "message": "ប្រព័ន្ធបានបញ្ឈប់ម៉ូទ័របូមទឹក ដើម្បីជៀសវាងការស្រោចទឹកលើសកម្រិត។"
-                })
-                recommend_action = False
-                # If it was already pumping, send STOP command
-                action = {"type": "irrigation", "deviceId": device_id, "command": {"type": "WATER", "status": "OFF", "duration": 0, "reason": "RAIN_DETECTED"}}
-            else:
-                # No rain expected - trigger irrigation
-                alerts.append({
-                    "severity": "CRITICAL",
-                    "type": "MOISTURE_CRITICAL",
-                    "title": "💧 សំណើមដីទាបខ្លាំង",
-                    "message": "សាឡាត់មានឫសរាក់ មិនអាចទ្រាំទ្រដីស្ងួតបានទេ។ បើកម៉ូទ័រទឹកជាបន្ទាន់។"
-                })
-                recommend_action = True
-                actions.append({"type": "irrigation", "deviceId": device_id, "command": {"type": "WATER", "status": "ON", "duration": 420}})
-                
-        elif moisture < 60:
-            if skip_irrigation_due_to_rain:
-                alerts.append({
-                    "severity": "INFO",
-                    "type": "WEATHER_ALERT",
-                    "title": "⚠️ សំណើមដីខ្ពស់ (ដោយសារភ្លៀង)",
-                    "message": "ប្រព័ន្ធបានបញ្ឈប់ម៉ូទ័របូមទឹក ដើម្បីជៀសវាងការស្រោចទឹកលើសកម្រិត។"
-                })
-            else:
-                alerts.append({
-                    "severity": "WARNING",
-                    "type": "MOISTURE_LOW",
-                    "title": "💧 សំណើមដីទាប",
-                    "message": "សំណើមដី ( < 60%) ទាបជាងស្តង់ដារ។ ប្រព័ន្ធនឹងបូមទឹកឆាប់ៗនេះ។"
-                })
-        else:
-             # Moisture OK or High
-             if moisture > 80:
-                 alerts.append({
-                    "severity": "INFO",
-                    "type": "SYSTEM_INFO",
-                    "title": "⚠️ សំណើមដីខ្ពស់ (Active Interrupt)",
-                    "message": "ប្រព័ន្ធបានបញ្ឈប់ម៉ូទ័របូមទឹកភ្លាមៗ ដើម្បីជៀសវាងការជោកជាំ (Moisture > 80%)។"
-                })
-                 # SAFETY INTERRUPT: Force Water Pump OFF immediately
-                 actions.append({"type": "irrigation", "deviceId": device_id, "command": {"type": "WATER", "status": "OFF", "duration": 0}})
-
-        # Add weather info to alerts if rain is expected
-        if tomorrow_rain_probability > 30 and not rain_detected:
-            alerts.append({
-                "severity": "INFO",
-                "type": "WEATHER_ALERT",
-                "title": f"🌧️ ការព្យាករណ៍ភ្លៀង៖ {tomorrow_rain_probability}%",
-                "message": f"រំពឹងថានឹងមានការស្រោចស្រពតាមធម្មជាតិនៅថ្ងៃស្អែក។ AI នឹងបង្កើនប្រសិទ្ធភាពការប្រើប្រាស់ទឹក។"
-            })
-        
-        # ============================================
-        # NUTRIENT THRESHOLDS
-        # ============================================
-        # Prototype Mode: Allow fertilizer even if moisture is low -> Simultaneous Pumping
-        can_fertilize = True # Enable "Combo Mode" for demo
-        # Note: In real parallel mode, we can send multiple commands, but here we prioritize telling user about both.
-        
-        # STANDALONE NPK CHECKS REMOVED - Integrated into main logic below to prevent duplicate alerts
-        
-        # pH THRESHOLDS: 6.0 - 6.8
-        if sensor_data.get('pH'):
-            if sensor_data['pH'] < 6.0 or sensor_data['pH'] > 6.8:
-                alerts.append({
-                    "severity": "WARNING",
-                    "type": "PH_WARNING",
-                    "title": "⚠️ បញ្ហា pH ដី",
-                    "message": f"pH ដីគឺ {sensor_data['pH']}។ សាឡាត់ត្រូវការ pH ៦.០-៦.៨។"
-                })
-        
-        # EC THRESHOLDS: 1.2 - 1.6 dS/m (1200-1600 µS/cm)
-        if sensor_data.get('ec'):
-            # NEW INTELLIGENCE: Trigger if overall EC is low OR any specific nutrient is low
-            is_n_low = sensor_data.get('nitrogen', 100) < 30
-            is_p_low = sensor_data.get('phosphorus', 100) < 15
-            is_k_low = sensor_data.get('potassium', 100) < 80
-            is_ec_low = sensor_data['ec'] < 1200
-
-            if is_ec_low or is_n_low or is_p_low or is_k_low:
-                if can_fertilize:
-                    # Check for current rain OR heavy rain forecast
-                    if rain_detected:
-                        alerts.append({
-                             "severity": "INFO", # Reduced severity cause rain handled it
-                             "type": "NPK_LOW",
-                             "title": "🌱 រកឃើញកម្រិតជីទាប",
-                             "message": "ប៉ុន្តែភ្លៀងកំពុងធ្លាក់។ ការដាក់ជីត្រូវបានផ្អាក។"
-                        })
-                        # Send STOP command if it was active
-                        actions.append({"type": "fertilizer", "deviceId": device_id, "command": {"type": "FERTILIZER", "status": "OFF", "duration": 0}})
-                        recommend_action = False
-                    elif tomorrow_rain_probability >= 70:
-                        alerts.append({
-                             "severity": "INFO",
-                             "type": "NPK_LOW",
-                             "title": "🌱 រកឃើញកម្រិតជីទាប",
-                             "message": f"ប៉ុន្តែមានភ្លៀងខ្លាំងនៅថ្ងៃស្អែក ({tomorrow_rain_probability}%)។ ការដាក់ជីត្រូវបានពន្យារពេល។"
-                        })
-                    else:
-                        # Check if fertilizer pump is already running/in cooldown
-                        current_time = datetime.now()
-                        device_state = device_pump_states.get(device_id, {})
-                        fert_end = device_state.get("fertilizer_end")
-                        
-                        is_pumping = fert_end and current_time < fert_end
-                        
-                        if is_pumping:
-                            # Pump is already running, suppress duplicate alerts
-                            pass
-                        else:
-                            # Pump not running, generate NEW Alert + Action
-                            
-                            # IDENTIFY SPECIFIC DEFICIENCIES
-                            deficiencies = []
-                            if sensor_data.get('nitrogen', 0) < 30: deficiencies.append(f"Nitrogen ({sensor_data.get('nitrogen')} mg/kg < 30)")
-                            if sensor_data.get('phosphorus', 0) < 15: deficiencies.append(f"Phosphorus ({sensor_data.get('phosphorus')} mg/kg < 15)")
-                            if sensor_data.get('potassium', 0) < 80: deficiencies.append(f"Potassium ({sensor_data.get('potassium')} mg/kg < 80)")
-                            
-                            deficiency_str = ", ".join(deficiencies) if deficiencies else "General Low EC"
-                            current_time_str = current_time.strftime("%I:%M %p")
-                            
-                            alerts.append({
-                                "severity": "WARNING",
-                                "type": "NPK_LOW",
-                                "title": f"🌱 កង្វះសារធាតុ ({deficiency_str}) ➔ ម៉ូទ័រកំពុងស្រោចជី...",
-                                "message": f"[{current_time_str}] រកឃើញ៖ {deficiency_str}។ ប្រព័ន្ធបាន **បើកម៉ូទ័របូមជី (Fertilizer Pump ON)** ដើម្បីផ្គត់ផ្គង់សារធាតុចិញ្ចឹម។"
-                            })
-                            recommend_action = True
-                            duration = 180 # 3 minutes
-                            actions.append({"type": "fertilizer", "deviceId": device_id, "command": {"type": "FERTILIZER", "status": "ON", "duration": duration}})
-                            
-                            # Update Pump State
-                            if device_id not in device_pump_states:
-                                device_pump_states[device_id] = {}
-                            device_pump_states[device_id]["fertilizer_end"] = current_time + timedelta(seconds=duration)
-
-                else:
-                    # If dry, add warning alert but don't trigger pump (water takes priority)
-                    alerts.append({
-                        "severity": "INFO",
-                        "type": "NPK_LOW",
-                        "title": "🌱 រកឃើញកម្រិតជីទាប",
-                        "message": "ត្រូវការស្រោចទឹកជាមុនសិន។"
-                    })
-            elif sensor_data['ec'] > 2000:
-                 alerts.append({
-                    "severity": "CRITICAL",
-                    "type": "PH_WARNING",
-                    "title": "⚠️ កម្រិតជាតិប្រៃក្នុងដីខ្ពស់ (Active Interrupt)",
-                    "message": f"EC គឺ {sensor_data['ec']} µS/cm។ ប្រព័ន្ធបានបិទម៉ូទ័របូមជីភ្លាមៗ។"
-                })
-                 # SAFETY INTERRUPT: Force Fertilizer Pump OFF immediately
-                 actions.append({"type": "fertilizer", "deviceId": device_id, "command": {"type": "FERTILIZER", "status": "OFF", "duration": 0}})
-        
-        recommendation = data_processor.generate_recommendation(
-            soil_health=soil_health,
-            stress_level=stress_level,
-            alerts=alerts
-        )
-        
-        # Add weather context to recommendation
-        if skip_irrigation_due_to_rain:
-            recommendation += f"\n\n🌧️ AI detected {tomorrow_rain_probability}% rain probability tomorrow and optimized water usage accordingly."
-        
-        return InterpretResponse(
-            soilHealth=soil_health,
-            stressLevel=stress_level,
-            moistureLossRate=moisture_loss_rate,
-            recommendation=recommendation,
-            alerts=alerts,
-            recommendAction=recommend_action,
-            action=actions[0] if actions else None, # Backwards compatibility
-            actions=actions
+        return await build_interpretation(
+            device_id, sensor_data, soil_health, stress_level,
+            moisture_loss_rate, tomorrow_rain_probability, crop=request.crop
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/ai/interpret/batch", response_model=BatchInterpretResponse)
+async def interpret_sensor_batch(request: BatchInterpretRequest):
+    """
+    Interpret many device readings in one call
+    Weather is fetched once per batch and scoring runs vectorized;
+    a bad reading is reported in its own slot instead of failing the batch
+    """
+    if len(request.readings) > INTERPRET_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Batch too large (max {INTERPRET_BATCH_MAX} readings)")
+    
+    weather_forecast = await fetch_weather_forecast()
+    tomorrow_rain_probability = get_rain_probability(weather_forecast)
+    
+    results: List[BatchInterpretItem] = []
+    valid: List[tuple] = []  # (slot, device_id, sensor_data, crop)
+    
+    for index, item in enumerate(request.readings):
+        device_id = item.get('deviceId') if isinstance(item, dict) else None
+        results.append(BatchInterpretItem(index=index, deviceId=device_id))
+        try:
+            reading = InterpretRequest.model_validate(item)
+            sensor_data = SensorData.model_validate(reading.sensorData).model_dump()
+            for key in SCORED_FIELDS:
+                value = sensor_data.get(key)
+                if value is not None and not isinstance(value, (int, float)):
+                    raise ValueError(f"{key} must be numeric")
+            record_reading(reading.deviceId, sensor_data, reading.timestamp)
+            valid.append((index, reading.deviceId, sensor_data, reading.crop))
+        except Exception as e:
+            results[index].error = str(e)
+    
+    scores = data_processor.score_batch([sensor_data for _, _, sensor_data, _ in valid])
+    decisions = await shared_store.run(rule_engine.evaluate_batch, [
+        {"deviceId": device_id, "sensorData": sensor_data, "crop": crop,
+         "stressLevel": stress_level, "rainProbability": tomorrow_rain_probability}
+        for (_, device_id, sensor_data, crop), (_, stress_level, _) in zip(valid, scores)
+    ], pumps=pump_states)
+    
+    for (index, device_id, _, _), (soil_health, stress_level, moisture_loss_rate), decision in zip(valid, scores, decisions):
+        try:
+            if isinstance(decision, Exception):
+                raise decision
+            results[index].result = interpretation_response(
+                decision, soil_health, stress_level,
+                observed_loss_rate(device_id, moisture_loss_rate), tomorrow_rain_probability
+            )
+        except Exception as e:
+            results[index].error = str(e)
+    
+    failed = sum(1 for r in results if r.error is not None)
+    return BatchInterpretResponse(
+        results=results,
+        succeeded=len(results) - failed,
+        failed=failed,
+        weatherAvailable=weather_forecast is not None
+    )
+
+
+# ============================================
+# STREAMING INGEST ENDPOINTS
+# ============================================
+
+def ingest_reading(raw: Any) -> str:
+    """
+    Validate one {"deviceId", "sensorData", "timestamp"?} reading (dict or
+    JSON text) and append it to the device's rolling window
+    """
+    item = json.loads(raw) if isinstance(raw, (str, bytes)) else raw
+    reading = InterpretRequest.model_validate(item)
+    sensor_data = SensorData.model_validate(dict(reading.sensorData)).model_dump()
+    for key in WINDOW_FIELDS:
+        value = sensor_data.get(key)
+        if value is not None and not isinstance(value, (int, float)):
+            raise ValueError(f"{key} must be numeric")
+    record_reading(reading.deviceId, sensor_data, reading.timestamp)
+    return reading.deviceId
+
+
+async def interpret_latest(device_ids: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Interpret the newest windowed reading of each device (one weather lookup, one scoring pass)"""
+    tomorrow_rain_probability = get_rain_probability(await fetch_weather_forecast())
+    results = {}
+    latest = []
+    for device_id in device_ids:
+        window = device_states.get(device_id)
+        sensor_data = window.latest() if window else None
+        if sensor_data is None:
+            # Unknown device, or its window was evicted from the LRU
+            results[device_id] = {"error": f"No readings tracked for device {device_id}"}
+        else:
+            latest.append((device_id, sensor_data))
+    if not latest:
+        return results
+    scores = data_processor.score_batch([sensor_data for _, sensor_data in latest])
+    decisions = await shared_store.run(rule_engine.evaluate_batch, [
+        {"deviceId": device_id, "sensorData": sensor_data,
+         "stressLevel": stress_level, "rainProbability": tomorrow_rain_probability}
+        for (device_id, sensor_data), (_, stress_level, _) in zip(latest, scores)
+    ], pumps=pump_states)
+    
+    for (device_id, _), (soil_health, stress_level, moisture_loss_rate), decision in zip(latest, scores, decisions):
+        try:
+            if isinstance(decision, Exception):
+                raise decision
+            results[device_id] = {"result": interpretation_response(
+                decision, soil_health, stress_level,
+                observed_loss_rate(device_id, moisture_loss_rate), tomorrow_rain_probability
+            ).model_dump()}
+        except Exception as e:
+            results[device_id] = {"error": str(e)}
+    return results
+
+
+@app.post("/api/ai/ingest")
+async def ingest_stream(request: Request):
+    """
+    Streaming ingest (NDJSON, chunked POST): one reading per line
+    Readings are appended to each device's rolling window as they arrive;
+    the response holds the interpretation of every device's newest reading
+    """
+    accepted = 0
+    errors = []
+    touched: Dict[str, None] = {}  # insertion-ordered set
+    
+    def take(line: bytes, line_no: int):
+        nonlocal accepted
+        if not line.strip():
+            return
+        try:
+            touched[ingest_reading(line)] = None
+            accepted += 1
+        except Exception as e:
+            errors.append({"line": line_no, "error": str(e)[:200]})
+    
+    pending = b""
+    line_no = 0
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            line_no += 1
+            take(line, line_no)
+    take(pending, line_no + 1)
+    
+    return {
+        "accepted": accepted,
+        "rejected": len(errors),
+        "errors": errors[:100],
+        "devices": await interpret_latest(list(touched)) if touched else {},
+        "timestamp": datetime.now().isoformat()
+    }
+
+
+@app.websocket("/api/ai/ingest/ws")
+async def ingest_websocket(websocket: WebSocket):
+    """Streaming ingest over WebSocket: send one reading per message, get its interpretation back"""
+    await websocket.accept()
+    try:
+        while True:
+            message = await websocket.receive_text()
+            try:
+                device_id = ingest_reading(message)
+                result = (await interpret_latest([device_id]))[device_id]
+                await websocket.send_json({"deviceId": device_id, **result})
+            except Exception as e:
+                await websocket.send_json({"error": str(e)[:200]})
+    except WebSocketDisconnect:
+        pass
+
+
+@app.get("/api/ai/devices/{device_id}/state")
+async def device_state(device_id: str):
+    """Summary of a device's rolling window"""
+    window = device_states.get(device_id)
+    if window is None:
+        raise HTTPException(status_code=404, detail=f"No readings ingested for {device_id}")
+    timestamps, _ = window.window()
+    return {
+        "deviceId": device_id,
+        "readings": window.count,
+        "totalIngested": window.total,
+        "from": datetime.fromtimestamp(timestamps[0]).isoformat(),
+        "to": datetime.fromtimestamp(timestamps[-1]).isoformat(),
+        "latest": window.latest(),
+        "mean": window.means()
+    }
+
+
+def query_time(value: Optional[str]) -> Optional[float]:
+    """Query-string time (ISO string or epoch seconds/ms) -> epoch seconds"""
+    if value is None:
+        return None
+    try:
+        return to_epoch(float(value))
+    except ValueError:
+        return to_epoch(value)
+
+
+def query_fields(fields: Optional[str]) -> tuple:
+    """Comma-separated sensor fields from the query string (all when empty); 422 on unknown names"""
+    selected = tuple(f.strip() for f in fields.split(",") if f.strip()) if fields else WINDOW_FIELDS
+    unknown = [f for f in selected if f not in WINDOW_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown fields {unknown}; available: {list(WINDOW_FIELDS)}")
+    return selected
+
+
+@app.get("/api/ai/devices/{device_id}/history")
+async def device_history(
+    device_id: str,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    fields: Optional[str] = None,
+    resolution: Optional[float] = None
+):
+    """
+    Stored readings of a device as columns. start/end are ISO times or epoch
+    seconds, fields a comma-separated subset of the sensor fields, and
+    resolution (seconds) averages the readings into buckets of that width
+    """
+    if history_store is None:
+        raise HTTPException(status_code=404, detail="History store disabled (HISTORY_DIR is empty)")
+    if not history_store.has_device(device_id):
+        raise HTTPException(status_code=404, detail=f"No history stored for {device_id}")
+    try:
+        start_ts, end_ts = query_time(start), query_time(end)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid start/end: {e}")
+    selected = query_fields(fields)
+    if resolution is not None and resolution <= 0:
+        raise HTTPException(status_code=422, detail="resolution must be positive")
+
+    if resolution:
+        columns = await asyncio.to_thread(history_store.downsample, device_id, resolution, start_ts, end_ts, selected)
+    else:
+        columns = await asyncio.to_thread(history_store.query, device_id, start_ts, end_ts, selected)
+    if len(columns["timestamp"]) > HISTORY_QUERY_MAX_ROWS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"{len(columns['timestamp'])} rows exceed HISTORY_QUERY_MAX_ROWS ({HISTORY_QUERY_MAX_ROWS}); narrow the range or set resolution"
+        )
+    return {"deviceId": device_id, "resolution": resolution, "rows": len(columns["timestamp"]), **columns_to_json(columns)}
+
+
+@app.get("/api/ai/devices/{device_id}/rollups")
+async def device_rollups(
+    device_id: str,
+    resolution: str = "hourly",
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    fields: Optional[str] = None
+):
+    """
+    Per-bucket count/mean/min/max of a device's readings, maintained on
+    ingest. resolution is hourly or daily (days start at local midnight);
+    start/end and fields as for /history
+    """
+    if history_store is None:
+        raise HTTPException(status_code=404, detail="History store disabled (HISTORY_DIR is empty)")
+    if resolution not in ROLLUP_RESOLUTIONS:
+        raise HTTPException(status_code=422, detail=f"resolution must be one of {list(ROLLUP_RESOLUTIONS)}")
+    if not history_store.has_device(device_id):
+        raise HTTPException(status_code=404, detail=f"No history stored for {device_id}")
+    try:
+        start_ts, end_ts = query_time(start), query_time(end)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid start/end: {e}")
+    selected = query_fields(fields)
+
+    rollup = await asyncio.to_thread(history_store.rollup, device_id, resolution, start_ts, end_ts, selected)
+    if len(rollup["timestamp"]) > HISTORY_QUERY_MAX_ROWS:
+        raise HTTPException(
+            status_code=422,
+            detail=f"{len(rollup['timestamp'])} buckets exceed HISTORY_QUERY_MAX_ROWS ({HISTORY_QUERY_MAX_ROWS}); narrow the range"
+        )
+    return {"deviceId": device_id, "resolution": resolution, "buckets": len(rollup["timestamp"]), **columns_to_json(rollup)}
+
+
+# ============================================
+# INTERPRETATION RULES
+# ============================================
+
+@app.get("/api/ai/rules")
+async def get_rules():
+    """Active rule table: version, crops, rule counts and last reload"""
+    return rule_engine.stats()
+
+
+@app.post("/api/ai/rules/reload")
+async def reload_rules():
+    """Recompile the rule file now (a broken file keeps the current rules)"""
+    if not rule_engine.reload():
+        raise HTTPException(status_code=422, detail=rule_engine.last_error)
+    return rule_engine.stats()
+
+
 # ============================================
 # PREDICTION ENDPOINTS
 # ============================================
@@ -541,7 +1194,12 @@ async def interpret_sensor_data(request: InterpretRequest):
 @app.post("/api/ai/predict/irrigation")
 async def predict_irrigation(request: IrrigationPredictionRequest):
     try:
-        predictions = await irrigation_model.predict(zone_id=request.zoneId, days_ahead=request.days)
+        observed = device_states.observations([request.zoneId])
+        predictions = await irrigation_model.predict(
+            zone_id=request.zoneId, days_ahead=request.days,
+            current_moisture=observed["moisture"][0], loss_rate=observed["loss_rate"][0],
+            temperature=observed["temperature"][0], humidity=observed["humidity"][0]
+        )
         return {"zoneId": request.zoneId, "predictions": predictions, "confidence": 0.85, "generatedAt": datetime.now().isoformat()}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -554,15 +1212,118 @@ async def predict_fertilizer(request: FertilizerPredictionRequest):
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/api/ai/predict/batch")
+async def predict_batch(request: BatchPredictionRequest):
+    """
+    Irrigation and fertilizer forecasts for many zones in one pass
+    Per-zone fields are [zone][day] matrices in zoneIds order, sharing one date index
+    """
+    if len(request.zoneIds) > PREDICT_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Too many zones (max {PREDICT_BATCH_MAX})")
+    try:
+        dates = forecast_dates(max(request.irrigationDays, request.fertilizerDays))
+        response = {"zoneIds": request.zoneIds}
+        if "irrigation" in request.include:
+            observed = device_states.observations(request.zoneIds)
+            response["irrigation"] = irrigation_model.predict_batch(
+                request.zoneIds, request.irrigationDays, dates[:request.irrigationDays],
+                current_moisture=observed["moisture"], loss_rates=observed["loss_rate"],
+                temperature=observed["temperature"], humidity=observed["humidity"])
+        if "fertilizer" in request.include:
+            response["fertilizer"] = fertilizer_model.predict_batch(
+                request.zoneIds, request.fertilizerDays, dates[:request.fertilizerDays])
+        response["generatedAt"] = datetime.now().isoformat()
+        return response
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/ai/predict/moisture")
+async def predict_moisture(request: MoisturePredictionRequest):
+    """Weather-adjusted Prophet moisture forecast using the zone's persisted model"""
+    resolution = request.resolution or training_resolution(request.days)
+    if resolution != "raw" and resolution not in ROLLUP_RESOLUTIONS:
+        raise HTTPException(status_code=422, detail=f"resolution must be raw or one of {list(ROLLUP_RESOLUTIONS)}")
+    try:
+        sensor_history = request.sensorHistory
+        device_id = request.deviceId or request.zoneId
+        if not sensor_history and history_store is not None and history_store.has_device(device_id):
+            # reference() flushes the device's unsaved readings to disk first
+            sensor_history = await asyncio.to_thread(
+                history_store.reference, device_id, start=time.time() - HISTORY_TRAIN_DAYS * 86400,
+                resolution=None if resolution == "raw" else resolution
+            )
+        elif not sensor_history:
+            window = device_states.get(device_id)
+            sensor_history = window.to_history() if window else []
+        result = await moisture_predictor.predict_with_weather(
+            sensor_history, request.lat, request.lon,
+            days_ahead=request.days, zone_id=request.zoneId
+        )
+        return {"zoneId": request.zoneId, **result, "generatedAt": datetime.now().isoformat()}
+    except PoolSaturated as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/ai/train/irrigation", status_code=202)
+async def train_irrigation(request: IrrigationTrainingRequest, background_tasks: BackgroundTasks):
+    """
+    Schedule an irrigation model refit in the forecast pool and return immediately
+    Uses the posted history, else the history store (or every device's ingested window)
+    """
+    try:
+        columns = history_to_columns(request.history) if request.history else None
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    background_tasks.add_task(retrain_irrigation_model, columns)
+    return {"status": "scheduled", "source": "history" if columns else ("history_store" if history_store is not None else "device_windows"), "current": irrigation_model.stats()}
+
 @app.post("/api/ai/optimize/zones")
-async def optimize_zones(zones: List[Dict[str, Any]]):
+async def optimize_zones(request: Union[List[Dict[str, Any]], ZoneOptimizationRequest]):
+    """Accepts a plain list of zones, or {"zones", "waterBudget", "pumps", "windowMinutes"}"""
+    if isinstance(request, list):
+        request = ZoneOptimizationRequest(zones=request)
     try:
-        result = zone_optimizer.optimize_allocation(zones)
+        result = zone_optimizer.optimize_allocation(
+            request.zones, water_budget=request.waterBudget,
+            pumps=request.pumps, window_minutes=request.windowMinutes
+        )
         return {"allocation": result, "efficiency": 0.92, "timestamp": datetime.now().isoformat()}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.post("/api/ai/schedule/pumps")
+async def schedule_pumps(request: PumpScheduleRequest):
+    """
+    Optimize allocation, then lay the runs out on a per-pump timeline inside
+    the irrigation window and return them as an ordered ON/OFF command queue
+    """
+    try:
+        result = zone_optimizer.optimize_allocation(
+            request.zones, water_budget=request.waterBudget,
+            pumps=request.pumps, window_minutes=request.windowMinutes
+        )
+        # Pumps still dosing fertilizer stay busy until their run ends
+        now = datetime.now()
+        busy_until = {}
+        for zone in request.zones:
+            pump_id = zone.get('pumpId') or zone.get('zoneId')
+            end = await shared_store.run(pump_states.running_until, pump_id, "fertilizer")
+            if end is not None:
+                busy_until[pump_id] = datetime.fromtimestamp(end)
+        schedule = pump_scheduler.schedule(
+            result["allocation"], request.zones, pumps=request.pumps, circuits=request.circuits,
+            busy_until=busy_until, max_concurrent=request.maxConcurrent,
+            window_start=request.windowStart, window_minutes=request.windowMinutes, now=now
+        )
+        return {"allocation": result, "schedule": schedule, "timestamp": now.isoformat()}
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 # ============================================
 # CHATBOT ENDPOINT - FIXED
 # ============================================
@@ -580,9 +1341,21 @@ async def ai_chatbot(request: ChatRequest):
     
     # Check if Gemini is available
     if has_gemini:
+        # Near-identical questions on near-identical readings reuse an earlier answer
+        cache_key = chat_cache.make_key(message, sensor_data, expenses)
+        cached = chat_cache.get(cache_key)
+        if cached:
+            return {
+                "reply": cached["reply"],
+                "timestamp": datetime.now().isoformat(),
+                "intent": "gemini_ai",
+                "model": cached.get("model"),
+                "cached": True
+            }
+        
         # Check quota status first
-        if quota_reset_time and datetime.now() < quota_reset_time:
-            wait_seconds = (quota_reset_time - datetime.now()).seconds
+        wait_seconds = await quota_wait_seconds()
+        if wait_seconds is not None:
             return {
                 "reply": f"⏳ AI quota exceeded. Using smart mode.\n\n{rule_based_chat(message, sensor_data, expenses)['reply']}",
                 "timestamp": datetime.now().isoformat(),
@@ -597,6 +1370,7 @@ async def ai_chatbot(request: ChatRequest):
         response = await call_gemini(prompt)
         
         if response:
+            chat_cache.put(cache_key, {"reply": response, "model": working_model})
             return {
                 "reply": response,
                 "timestamp": datetime.now().isoformat(),
@@ -617,6 +1391,94 @@ async def ai_chatbot(request: ChatRequest):
     return rule_based_chat(message, sensor_data, expenses)
 
 
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """Format one Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@app.post("/api/ai/chat/stream")
+async def ai_chatbot_stream(request: ChatRequest):
+    """
+    Streaming variant of /api/ai/chat (Server-Sent Events)
+    Emits `token` events with {"text": ...} followed by one `done` event carrying
+    the same intent/model metadata as the non-streaming reply. If Gemini has not
+    produced its first token within CHAT_FIRST_TOKEN_DEADLINE seconds, the
+    rule-based answer is sent instead
+    """
+    return StreamingResponse(
+        chat_event_stream(request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def chat_event_stream(request: ChatRequest) -> AsyncIterator[str]:
+    message = (request.message or "").strip()
+    if not message:
+        yield sse_event("token", {"text": "Please enter a message."})
+        yield sse_event("done", {"timestamp": datetime.now().isoformat(), "intent": "empty"})
+        return
+    
+    ctx = request.context or {}
+    sensor_data = ctx.get('sensorData', {})
+    expenses = ctx.get('expenses', [])
+    
+    if not has_gemini:
+        fallback = rule_based_chat(message, sensor_data, expenses)
+        yield sse_event("token", {"text": fallback["reply"]})
+        yield sse_event("done", {"timestamp": fallback["timestamp"], "intent": fallback["intent"]})
+        return
+    
+    cache_key = chat_cache.make_key(message, sensor_data, expenses)
+    cached = chat_cache.get(cache_key)
+    if cached:
+        yield sse_event("token", {"text": cached["reply"]})
+        yield sse_event("done", {"timestamp": datetime.now().isoformat(), "intent": "gemini_ai", "model": cached.get("model"), "cached": True})
+        return
+    
+    # Check quota status first
+    wait_seconds = await quota_wait_seconds()
+    if wait_seconds is not None:
+        yield sse_event("token", {"text": f"⏳ AI quota exceeded. Using smart mode.\n\n{rule_based_chat(message, sensor_data, expenses)['reply']}"})
+        yield sse_event("done", {"timestamp": datetime.now().isoformat(), "intent": "quota_exceeded", "retry_in": wait_seconds})
+        return
+    
+    chunks = stream_gemini(build_prompt(message, sensor_data, expenses))
+    try:
+        first = await asyncio.wait_for(chunks.__anext__(), timeout=CHAT_FIRST_TOKEN_DEADLINE)
+    except (asyncio.TimeoutError, StopAsyncIteration):
+        await chunks.aclose()
+        # Gemini too slow or failed - answer from the rules right away
+        fallback = rule_based_chat(message, sensor_data, expenses)
+        yield sse_event("token", {"text": f"⚠️ AI temporarily unavailable.\n\n{fallback['reply']}"})
+        yield sse_event("done", {
+            "timestamp": datetime.now().isoformat(),
+            "intent": "fallback",
+            "error": last_gemini_error or f"No response within {CHAT_FIRST_TOKEN_DEADLINE:g}s"
+        })
+        return
+    
+    parts = [first]
+    error = None
+    try:
+        yield sse_event("token", {"text": first})
+        async for text in chunks:
+            parts.append(text)
+            yield sse_event("token", {"text": text})
+    except GeminiStreamInterrupted as e:
+        error = str(e)
+    finally:
+        await chunks.aclose()
+    
+    done = {"timestamp": datetime.now().isoformat(), "intent": "gemini_ai", "model": working_model}
+    if error:
+        # Truncated answer - relayed as is, but never cached
+        done.update(partial=True, error=error)
+    else:
+        chat_cache.put(cache_key, {"reply": "".join(parts), "model": working_model})
+    yield sse_event("done", done)
+
+
 def build_prompt(message: str, sensor_data: dict, expenses: list) -> str:
     """Build context-aware prompt with Cambodian/MAFF standards"""
     total_expenses = sum(float(e.get('amount', 0)) for e in expenses)
@@ -741,4 +1603,11 @@ def rule_based_chat(message: str, sensor_data: dict, expenses: list) -> dict:
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("AI_SERVICE_PORT", 8000))
-    uvicorn.run("app:app", host="0.0.0.0", port=port, reload=True)
\ No newline at end of file
+    workers = int(os.getenv("WORKERS", 1))
+    if workers > 1:
+        # Multi-worker mode: set SHARED_STATE_URL (sqlite:// or redis://) so workers coordinate
+        if shared_store.backend == "memory":
+            print("⚠️ WORKERS > 1 with SHARED_STATE_URL=memory:// - quota, routing and pump state won't be shared")
+        uvicorn.run("app:app", host="0.0.0.0", port=port, workers=workers)
+    else:
+        uvicorn.run("app:app", host="0.0.0.0", port=port, reload=True)
\ No newline at end of file
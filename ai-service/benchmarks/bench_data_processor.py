@@ -0,0 +1,96 @@
+"""
+Benchmark: SensorDataProcessor scalar vs. array scoring
+
+Generates random readings (including exact threshold values and missing
+fields), checks that the *_array methods agree exactly with the scalar
+methods on every row, then reports throughput of both paths.
+
+Usage:
+    python benchmarks/bench_data_processor.py [rows] [seed]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from utils.data_processor import SensorDataProcessor
+
+# Field -> (low, high, threshold values that must be hit exactly)
+FIELDS = {
+    'moisture': (0, 110, [40, 50, 60, 80]),
+    'temperature': (5, 45, [15, 18, 24, 25, 27, 33]),
+    'humidity': (10, 100, [40, 70, 75, 85]),
+    'pH': (3.5, 9.5, [6.0, 6.8]),
+    'nitrogen': (0, 120, [30, 50]),
+    'phosphorus': (0, 60, [15, 30]),
+    'potassium': (0, 200, [80, 120]),
+    'lightIntensity': (0, 100, [50]),
+}
+
+
+def random_columns(rows: int, rng: np.random.Generator):
+    columns = {}
+    for field, (low, high, edges) in FIELDS.items():
+        values = rng.uniform(low, high, rows)
+        # ~10% exact threshold values, ~15% missing
+        pick = rng.random(rows)
+        values = np.where(pick < 0.10, rng.choice(edges, rows), values)
+        values = np.where((pick >= 0.10) & (pick < 0.25), np.nan, values)
+        columns[field] = values
+    return columns
+
+
+def scalar(processor, columns, rows):
+    value = lambda field, i: None if np.isnan(columns[field][i]) else float(columns[field][i])
+    health, stress, loss = [], [], []
+    for i in range(rows):
+        health.append(processor.assess_soil_health(
+            moisture=value('moisture', i), pH=value('pH', i), nitrogen=value('nitrogen', i),
+            phosphorus=value('phosphorus', i), potassium=value('potassium', i)))
+        stress.append(processor.calculate_stress_level(
+            moisture=value('moisture', i), temperature=value('temperature', i), humidity=value('humidity', i)))
+        loss.append(processor.estimate_moisture_loss_rate(
+            temperature=value('temperature', i), humidity=value('humidity', i),
+            light_intensity=value('lightIntensity', i)))
+    return health, stress, loss
+
+
+def vectorized(processor, c):
+    return (
+        processor.assess_soil_health_array(c['moisture'], c['pH'], c['nitrogen'], c['phosphorus'], c['potassium']),
+        processor.calculate_stress_level_array(c['moisture'], c['temperature'], c['humidity']),
+        processor.estimate_moisture_loss_rate_array(c['temperature'], c['humidity'], c['lightIntensity'])
+    )
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 42
+    processor = SensorDataProcessor()
+    columns = random_columns(rows, np.random.default_rng(seed))
+
+    start = time.perf_counter()
+    health, stress, loss = scalar(processor, columns, rows)
+    scalar_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    health_a, stress_a, loss_a = vectorized(processor, columns)
+    array_s = time.perf_counter() - start
+
+    mismatches = sum(
+        health[i] != health_a[i] or stress[i] != stress_a[i] or loss[i] != loss_a[i]
+        for i in range(rows)
+    )
+
+    print(f"{rows:,} readings (seed {seed})")
+    print(f"  scalar: {scalar_s:8.3f} s  {rows / scalar_s:12,.0f} rows/s")
+    print(f"  array:  {array_s:8.3f} s  {rows / array_s:12,.0f} rows/s  x{scalar_s / array_s:.0f}")
+    print(f"  rows differing from scalar: {mismatches}")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
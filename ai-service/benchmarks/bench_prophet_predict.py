@@ -0,0 +1,110 @@
+"""
+Benchmark: ProphetForecaster prediction output path
+
+Compares the previous implementation (predict over history + future, then
+DataFrame.iterrows() per future row) with the current one (predict over
+the future frame only, NumPy clipping, columnar output).
+
+Uses a real Prophet model when Prophet is installed; otherwise a stub
+with the same make_future_dataframe/predict interface, so the frame
+sizes and conversion costs are still representative.
+
+Usage:
+    python benchmarks/bench_prophet_predict.py [history_days] [horizon_days]
+"""
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import pandas as pd
+
+from models.prophet_forecaster import ProphetForecaster, PROPHET_AVAILABLE
+
+
+class StubProphet:
+    """make_future_dataframe/predict with Prophet's column layout"""
+
+    def __init__(self, history: pd.DataFrame):
+        self.history = history
+
+    def make_future_dataframe(self, periods, freq='D', include_history=True):
+        last = self.history['ds'].max()
+        dates = pd.date_range(start=last, periods=periods + 1, freq=freq)[1:]
+        if include_history:
+            dates = np.concatenate([self.history['ds'].to_numpy(), dates.to_numpy()])
+        return pd.DataFrame({'ds': dates})
+
+    def predict(self, df):
+        t = (df['ds'] - self.history['ds'].min()).dt.total_seconds().to_numpy() / 86400
+        yhat = 65 + 10 * np.sin(t * 2 * np.pi) - 0.05 * t
+        return pd.DataFrame({'ds': df['ds'], 'yhat': yhat, 'yhat_lower': yhat - 8, 'yhat_upper': yhat + 8})
+
+
+def legacy_predict(model, days_ahead):
+    """The pre-vectorization _prophet_predict"""
+    future = model.make_future_dataframe(periods=days_ahead * 24, freq='h')
+    forecast = model.predict(future)
+    now = datetime.now()
+    future_forecast = forecast[forecast['ds'] > now]
+    predictions = []
+    for _, row in future_forecast.iterrows():
+        predictions.append({
+            "timestamp": row['ds'].isoformat(),
+            "predicted_moisture": max(0, min(100, row['yhat'])),
+            "lower_bound": max(0, row['yhat_lower']),
+            "upper_bound": min(100, row['yhat_upper']),
+            "confidence": 0.85
+        })
+    return predictions
+
+
+def timed(fn, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    history_days = int(sys.argv[1]) if len(sys.argv) > 1 else 365
+    horizon_days = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+
+    freq = 'h' if PROPHET_AVAILABLE else 'min'  # real Prophet fits on minute data are too slow to benchmark
+    ds = pd.date_range(end=datetime.now(), periods=history_days * (24 if freq == 'h' else 1440), freq=freq)
+    history = pd.DataFrame({'ds': ds, 'y': 60 + 5 * np.sin(np.arange(len(ds)) / 100)})
+
+    forecaster = ProphetForecaster()
+    if PROPHET_AVAILABLE:
+        forecaster.train([{'timestamp': d, 'moisture': y} for d, y in zip(history['ds'], history['y'])])
+        model = forecaster.model
+    else:
+        model = StubProphet(history)
+        forecaster.model = model
+        forecaster.is_trained = True
+        # predict_columns only takes the Prophet path when Prophet is importable
+        import models.prophet_forecaster as pf
+        pf.PROPHET_AVAILABLE = True
+
+    legacy_s, legacy = timed(lambda: legacy_predict(model, horizon_days))
+    columns_s, columns = timed(lambda: forecaster.predict_columns(horizon_days))
+    rows_s, rows = timed(lambda: forecaster.predict(horizon_days))
+
+    fields = ["predicted_moisture", "lower_bound", "upper_bound"]
+    same = len(legacy) == len(rows) and all(
+        np.isclose(a[f], b[f]) for a, b in zip(legacy, rows) for f in fields
+    )
+    print(f"Model: {'Prophet' if PROPHET_AVAILABLE else 'stub'}, history {len(history):,} points, horizon {horizon_days} days")
+    print(f"  legacy (full predict + iterrows): {legacy_s * 1000:9.1f} ms  ({len(legacy)} rows)")
+    print(f"  predict_columns (columnar):       {columns_s * 1000:9.1f} ms  ({len(columns['timestamp'])} rows)  x{legacy_s / columns_s:.1f}")
+    print(f"  predict (rows from columns):      {rows_s * 1000:9.1f} ms  ({len(rows)} rows)  x{legacy_s / rows_s:.1f}")
+    print(f"  outputs match legacy: {same}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark: loading a device's history for Prophet training
+
+Compares the JSON path (a request body of [{"timestamp", "moisture"}] rows,
+parsed and turned into a DataFrame by prepare_training_data) with the
+history store (memory-mapped chunk query, then the columnar
+prepare_training_data path), for one device with N days of per-minute
+readings, and the hourly/daily rollup means the forecasters now train on.
+Also times ingest (readings plus rollup upkeep), a one-day range query and
+hourly downsampling, and checks both paths give the same training frame and
+the ingest-time hourly rollup matches downsampling the raw readings.
+
+Usage:
+    python benchmarks/bench_sensor_history.py [days] [readings_per_hour]
+"""
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from models.prophet_forecaster import ProphetForecaster
+from utils.sensor_history import SensorHistoryStore
+
+
+def timed(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 90
+    per_hour = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+    n = days * 24 * per_hour
+    rng = np.random.default_rng(0)
+    t0 = datetime(2025, 1, 1).timestamp()
+    timestamps = t0 + np.arange(n) * 3600 / per_hour
+    moisture = np.round(60 + 10 * np.sin(np.arange(n) / (24 * per_hour) * 2 * np.pi) + rng.normal(0, 1, n), 2)
+    forecaster = ProphetForecaster()
+
+    body = json.dumps({"sensorHistory": [
+        {"timestamp": datetime.fromtimestamp(ts).isoformat(), "moisture": m}
+        for ts, m in zip(timestamps.tolist(), moisture.tolist())
+    ]})
+
+    with tempfile.TemporaryDirectory() as root:
+        store = SensorHistoryStore(root, utc_offset=0)
+        start = time.perf_counter()
+        for ts, m in zip(timestamps.tolist(), moisture.tolist()):
+            store.append("bench", {"moisture": m, "temperature": 30.0}, ts)
+        store.flush()
+        ingest = time.perf_counter() - start
+
+        json_time, json_df = timed(lambda: forecaster.prepare_training_data(json.loads(body)["sensorHistory"]), 3)
+        store_time, store_df = timed(lambda: forecaster.prepare_training_data(store.reference("bench").load()))
+        query_time, _ = timed(lambda: store.query("bench", fields=("moisture",)))
+        day_time, day = timed(lambda: store.query("bench", t0 + 86400 * (days // 2), t0 + 86400 * (days // 2 + 1), ("moisture",)))
+        hourly_time, hourly = timed(lambda: store.downsample("bench", 3600, fields=("moisture",)))
+        rollup_time, rollup_df = timed(lambda: forecaster.prepare_training_data(store.reference("bench", resolution="hourly").load()))
+        daily_time, daily_df = timed(lambda: forecaster.prepare_training_data(store.reference("bench", resolution="daily").load()))
+        rollup = store.rollup("bench", "hourly", fields=("moisture",))
+        on_disk = sum(os.path.getsize(os.path.join(dp, f)) for dp, _, files in os.walk(root) for f in files)
+
+        same = (
+            len(json_df) == len(store_df)
+            and np.array_equal(json_df["ds"].to_numpy(), store_df["ds"].to_numpy())
+            and np.array_equal(json_df["y"].to_numpy(dtype=float), store_df["y"].to_numpy())
+        )
+        rollup_ok = (
+            np.array_equal(rollup["timestamp"], hourly["timestamp"])
+            and np.array_equal(rollup["moisture"]["count"], hourly["count"])
+            and np.allclose(rollup["moisture"]["mean"], hourly["moisture"])
+        )
+
+    print(f"{n:,} readings ({days} days x {per_hour}/hour), JSON body {len(body) / 1e6:.1f} MB, store {on_disk / 1e6:.1f} MB on disk")
+    print(f"{'ingest (append + flush)':<34} {ingest * 1e3:>9.1f} ms  ({n / ingest:,.0f} readings/s)")
+    print(f"{'JSON rows -> training frame':<34} {json_time * 1e3:>9.1f} ms")
+    print(f"{'history store -> training frame':<34} {store_time * 1e3:>9.1f} ms  ({json_time / store_time:.1f}x)")
+    print(f"{'query, full range':<34} {query_time * 1e3:>9.2f} ms")
+    print(f"{'query, one day':<34} {day_time * 1e3:>9.3f} ms  ({len(day['timestamp'])} rows)")
+    print(f"{'downsample, hourly means':<34} {hourly_time * 1e3:>9.2f} ms  ({len(hourly['timestamp'])} buckets)")
+    print(f"{'hourly rollup -> training frame':<34} {rollup_time * 1e3:>9.2f} ms  ({len(rollup_df)} points)")
+    print(f"{'daily rollup -> training frame':<34} {daily_time * 1e3:>9.2f} ms  ({len(daily_df)} points, 1/{n // max(1, len(daily_df))} of raw)")
+    print(f"training frames identical: {same}, hourly rollup matches downsampling: {rollup_ok}")
+    sys.exit(0 if same and rollup_ok else 1)
+
+
+if __name__ == "__main__":
+    main()
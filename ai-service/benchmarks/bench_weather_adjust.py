@@ -0,0 +1,176 @@
+"""
+Benchmark: WeatherAwareMoisturePredictor._adjust_for_weather
+
+Prophet predictions are hourly, the Open-Meteo forecast is daily. The old
+version paired prediction i with forecast day i (so a 7-day run adjusted
+hours 0-6 with days 0-6) in a per-row Python loop; the current one joins
+every prediction to its own calendar day and applies the rain/heat
+adjustments as array operations.
+
+Checks first:
+- hour/day alignment on a hand-built case (predictions crossing midnight,
+  a rainy day followed by a hot day, a day with no forecast)
+- the vectorized join agrees exactly with a per-row, date-keyed reference
+  on random forecasts (missing days, repeated dates, missing temp_max)
+then times the old loop, the reference loop and the vectorized version.
+Exits non-zero if any check fails.
+
+Usage:
+    python benchmarks/bench_weather_adjust.py [days] [seed]
+"""
+import copy
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from models.prophet_forecaster import WeatherAwareMoisturePredictor, PREDICTION_FIELDS, columns_to_rows
+
+
+def hourly_predictions(start: datetime, hours: int, rng: np.random.Generator) -> dict:
+    yhat = np.clip(60 + 15 * rng.standard_normal(hours), 0, 100)
+    return {
+        "timestamp": [(start + timedelta(hours=h)).isoformat() for h in range(hours)],
+        "predicted_moisture": yhat.tolist(),
+        "lower_bound": np.maximum(0, yhat - 8).tolist(),
+        "upper_bound": np.minimum(100, yhat + 8).tolist(),
+        "confidence": [0.85] * hours
+    }
+
+
+def legacy_adjust(predictions: list, weather: dict) -> list:
+    """The pre-vectorization version: prediction i <- forecast day i"""
+    weather_forecast = weather['forecast']
+    for i, pred in enumerate(predictions):
+        if i < len(weather_forecast):
+            wx = weather_forecast[i]
+            if wx.get('is_raining', False):
+                pred['predicted_moisture'] = min(100, pred['predicted_moisture'] + 15)
+                pred['rain_boost'] = True
+            temp_max = wx.get('temp_max', 28)
+            if temp_max > 30:
+                pred['predicted_moisture'] = max(10, pred['predicted_moisture'] - (temp_max - 30) * 5)
+                pred['heat_stress'] = True
+    return predictions
+
+
+def reference_adjust(predictions: list, weather: dict) -> list:
+    """Same rules, one row at a time, keyed on the prediction's date"""
+    by_date = {}
+    for wx in weather['forecast']:
+        if wx.get('date'):
+            by_date.setdefault(str(wx['date'])[:10], wx)
+    for pred in predictions:
+        wx = by_date.get(pred['timestamp'][:10])
+        if wx is None:
+            continue
+        if wx.get('is_raining', False):
+            pred['predicted_moisture'] = min(100, pred['predicted_moisture'] + 15)
+            pred['rain_boost'] = True
+        temp_max = 28.0 if wx.get('temp_max') is None else wx['temp_max']
+        if temp_max > 30:
+            pred['predicted_moisture'] = max(10, pred['predicted_moisture'] - (temp_max - 30) * 5)
+            pred['heat_stress'] = True
+    return predictions
+
+
+def vectorized_rows(predictor, columns: dict, weather: dict) -> list:
+    """_adjust_for_weather plus the row conversion predict_with_weather does"""
+    adjusted = predictor._adjust_for_weather(columns, weather)
+    rows = columns_to_rows({field: adjusted[field] for field in PREDICTION_FIELDS})
+    for flag in ('rain_boost', 'heat_stress'):
+        for i in np.flatnonzero(adjusted.get(flag, ())):
+            rows[i][flag] = True
+    return rows
+
+
+def alignment_check(predictor) -> bool:
+    """22:00 on day 0 through 02:00 on day 2; day 0 rainy, day 1 hot (34°C), day 2 has no forecast"""
+    start = datetime(2025, 3, 1, 22)
+    columns = {
+        "timestamp": [(start + timedelta(hours=h)).isoformat() for h in range(29)],
+        "predicted_moisture": [50.0] * 29,
+        "lower_bound": [40.0] * 29, "upper_bound": [60.0] * 29, "confidence": [0.85] * 29
+    }
+    weather = {"forecast": [
+        {"date": "2025-03-01", "temp_max": 29, "is_raining": True},
+        {"date": "2025-03-02", "temp_max": 34, "is_raining": False},
+    ]}
+    rows = vectorized_rows(predictor, columns, weather)
+    expected = [65.0] * 2 + [30.0] * 24 + [50.0] * 3  # rain +15 | heat -(34-30)*5 | untouched
+    ok = [r["predicted_moisture"] for r in rows] == expected
+    ok &= all(r.get("rain_boost") for r in rows[:2]) and not any(r.get("rain_boost") for r in rows[2:])
+    ok &= all(r.get("heat_stress") for r in rows[2:26]) and not any(r.get("heat_stress") for r in rows[:2] + rows[26:])
+    return ok
+
+
+def random_weather(start: datetime, days: int, rng: np.random.Generator, gaps: bool = True) -> dict:
+    forecast = []
+    for day in range(days + 1):
+        if gaps and rng.random() < 0.1:
+            continue  # day missing from the forecast
+        wx = {
+            "date": (start + timedelta(days=day)).strftime("%Y-%m-%d"),
+            "temp_max": round(float(rng.uniform(24, 38)), 1),
+            "is_raining": bool(rng.random() < 0.3)
+        }
+        if gaps and rng.random() < 0.05:
+            wx["temp_max"] = None  # the old loop cannot handle this, so timing runs skip it
+        forecast.append(wx)
+        if gaps and rng.random() < 0.05:
+            forecast.append({**wx, "is_raining": not wx["is_raining"]})  # repeated date: first one counts
+    return {"forecast": forecast}
+
+
+def timed(fn, setup, repeat=50):
+    """Best time of fn(setup()) over repeat runs, setup not timed"""
+    best = float("inf")
+    for _ in range(repeat):
+        data = setup()
+        start = time.perf_counter()
+        fn(data)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 7
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    rng = np.random.default_rng(seed)
+    predictor = WeatherAwareMoisturePredictor()
+
+    aligned = alignment_check(predictor)
+    print(f"hour/day alignment: {'ok' if aligned else 'FAILED'}")
+
+    mismatches = 0
+    for trial in range(200):
+        start = datetime(2025, 1, 1) + timedelta(hours=int(rng.integers(0, 24 * 365)))
+        columns = hourly_predictions(start, days * 24, rng)
+        weather = random_weather(start, days, rng)
+        expected = reference_adjust(columns_to_rows(columns), weather)
+        mismatches += vectorized_rows(predictor, columns, weather) != expected
+    print(f"vectorized vs. per-row date join: {mismatches} mismatching runs out of 200")
+
+    start = datetime.now().replace(minute=0, second=0, microsecond=0)
+    columns = hourly_predictions(start, days * 24, rng)
+    weather = random_weather(start, days, rng, gaps=False)
+    rows = columns_to_rows(columns)
+    fresh_rows = lambda: copy.deepcopy(rows)
+    legacy_s = timed(lambda data: legacy_adjust(data, weather), fresh_rows)
+    reference_s = timed(lambda data: reference_adjust(data, weather), fresh_rows)
+    vector_s = timed(lambda data: predictor._adjust_for_weather(data, weather), lambda: columns)
+    vector_rows_s = timed(lambda data: vectorized_rows(predictor, data, weather), lambda: columns)
+    print(f"{days * 24} hourly predictions, {len(weather['forecast'])} forecast days")
+    print(f"  old loop (index-paired, {min(len(rows), len(weather['forecast']))} rows adjusted): {legacy_s * 1e6:9.1f} us")
+    print(f"  per-row date join:              {reference_s * 1e6:9.1f} us")
+    print(f"  vectorized date join:           {vector_s * 1e6:9.1f} us")
+    print(f"  vectorized + rows for response: {vector_rows_s * 1e6:9.1f} us")
+    sys.exit(0 if aligned and mismatches == 0 else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Benchmark: background weather prefetch vs. fetching in request handlers
+
+Simulated handlers call WeatherService.get_forecast for random farms
+against the stub Open-Meteo from bench_weather_service, with a short cache
+TTL and no stale window so expiries happen during the run. Without
+prefetch, the first request for a cell after expiry waits on the upstream;
+with a task calling WeatherService.prefetch every TTL/4 (as
+weather_prefetch_loop does), handlers should only read the warm cache.
+Reports handler wait percentiles, requests that waited on the upstream and
+the most upstream requests started in any 50 ms, and exits non-zero if any
+handler waited with prefetch on. Bulk requests carry 10 cells here so the
+staggering shows; refreshing cannot keep up once cells / 10 * latency
+exceeds the TTL.
+
+Usage:
+    python benchmarks/bench_weather_prefetch.py [farms] [towns] [seconds] [latency_ms]
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from bench_weather_service import StubOpenMeteo, StubPool
+from utils.weather_cache import WeatherCache
+from utils.weather_service import WeatherService
+
+
+class TimedStub(StubOpenMeteo):
+    """Also records when each request started"""
+
+    def __init__(self, latency: float):
+        super().__init__(latency)
+        self.started = []
+
+    async def handle(self, request):
+        self.started.append(time.monotonic())
+        return await super().handle(request)
+
+
+def peak(started, window=0.05):
+    started = np.sort(started)
+    if not len(started):
+        return 0
+    return int((np.searchsorted(started, started + window) - np.arange(len(started))).max())
+
+
+async def run_once(locations, seconds, latency, ttl, prefetch):
+    stub = TimedStub(latency)
+    service = WeatherService(StubPool(stub), WeatherCache(ttl_seconds=ttl, stale_seconds=0), bulk_size=10,
+                             locations=locations)
+    rng = np.random.default_rng(1)
+    task = None
+    if prefetch:
+        async def loop():
+            while True:
+                started = time.monotonic()
+                await service.prefetch(ttl / 4)
+                await asyncio.sleep(max(0.0, ttl / 4 - (time.monotonic() - started)))
+        task = asyncio.create_task(loop())
+        while service.prefetched < len(await service.known_cells()):
+            await asyncio.sleep(latency)  # let the first pass fill the cold cache, as after startup
+
+    waits = []
+    end = time.monotonic() + seconds
+    while time.monotonic() < end:
+        lat, lon = locations[rng.integers(len(locations))]
+        start = time.monotonic()
+        await service.get_forecast(lat, lon)
+        waits.append(time.monotonic() - start)
+        await asyncio.sleep(0.002)
+    if task:
+        task.cancel()
+    waits = np.array(waits)
+    return waits, int((waits > latency / 2).sum()), stub.requests, peak(stub.started)
+
+
+async def run(farms, towns, seconds, latency):
+    rng = np.random.default_rng(0)
+    centers = rng.uniform([10.5, 103.0], [13.5, 106.5], size=(towns, 2))
+    locations = [tuple(c) for c in (centers[rng.integers(0, towns, farms)] + rng.normal(0, 0.01, (farms, 2))).tolist()]
+    ttl = seconds / 4
+    print(f"{farms} farms around {towns} towns, TTL {ttl:.2f} s, {latency * 1e3:.0f} ms per request, {seconds:.0f} s of traffic")
+    print(f"  {'':<12} {'calls':>6} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'waited':>7} {'upstream':>9} {'peak/50ms':>10}")
+    waited_with_prefetch = None
+    for prefetch in (False, True):
+        waits, waited, requests, busiest = await run_once(locations, seconds, latency, ttl, prefetch)
+        label = "prefetch" if prefetch else "on demand"
+        p50, p99 = np.percentile(waits, [50, 99]) * 1e3
+        print(f"  {label:<12} {len(waits):>6} {p50:>8.2f} {p99:>8.2f} {waits.max() * 1e3:>8.2f} {waited:>7} {requests:>9} {busiest:>10}")
+        if prefetch:
+            waited_with_prefetch = waited
+    return waited_with_prefetch == 0
+
+
+def main():
+    farms = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    towns = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    seconds = float(sys.argv[3]) if len(sys.argv) > 3 else 4
+    latency = float(sys.argv[4]) / 1000 if len(sys.argv) > 4 else 0.05
+    sys.exit(0 if asyncio.run(run(farms, towns, seconds, latency)) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+"""
+Benchmark: WeatherService forecasts for many farms
+
+A stub Open-Meteo (httpx MockTransport, fixed latency per request) answers
+single and comma-separated multi-location requests. For N farms scattered
+over a few km around M towns, compares:
+- one request per farm (the old get_forecast, no cache)
+- grid-cell cache, one get_forecast per farm
+- get_forecasts, one bulk request per WEATHER_BULK_SIZE cells
+then checks that the bulk and per-cell forecasts agree, that a restarted
+service reuses the saved forecasts without any request, and that with
+Open-Meteo down it serves the saved forecast instead of the dummy one.
+Exits non-zero if any check fails.
+
+Usage:
+    python benchmarks/bench_weather_service.py [farms] [towns] [latency_ms]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx
+import numpy as np
+
+from utils.http_clients import HttpClientPool
+from utils.weather_cache import WeatherCache
+from utils.weather_service import WeatherService
+
+
+class StubOpenMeteo:
+    """Deterministic daily forecast per coordinate; counts requests, can be taken down"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.requests = 0
+        self.down = False
+
+    @staticmethod
+    def _location(lat: float, lon: float) -> dict:
+        days = [(date.today() + timedelta(days=d)).isoformat() for d in range(16)]
+        seed = int(abs(lat * 1000 + lon * 7))
+        return {"latitude": lat, "longitude": lon, "daily": {
+            "time": days,
+            "temperature_2m_max": [round(27 + (seed + d) % 10, 1) for d in range(16)],
+            "temperature_2m_min": [22.0] * 16,
+            "precipitation_sum": [float((seed + d) % 3) for d in range(16)],
+            "rain_sum": [float((seed * d) % 3) for d in range(16)],
+            "showers_sum": [0.0] * 16,
+            "snowfall_sum": [0.0] * 16
+        }}
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        if self.down:
+            return httpx.Response(503)
+        lats = request.url.params["latitude"].split(",")
+        lons = request.url.params["longitude"].split(",")
+        results = [self._location(float(lat), float(lon)) for lat, lon in zip(lats, lons)]
+        return httpx.Response(200, json=results if len(results) > 1 else results[0])
+
+
+class StubPool(HttpClientPool):
+    def __init__(self, stub: StubOpenMeteo):
+        super().__init__()
+        self.client = httpx.AsyncClient(transport=httpx.MockTransport(stub.handle))
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        return self.client
+
+
+def service(stub, forecast_dir=None, grid=0.05):
+    return WeatherService(StubPool(stub), WeatherCache(ttl_seconds=3600), grid_degrees=grid, forecast_dir=forecast_dir)
+
+
+async def run(farms: int, towns: int, latency: float) -> bool:
+    rng = np.random.default_rng(0)
+    centers = rng.uniform([10.5, 103.0], [13.5, 106.5], size=(towns, 2))
+    locations = [tuple(c) for c in (centers[rng.integers(0, towns, farms)] + rng.normal(0, 0.01, (farms, 2))).tolist()]
+
+    # Old behaviour: every call goes to Open-Meteo with the raw coordinates
+    stub = StubOpenMeteo(latency)
+    uncached = service(stub, grid=0)
+    start = time.perf_counter()
+    for lat, lon in locations:
+        uncached.cache = WeatherCache(ttl_seconds=0, stale_seconds=0)
+        await uncached.get_forecast(lat, lon)
+    old_s, old_requests = time.perf_counter() - start, stub.requests
+
+    stub = StubOpenMeteo(latency)
+    cached = service(stub)
+    start = time.perf_counter()
+    per_cell = [await cached.get_forecast(lat, lon) for lat, lon in locations]
+    cell_s, cell_requests = time.perf_counter() - start, stub.requests
+    cells = len({cached.cell(lat, lon) for lat, lon in locations})
+
+    with tempfile.TemporaryDirectory() as forecast_dir:
+        stub = StubOpenMeteo(latency)
+        bulk = service(stub, forecast_dir)
+        start = time.perf_counter()
+        bulk_forecasts = await bulk.get_forecasts(locations)
+        bulk_s, bulk_requests = time.perf_counter() - start, stub.requests
+        same = [f["forecast"] for f in bulk_forecasts] == [f["forecast"] for f in per_cell]
+
+        # Restart: a new service with an empty cache reads the saved cells
+        stub = StubOpenMeteo(latency)
+        restarted = service(stub, forecast_dir)
+        reused = [await restarted.get_forecast(lat, lon) for lat, lon in locations]
+        restart_ok = stub.requests == 0 and [f["forecast"] for f in reused] == [f["forecast"] for f in per_cell]
+
+        # Outage after the saved copies have aged past the TTL: saved forecast, not the dummy
+        stub = StubOpenMeteo(latency)
+        stub.down = True
+        offline = service(stub, forecast_dir)
+        offline.cache.ttl = 0
+        lat, lon = locations[0]
+        single = await offline.get_forecast(lat, lon, days=3)
+        many = await offline.get_forecasts(locations[:5], days=3)
+        outage_ok = (
+            single["source"] == "Open-Meteo (saved)" and single["forecast"] == per_cell[0]["forecast"][:3]
+            and all(f["source"] == "Open-Meteo (saved)" for f in many)
+        )
+        fallback = await service(stub).get_forecast(lat, lon, days=3)
+        outage_ok &= fallback["source"] == "Fallback"
+
+    print(f"{farms} farms around {towns} towns -> {cells} grid cells, {latency * 1e3:.0f} ms per request")
+    print(f"  {'one request per farm':<28} {old_requests:>6} requests {old_s * 1e3:>9.1f} ms")
+    print(f"  {'grid cache, per farm':<28} {cell_requests:>6} requests {cell_s * 1e3:>9.1f} ms")
+    print(f"  {'grid cache, bulk fetch':<28} {bulk_requests:>6} requests {bulk_s * 1e3:>9.1f} ms")
+    print(f"bulk == per-cell: {same}, restart reuses saved forecasts: {restart_ok}, outage serves saved forecast: {outage_ok}")
+    return same and restart_ok and outage_ok and cell_requests == cells
+
+
+def main():
+    farms = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    towns = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    latency = float(sys.argv[3]) / 1000 if len(sys.argv) > 3 else 0.02
+    sys.exit(0 if asyncio.run(run(farms, towns, latency)) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Benchmark: ZoneOptimizer allocation at farm scale
+
+Generates random zones sharing pumps, checks the allocation respects the
+water budget, per-pump capacity and per-zone need, compares the priority
+value delivered with the previous greedy sort-and-fill, and times both.
+When SciPy is installed the result is also checked against linprog.
+
+Usage:
+    python benchmarks/bench_zone_optimizer.py [zones] [pumps] [seed]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+from models.zone_optimizer import ZoneOptimizer
+
+WINDOW_MINUTES = 120
+
+
+def random_farm(zones: int, pumps: int, rng: np.random.Generator):
+    farm = [
+        {
+            'zoneId': f"zone-{i}",
+            'currentMoisture': float(rng.uniform(10, 70)),
+            'targetMoisture': float(rng.choice([55, 60, 65])),
+            'area': float(rng.uniform(20, 400)),
+            'cropPriority': int(rng.integers(1, 11)),
+            'dryingRate': float(rng.uniform(0.3, 3.0)),
+            'pumpId': f"pump-{rng.integers(pumps)}"
+        }
+        for i in range(zones)
+    ]
+    pump_limits = {f"pump-{p}": {'flowRate': float(rng.uniform(10, 60))} for p in range(pumps)}
+    return farm, pump_limits
+
+
+def legacy_allocate(zones, budget):
+    """The previous sort-by-priority-score, fill-until-empty allocation"""
+    ranked = []
+    for zone in zones:
+        deficit = max(0, zone['targetMoisture'] - zone['currentMoisture'])
+        ranked.append((deficit * zone['dryingRate'] * zone['cropPriority'], deficit * zone['area'], zone['zoneId']))
+    ranked.sort(reverse=True)
+    allocation, remaining = {}, budget
+    for _, need, zone_id in ranked:
+        allocated = min(need, remaining)
+        allocation[zone_id] = allocated
+        remaining -= allocated
+        if remaining <= 0:
+            break
+    return allocation
+
+
+def value_delivered(zones, water):
+    """Objective: priority score per litre times litres, summed"""
+    total = 0.0
+    for zone in zones:
+        deficit = max(0, zone['targetMoisture'] - zone['currentMoisture'])
+        if deficit > 0:
+            total += zone['dryingRate'] * zone['cropPriority'] / zone['area'] * water.get(zone['zoneId'], 0)
+    return total
+
+
+def timed(fn, repeat=5):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    n_zones = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    n_pumps = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    seed = int(sys.argv[3]) if len(sys.argv) > 3 else 7
+    zones, pumps = random_farm(n_zones, n_pumps, np.random.default_rng(seed))
+    budget = 0.4 * sum(max(0, z['targetMoisture'] - z['currentMoisture']) * z['area'] for z in zones)
+
+    optimizer = ZoneOptimizer(water_budget=budget)
+    lp_s, result = timed(lambda: optimizer.optimize_allocation(zones, pumps=pumps, window_minutes=WINDOW_MINUTES))
+    legacy_s, legacy = timed(lambda: legacy_allocate(zones, budget))
+    budget_only = optimizer.optimize_allocation(zones)  # same constraints as legacy
+
+    water = {z: a['waterAllocated'] for z, a in result['allocation'].items()}
+    per_pump = {}
+    violations = 0
+    for zone in zones:
+        need = max(0, zone['targetMoisture'] - zone['currentMoisture']) * zone['area']
+        violations += water[zone['zoneId']] > need + 0.01
+        per_pump[zone['pumpId']] = per_pump.get(zone['pumpId'], 0) + water[zone['zoneId']]
+    violations += sum(used > pumps[p]['flowRate'] * WINDOW_MINUTES + 0.01 * n_zones for p, used in per_pump.items())
+    violations += result['totalWaterUsed'] > budget + 0.01 * n_zones
+
+    print(f"{n_zones:,} zones on {n_pumps} pumps, budget {budget:,.0f} L, window {WINDOW_MINUTES} min")
+    print(f"  LP allocation:   {lp_s * 1000:8.2f} ms  used {result['totalWaterUsed']:,.0f} L  constraint violations: {violations}")
+    print(f"  legacy greedy:   {legacy_s * 1000:8.2f} ms  (budget only, no pump limits)")
+    print(f"  priority value, budget only: LP {value_delivered(zones, {z: a['waterAllocated'] for z, a in budget_only['allocation'].items()}):,.0f}"
+          f"  vs legacy {value_delivered(zones, legacy):,.0f}")
+
+    try:
+        from scipy.optimize import linprog
+    except ImportError:
+        print("  (SciPy not installed - skipping linprog cross-check)")
+    else:
+        ids = [z['zoneId'] for z in zones]
+        need = np.array([max(0, z['targetMoisture'] - z['currentMoisture']) * z['area'] for z in zones])
+        value = np.array([z['dryingRate'] * z['cropPriority'] / z['area'] if n > 0 else 0 for z, n in zip(zones, need)])
+        names = sorted(pumps)
+        A = np.vstack([np.ones(n_zones)] + [[z['pumpId'] == p for z in zones] for p in names]).astype(float)
+        b = np.array([budget] + [pumps[p]['flowRate'] * WINDOW_MINUTES for p in names])
+        lp = linprog(-value, A_ub=A, b_ub=b, bounds=list(zip(np.zeros(n_zones), need)), method='highs')
+        ours = value @ np.array([water[i] for i in ids])
+        print(f"  linprog optimum {-lp.fun:,.2f} vs ours {ours:,.2f}")
+    sys.exit(1 if violations else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Load test: /api/ai/interpret throughput with 1, 2 and 4 uvicorn workers
+
+Starts the service with each worker count against a stub weather backend
+and SQLite shared state, drives /api/ai/interpret with concurrent clients
+for a fixed time and reports requests/s and scaling efficiency. Before
+each run it fires a burst of low-NPK readings for one device at all
+workers and checks that exactly one fertilizer ON command comes back
+(pump state is shared, so workers must not double-start the pump).
+
+Throughput can only scale up to the number of CPU cores; the client runs
+on the same host, so leave a core for it when reading the numbers.
+
+Usage:
+    python benchmarks/load_interpret.py [seconds] [concurrency] [workers...]
+"""
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FORECAST = {"forecast": [{"date": "tomorrow", "rainProbability": 20, "temp": 31}]}
+
+
+class StubBackend(BaseHTTPRequestHandler):
+    """Node backend stand-in: serves /api/weather"""
+
+    def do_GET(self):
+        body = json.dumps(FORECAST).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_service(workers: int, port: int, backend_port: int, state_dir: str) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "GEMINI_API_KEY": "",
+        "NODE_BACKEND_URL": f"http://127.0.0.1:{backend_port}",
+        "SHARED_STATE_URL": f"sqlite:///{os.path.join(state_dir, f'shared_{workers}.db')}",
+        "MODEL_DIR": os.path.join(state_dir, f"models_{workers}"),
+        "HISTORY_DIR": os.path.join(state_dir, f"history_{workers}"),
+        "WEATHER_FORECAST_DIR": os.path.join(state_dir, f"weather_{workers}"),
+        "IRRIGATION_RETRAIN_INTERVAL": "0",
+        "FORECAST_POOL_WORKERS": "1",
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port),
+         "--workers", str(workers), "--log-level", "warning"],
+        cwd=SERVICE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+
+
+async def wait_ready(base: str, workers: int, timeout: float = 60.0) -> set:
+    """Wait until /api/health answers; returns the worker pids seen on fresh connections"""
+    deadline = time.monotonic() + timeout
+    pids = set()
+    async with httpx.AsyncClient(timeout=2.0, headers={"Connection": "close"}) as client:
+        while time.monotonic() < deadline and len(pids) < workers:
+            try:
+                response = await client.get(f"{base}/api/health")
+                pids.add(response.json()["shared_state"]["pid"])
+            except (httpx.HTTPError, KeyError, ValueError):
+                await asyncio.sleep(0.2)
+    return pids
+
+
+def reading(device_id: str, low_npk: bool = False) -> dict:
+    return {
+        "deviceId": device_id,
+        "sensorData": {
+            "moisture": 55, "temperature": 30, "humidity": 70, "rain": 0, "pH": 6.4, "ec": 1400,
+            "nitrogen": 10 if low_npk else 60, "phosphorus": 40, "potassium": 120
+        }
+    }
+
+
+async def fertilizer_starts(base: str, burst: int) -> int:
+    """Concurrent low-NPK readings for one device; number of fertilizer ON commands returned"""
+    async with httpx.AsyncClient(timeout=10.0, limits=httpx.Limits(max_connections=burst)) as client:
+        responses = await asyncio.gather(*[
+            client.post(f"{base}/api/ai/interpret", json=reading("coherence-check", low_npk=True))
+            for _ in range(burst)
+        ])
+    return sum(
+        1 for r in responses for a in r.json().get("actions") or []
+        if a["type"] == "fertilizer" and a["command"]["status"] == "ON"
+    )
+
+
+async def drive(base: str, seconds: float, concurrency: int) -> tuple:
+    """(completed requests, errors) over seconds with concurrency clients"""
+    done = errors = 0
+    deadline = time.monotonic() + seconds
+
+    async def client_loop(client: httpx.AsyncClient, n: int):
+        nonlocal done, errors
+        i = 0
+        while time.monotonic() < deadline:
+            i += 1
+            try:
+                response = await client.post(f"{base}/api/ai/interpret", json=reading(f"load-{n}-{i % 50}"))
+                if response.status_code == 200:
+                    done += 1
+                else:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+
+    async with httpx.AsyncClient(timeout=10.0, limits=httpx.Limits(max_connections=concurrency)) as client:
+        await asyncio.gather(*[client_loop(client, n) for n in range(concurrency)])
+    return done, errors
+
+
+async def run(workers: int, seconds: float, concurrency: int, backend_port: int, state_dir: str) -> dict:
+    port = free_port()
+    base = f"http://127.0.0.1:{port}"
+    service = start_service(workers, port, backend_port, state_dir)
+    try:
+        pids = await wait_ready(base, workers)
+        starts = await fertilizer_starts(base, burst=8 * workers)
+        await drive(base, 1.0, concurrency)  # warm-up (weather cache, connections)
+        done, errors = await drive(base, seconds, concurrency)
+    finally:
+        service.terminate()
+        service.wait(timeout=30)
+    return {"workers": workers, "pids": len(pids), "rps": done / seconds, "errors": errors, "starts": starts}
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 10
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    worker_counts = [int(w) for w in sys.argv[3:]] or [1, 2, 4]
+
+    backend = ThreadingHTTPServer(("127.0.0.1", 0), StubBackend)
+    threading.Thread(target=backend.serve_forever, daemon=True).start()
+
+    print(f"/api/ai/interpret, {seconds:g}s per run, {concurrency} concurrent clients, {os.cpu_count()} CPU cores")
+    print(f"{'workers':>7} {'pids':>5} {'req/s':>9} {'speedup':>8} {'efficiency':>10} {'errors':>7} {'fert ON':>8}")
+    failed = False
+    with tempfile.TemporaryDirectory() as state_dir:
+        baseline = None
+        for workers in worker_counts:
+            result = asyncio.run(run(workers, seconds, concurrency, backend.server_address[1], state_dir))
+            baseline = baseline or result["rps"] / result["workers"]
+            speedup = result["rps"] / baseline if baseline else 0.0
+            print(f"{workers:>7} {result['pids']:>5} {result['rps']:>9.1f} {speedup:>7.2f}x "
+                  f"{speedup / workers:>9.0%} {result['errors']:>7} {result['starts']:>8}")
+            # Exactly one worker may start the pump, however many saw the burst
+            failed |= result["starts"] != 1 or result["errors"] > 0
+    backend.shutdown()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
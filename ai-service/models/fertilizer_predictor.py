@@ -2,104 +2,312 @@
 Fertilizer Predictor
 Predicts fertilizer needs based on NPK depletion patterns
 """
-from datetime import datetime, timedelta
+import os
+import tempfile
+from datetime import datetime
+from typing import Any, Dict, List, Optional
 import logging
 
+import numpy as np
+
+from models.irrigation_predictor import forecast_dates
+from utils.device_state import to_epoch
+
 logger = logging.getLogger(__name__)
 
+NUTRIENTS = ['nitrogen', 'phosphorus', 'potassium']
+
+# Per-zone, per-nutrient state columns of the depletion table
+TABLE_COLUMNS = ('sw', 'st', 'sy', 'stt', 'sty', 'first_day', 'last_day', 'last_value', 'points')
+
+# A rise of more than this (mg/kg) between readings is a fertilizer application
+FERTILIZER_JUMP = 10.0
+
+SECONDS_PER_DAY = 86400.0
+
+
+class NPKDepletionTable:
+    """
+    Per-zone NPK depletion rates, updated online
+
+    For every (zone, nutrient) it keeps exponentially weighted least-squares
+    sums of level vs. time (days, origin at the latest reading) so each new
+    reading is an O(1) vectorized update over the three nutrients. A jump up
+    of more than FERTILIZER_JUMP, or an explicit fertilizer event, starts a
+    new depletion segment. Stored as one .npz file.
+    """
+
+    def __init__(self, half_life_days: float = 14.0, min_points: int = 3, min_span_days: float = 1.0):
+        self.half_life_days = half_life_days
+        self.min_points = min_points
+        self.min_span_days = min_span_days
+        self.index: Dict[str, int] = {}
+        self.columns = {name: np.zeros((0, len(NUTRIENTS))) for name in TABLE_COLUMNS}
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def _row(self, zone_id: str) -> int:
+        row = self.index.get(zone_id)
+        if row is None:
+            row = len(self.index)
+            self.index[zone_id] = row
+            capacity = len(self.columns['sw'])
+            if row >= capacity:
+                grow = max(16, capacity)
+                for name, values in self.columns.items():
+                    fill = np.nan if name in ('first_day', 'last_day', 'last_value') else 0.0
+                    self.columns[name] = np.vstack([values, np.full((grow, len(NUTRIENTS)), fill)])
+        return row
+
+    def update(self, zone_id: str, timestamp: float, npk, fertilized: bool = False):
+        """Fold one reading (timestamp in epoch seconds, npk as 3 values with None/NaN for missing) into the table"""
+        values = np.array([np.nan if v is None else float(v) for v in npk])
+        present = ~np.isnan(values)
+        if not present.any():
+            return
+        c = self.columns
+        row = self._row(zone_id)
+        day = timestamp / SECONDS_PER_DAY
+        last_day = c['last_day'][row]
+
+        fresh = present & (np.isnan(last_day) | (day > last_day))  # drop late/duplicate readings
+        reset = fresh & (fertilized | (values - c['last_value'][row] > FERTILIZER_JUMP))
+        for name in ('sw', 'st', 'sy', 'stt', 'sty', 'points'):
+            c[name][row] = np.where(reset, 0.0, c[name][row])
+        c['last_day'][row] = last_day = np.where(reset, np.nan, last_day)
+        c['first_day'][row] = np.where(fresh & np.isnan(last_day), day, c['first_day'][row])
+
+        # Move the time origin to this reading and decay the previous sums
+        dt = np.where(fresh & ~np.isnan(last_day), day - np.nan_to_num(last_day, nan=day), 0.0)
+        decay = np.where(fresh, 0.5 ** (dt / self.half_life_days), 1.0)
+        sw, st, sy = c['sw'][row].copy(), c['st'][row].copy(), c['sy'][row].copy()
+        c['stt'][row] = decay * (c['stt'][row] - 2 * dt * st + dt * dt * sw)
+        c['sty'][row] = decay * (c['sty'][row] - dt * sy)
+        c['st'][row] = decay * (st - dt * sw)
+        c['sy'][row] = decay * sy + np.where(fresh, values, 0.0)
+        c['sw'][row] = decay * sw + fresh
+        c['points'][row] += fresh
+        c['last_day'][row] = np.where(fresh, day, c['last_day'][row])
+        c['last_value'][row] = np.where(fresh, values, c['last_value'][row])
+
+    def rates(self, rows: np.ndarray) -> np.ndarray:
+        """Depletion rate (mg/kg per day, >= 0) for table rows; NaN where not yet known"""
+        c = {name: values[rows] for name, values in self.columns.items()}
+        denominator = c['sw'] * c['stt'] - c['st'] ** 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            slope = (c['sw'] * c['sty'] - c['st'] * c['sy']) / denominator
+        known = (
+            (c['points'] >= self.min_points)
+            & (c['last_day'] - c['first_day'] >= self.min_span_days)
+            & (denominator > 1e-12)
+        )
+        return np.where(known, np.maximum(0.0, -slope), np.nan)
+
+    def lookup(self, zone_ids: List[str]):
+        """(level, last reading day, rate) arrays of shape (zone, nutrient); NaN for unknown zones/nutrients"""
+        rows = np.array([self.index.get(z, -1) for z in zone_ids], dtype=int)
+        known = rows >= 0
+        shape = (len(zone_ids), len(NUTRIENTS))
+        level, last_day, rate = np.full(shape, np.nan), np.full(shape, np.nan), np.full(shape, np.nan)
+        if known.any():
+            level[known] = self.columns['last_value'][rows[known]]
+            last_day[known] = self.columns['last_day'][rows[known]]
+            rate[known] = self.rates(rows[known])
+        return level, last_day, rate
+
+    def merge(self, other: "NPKDepletionTable"):
+        """
+        Adopt other's zones we don't have, and its (zone, nutrient) entries
+        whose latest reading is newer than ours (e.g. another worker's table)
+        """
+        if not len(other):
+            return
+        rows = np.array([self._row(zone_id) for zone_id in other.index], dtype=int)
+        other_rows = np.fromiter(other.index.values(), dtype=int, count=len(other))
+        ours, theirs = self.columns['last_day'][rows], other.columns['last_day'][other_rows]
+        newer = ~np.isnan(theirs) & (np.isnan(ours) | (theirs > ours))
+        for name in TABLE_COLUMNS:
+            self.columns[name][rows] = np.where(newer, other.columns[name][other_rows], self.columns[name][rows])
+
+    def save(self, path: str):
+        """Write the table through a unique temp file (one per writer), then rename it over path"""
+        directory = os.path.dirname(path) or "."
+        os.makedirs(directory, exist_ok=True)
+        size = len(self.index)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path), suffix=".tmp.npz")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(
+                    f,
+                    zone_ids=np.array(list(self.index), dtype=str),
+                    half_life_days=self.half_life_days,
+                    **{name: values[:size] for name, values in self.columns.items()}
+                )
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def load(self, path: str):
+        with np.load(path) as data:
+            self.half_life_days = float(data['half_life_days'])
+            self.index = {str(z): i for i, z in enumerate(data['zone_ids'])}
+            self.columns = {name: data[name].astype(float) for name in TABLE_COLUMNS}
+
+
 class FertilizerPredictor:
-    def __init__(self):
-        self.model = None
+    def __init__(self, half_life_days: float = 14.0):
+        self.table = NPKDepletionTable(half_life_days)
         self.is_trained = False
-        
-        # NPK depletion rates (mg/kg per day) - these are estimates
+        self.unsaved = 0  # updates since the table was last saved or loaded
+
+        # NPK depletion rates (mg/kg per day) - fallback until a zone has enough readings
         self.depletion_rates = {
             'nitrogen': 2.5,
             'phosphorus': 1.0,
             'potassium': 1.5
         }
-        
+
+        # Current levels assumed for zones with no readings yet
+        self.default_npk = {
+            'nitrogen': 80.0,
+            'phosphorus': 60.0,
+            'potassium': 90.0
+        }
+
         # Minimum thresholds
         self.min_thresholds = {
             'nitrogen': 40,
             'phosphorus': 30,
             'potassium': 40
         }
-    
+
     async def predict(self, zone_id: str, days_ahead: int = 14):
         """
         Predict fertilizer needs for the next N days
-        
+
         Returns predictions with:
         - date: when fertilization is needed
         - npk_forecast: predicted N, P, K levels
         - fertilization_needed: boolean
         - recommended_amounts: kg or L
         """
-        # TODO: Fetch current NPK levels from database
-        # For now, using dummy current values
-        current_npk = {
-            'nitrogen': 80,
-            'phosphorus': 60,
-            'potassium': 90
+        batch = self.predict_batch([zone_id], days_ahead)
+        return [
+            {
+                "date": date,
+                "npk_forecast": {n: batch["npk_forecast"][n][0][day] for n in NUTRIENTS},
+                "fertilization_needed": batch["fertilization_needed"][0][day],
+                "recommended_amounts": {n: batch["recommended_amounts"][n][0][day] for n in NUTRIENTS},
+                "confidence": batch["confidence"]
+            }
+            for day, date in enumerate(batch["dates"])
+        ]
+
+    def predict_batch(self, zone_ids: List[str], days_ahead: int = 14, dates: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Predict fertilizer needs for many zones at once on a shared date index
+
+        Each zone starts from its last NPK reading, projected to now with its
+        fitted depletion rates (defaults where not yet known). All days and
+        nutrients are computed as one (zone, day, nutrient) array;
+        per-zone fields are [zone][day] matrices in zone_ids order
+        """
+        level, last_day, fitted = self.table.lookup(zone_ids)
+        defaults = np.array([self.default_npk[n] for n in NUTRIENTS])
+        rates = np.where(np.isnan(fitted), [self.depletion_rates[n] for n in NUTRIENTS], fitted)
+
+        # Project the last reading forward to today
+        since_reading = np.maximum(0, datetime.now().timestamp() / SECONDS_PER_DAY - last_day)
+        current_npk = np.where(
+            np.isnan(level), defaults,
+            np.maximum(0, level - rates * np.nan_to_num(since_reading))
+        )  # (zone, nutrient)
+
+        if dates is None:
+            dates = forecast_dates(days_ahead)
+        days_elapsed = np.arange(1, days_ahead + 1)
+        thresholds = np.array([self.min_thresholds[n] for n in NUTRIENTS])
+
+        # Predict NPK levels: (zone, day, nutrient)
+        predicted_npk = np.maximum(0, current_npk[:, None, :] - rates[:, None, :] * days_elapsed[None, :, None])
+
+        # Check if fertilization is needed
+        fertilization_needed = (predicted_npk < thresholds).any(axis=2)
+
+        # Calculate recommended amounts (simplified)
+        # Target 80 mg/kg; convert to kg (assuming 100m² area, 30cm depth, 1.3 density)
+        deficit = np.maximum(0, 80 - predicted_npk)
+        recommended_amounts = np.where(fertilization_needed[:, :, None], np.round(deficit * 0.039, 2), 0)
+
+        return {
+            "dates": dates,
+            "npk_forecast": {n: np.round(predicted_npk[:, :, i], 1).tolist() for i, n in enumerate(NUTRIENTS)},
+            "fertilization_needed": fertilization_needed.tolist(),
+            "recommended_amounts": {n: recommended_amounts[:, :, i].tolist() for i, n in enumerate(NUTRIENTS)},
+            "confidence": 0.80 if len(zone_ids) and not np.isnan(fitted).any() else 0.70
         }
-        
-        predictions = []
-        current_date = datetime.now()
-        
-        for day in range(days_ahead):
-            forecast_date = current_date + timedelta(days=day)
-            days_elapsed = day + 1
-            
-            # Predict NPK levels
-            predicted_npk = {}
-            for nutrient, current_level in current_npk.items():
-                predicted_level = current_level - (self.depletion_rates[nutrient] * days_elapsed)
-                predicted_npk[nutrient] = max(0, predicted_level)
-            
-            # Check if fertilization is needed
-            fertilization_needed = any(
-                predicted_npk[nutrient] < self.min_thresholds[nutrient]
-                for nutrient in ['nitrogen', 'phosphorus', 'potassium']
-            )
-            
-            # Calculate recommended amounts (simplified)
-            if fertilization_needed:
-                recommended_amounts = {}
-                for nutrient in ['nitrogen', 'phosphorus', 'potassium']:
-                    deficit = max(0, 80 - predicted_npk[nutrient])  # Target 80 mg/kg
-                    # Convert to kg (assuming 100m² area, 30cm depth, 1.3 density)
-                    recommended_amounts[nutrient] = round(deficit * 0.039, 2)  # kg
-            else:
-                recommended_amounts = {'nitrogen': 0, 'phosphorus': 0, 'potassium': 0}
-            
-            predictions.append({
-                "date": forecast_date.isoformat(),
-                "npk_forecast": {
-                    "nitrogen": round(predicted_npk['nitrogen'], 1),
-                    "phosphorus": round(predicted_npk['phosphorus'], 1),
-                    "potassium": round(predicted_npk['potassium'], 1)
-                },
-                "fertilization_needed": fertilization_needed,
-                "recommended_amounts": recommended_amounts,
-                "confidence": 0.70
-            })
-        
-        return predictions
-    
+
+    def update(self, zone_id: str, timestamp: float, reading: Dict[str, Any], fertilized: bool = False):
+        """Incremental update from one streamed reading (epoch seconds)"""
+        self.table.update(zone_id, timestamp, [reading.get(n) for n in NUTRIENTS], fertilized)
+        self.is_trained = True
+        self.unsaved += 1
+
     def train(self, historical_data):
         """
         Train the prediction model on historical NPK data
+
+        historical_data: DataFrame or list of rows with zoneId, timestamp,
+        nitrogen, phosphorus, potassium and optionally fertilizer_events;
+        rows are replayed in time order into a fresh depletion table
         """
-        # TODO: Implement regression model for NPK depletion
         logger.info("Training fertilizer model...")
-        self.is_trained = True
+        if hasattr(historical_data, 'to_dict'):
+            historical_data = historical_data.to_dict('records')
+        rows = [(to_epoch(r.get('timestamp')), r) for r in historical_data]
+        rows.sort(key=lambda item: item[0])
+
+        self.table = NPKDepletionTable(self.table.half_life_days)
+        for timestamp, row in rows:
+            zone_id = str(row.get('zoneId', row.get('deviceId', '')))
+            self.update(zone_id, timestamp, row, bool(row.get('fertilizer_events')))
         logger.info("Fertilizer model trained successfully")
-    
+
     def save_model(self, path: str):
-        """Save trained model"""
-        pass
-    
-    def load_model(self, path: str):
-        """Load trained model"""
-        pass
+        """
+        Save the depletion table, first merging in the saved one so the
+        rates other workers learned (and saved) are kept rather than overwritten
+        """
+        if os.path.exists(path):
+            saved = NPKDepletionTable(self.table.half_life_days)
+            try:
+                saved.load(path)
+                self.table.merge(saved)
+            except (OSError, ValueError, KeyError) as e:
+                print(f"⚠️ Could not merge fertilizer table {path}, overwriting it: {e}")
+        self.table.save(path)
+        self.is_trained = len(self.table) > 0
+        self.unsaved = 0
+
+    def load_model(self, path: str) -> bool:
+        """Load the depletion table"""
+        if not os.path.exists(path):
+            return False
+        try:
+            self.table.load(path)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️ Could not load fertilizer table {path}: {e}")
+            return False
+        self.is_trained = len(self.table) > 0
+        self.unsaved = 0
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        rows = np.arange(len(self.table))
+        fitted = ~np.isnan(self.table.rates(rows)).any(axis=1) if len(rows) else np.array([])
+        return {"zones": len(self.table), "zones_fitted": int(fitted.sum()), "unsaved_updates": self.unsaved}
@@ -2,88 +2,291 @@
 Irrigation Predictor
 Uses time-series analysis to predict irrigation needs
 """
+import json
+import os
 from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Union
 import logging
 
+import numpy as np
+
+from utils.atomic_file import write_atomic
+from utils.device_state import to_epoch
+from utils.sensor_history import HistoryRef
+
 logger = logging.getLogger(__name__)
 
+# Regression inputs for the hourly moisture change (moisture is the lag-1 value)
+FEATURES = ('intercept', 'moisture', 'temperature', 'humidity')
+
+# Readings further apart than this are not used as a training pair
+MAX_GAP_HOURS = 3.0
+# A rise of more than this many points between readings is irrigation/rain
+IRRIGATION_JUMP = 5.0
+
+
+def forecast_dates(days_ahead: int) -> List[str]:
+    """Shared daily date index (ISO strings) starting now"""
+    current_date = datetime.now()
+    return [(current_date + timedelta(days=day)).isoformat() for day in range(days_ahead)]
+
+
+def _to_epoch_array(values) -> np.ndarray:
+    return np.array([to_epoch(v.isoformat() if hasattr(v, 'isoformat') else v) for v in values], dtype=float)
+
+
+def history_to_columns(historical_data) -> Dict[str, np.ndarray]:
+    """
+    Rows ([{...}]) or a DataFrame with timestamp, moisture, temperature,
+    humidity and optionally irrigation_events / zoneId -> float columns
+    """
+    if hasattr(historical_data, 'to_dict'):
+        historical_data = historical_data.to_dict('records')
+    rows = list(historical_data)
+
+    def column(key):
+        return np.array([np.nan if r.get(key) is None else float(r[key]) for r in rows], dtype=float)
+
+    return {
+        'group': np.array([str(r.get('zoneId', r.get('deviceId', ''))) for r in rows]),
+        'timestamp': _to_epoch_array([r.get('timestamp') for r in rows]),
+        'moisture': column('moisture'),
+        'temperature': column('temperature'),
+        'humidity': column('humidity'),
+        'irrigated': np.array([bool(r.get('irrigation_events')) for r in rows])
+    }
+
+
 class IrrigationPredictor:
+    """
+    Linear model of the hourly moisture change:
+        d(moisture)/h = w . [1, moisture, temperature, humidity]
+    fitted on drying intervals (irrigation/rain excluded) and rolled forward
+    hour by hour for every zone at once
+    """
+
     def __init__(self):
-        self.model = None
+        self.model = None  # {"coef", "feature_means", "n_samples", "rmse", "trained_at"}
         self.is_trained = False
-    
-    async def predict(self, zone_id: str, days_ahead: int = 7):
+
+    async def predict(self, zone_id: str, days_ahead: int = 7,
+                      current_moisture: Optional[float] = None, loss_rate: Optional[float] = None,
+                      temperature: Optional[float] = None, humidity: Optional[float] = None):
         """
         Predict irrigation needs for the next N days
-        
+
         Returns a list of predictions with:
         - date: when irrigation is needed
         - moisture_forecast: predicted moisture level
         - irrigation_needed: boolean
         - recommended_duration: seconds
         - confidence: prediction confidence
+
+        current_moisture (%), loss_rate (%/hour, observed) and the current
+        temperature/humidity replace the defaults when known
+        """
+        batch = self.predict_batch([zone_id], days_ahead,
+                                   current_moisture=[current_moisture], loss_rates=[loss_rate],
+                                   temperature=[temperature], humidity=[humidity])
+        return [
+            {
+                "date": date,
+                "moisture_forecast": batch["moisture_forecast"][0][day],
+                "irrigation_needed": batch["irrigation_needed"][0][day],
+                "recommended_duration": batch["recommended_duration"][0][day],
+                "recommended_time": batch["recommended_time"],
+                "confidence": batch["confidence"]
+            }
+            for day, date in enumerate(batch["dates"])
+        ]
+
+    def predict_batch(
+        self,
+        zone_ids: List[str],
+        days_ahead: int = 7,
+        dates: Optional[List[str]] = None,
+        current_moisture: Optional[List[Optional[float]]] = None,
+        loss_rates: Optional[List[Optional[float]]] = None,
+        temperature: Optional[List[Optional[float]]] = None,
+        humidity: Optional[List[Optional[float]]] = None
+    ) -> Dict[str, Any]:
+        """
+        Predict irrigation needs for many zones at once on a shared date index
+
+        The per-zone inputs are lists that may hold None; missing values fall
+        back to defaults. Without a trained model moisture depletes linearly
+        (observed rate, else 10%/day); with one, the zone's observed rate
+        calibrates the model's intercept.
+        Returns columnar data; per-zone fields are [zone][day] matrices in zone_ids order
         """
-        # TODO: Implement actual machine learning model
-        # For now, using rule-based predictions
-        
-        predictions = []
-        current_date = datetime.now()
-        
-        for day in range(days_ahead):
-            forecast_date = current_date + timedelta(days=day)
-            
-            # Simple heuristic: assume moisture depletes by 8-12% per day
-            # This should be replaced with actual ML model trained on historical data
-            moisture_depletion_rate = 10  # %/day
-            
-            # Simulate moisture forecast
-            days_elapsed = day + 1
-            predicted_moisture = max(0, 100 - (moisture_depletion_rate * days_elapsed))
-            
-            # Determine if irrigation is needed
-            irrigation_needed = predicted_moisture < 35
-            
-            # Calculate recommended duration
-            if irrigation_needed:
-                moisture_deficit = 60 - predicted_moisture  # Target 60%
-                # Assume irrigation rate of 1% moisture per 30 seconds
-                recommended_duration = int(moisture_deficit * 30)
-            else:
-                recommended_duration = 0
-            
-            predictions.append({
-                "date": forecast_date.isoformat(),
-                "moisture_forecast": round(predicted_moisture, 1),
-                "irrigation_needed": irrigation_needed,
-                "recommended_duration": recommended_duration,
-                "recommended_time": "06:00",  # Early morning
-                "confidence": 0.75
-            })
-        
-        return predictions
-    
-    def train(self, historical_data):
+        if dates is None:
+            dates = forecast_dates(days_ahead)
+        zones = len(zone_ids)
+        start_moisture = self._per_zone(current_moisture, zones, 100.0)
+        observed = self._per_zone(loss_rates, zones, np.nan)
+
+        if self.is_trained:
+            predicted_moisture = self._simulate(
+                start_moisture, observed,
+                self._per_zone(temperature, zones, np.nan),
+                self._per_zone(humidity, zones, np.nan),
+                days_ahead
+            )
+        else:
+            # Simple heuristic: assume moisture depletes by 8-12% per day,
+            # unless the zone's own readings show how fast it is drying
+            days_elapsed = np.arange(1, days_ahead + 1)
+            depletion_rate = np.where(np.isnan(observed), 10.0 / 24, observed) * 24  # %/day
+            predicted_moisture = np.maximum(0, start_moisture[:, None] - depletion_rate[:, None] * days_elapsed[None, :])
+
+        # Determine if irrigation is needed
+        irrigation_needed = predicted_moisture < 35
+
+        # Calculate recommended duration
+        # Target 60%, assume irrigation rate of 1% moisture per 30 seconds
+        recommended_duration = np.where(irrigation_needed, ((60 - predicted_moisture) * 30).astype(int), 0)
+
+        return {
+            "dates": dates,
+            "moisture_forecast": np.round(predicted_moisture, 1).tolist(),
+            "irrigation_needed": irrigation_needed.tolist(),
+            "recommended_duration": recommended_duration.tolist(),
+            "recommended_time": "06:00",  # Early morning
+            "confidence": 0.85 if self.is_trained else 0.75
+        }
+
+    def _simulate(self, moisture, observed, temperature, humidity, days_ahead) -> np.ndarray:
+        """Roll the hourly model forward for all zones; returns [zone][day] moisture at day ends"""
+        coef = np.asarray(self.model["coef"])
+        means = dict(zip(FEATURES, self.model["feature_means"]))
+        temperature = np.where(np.isnan(temperature), means['temperature'], temperature)
+        humidity = np.where(np.isnan(humidity), means['humidity'], humidity)
+
+        # Terms that don't change during the rollout (weather held at current values)
+        fixed = coef[0] + coef[2] * temperature + coef[3] * humidity
+        # Shift each zone so the model's current rate matches the observed one
+        fixed = fixed + np.where(np.isnan(observed), 0.0, -observed - (fixed + coef[1] * moisture))
+
+        moisture = moisture.astype(float).copy()
+        out = np.empty((len(moisture), days_ahead))
+        for hour in range(1, days_ahead * 24 + 1):
+            moisture = np.clip(moisture + fixed + coef[1] * moisture, 0, 100)
+            if hour % 24 == 0:
+                out[:, hour // 24 - 1] = moisture
+        return out
+
+    @staticmethod
+    def _per_zone(values: Optional[List[Optional[float]]], zones: int, default: float) -> np.ndarray:
+        if values is None:
+            return np.full(zones, default)
+        return np.array([default if v is None else v for v in values], dtype=float)
+
+    def train(self, historical_data) -> bool:
         """
         Train the prediction model on historical data
-        
-        historical_data: DataFrame with columns:
+
+        historical_data: DataFrame or list of rows with columns:
         - timestamp
         - moisture
         - temperature
         - humidity
         - irrigation_events
+        - zoneId (optional; readings are paired within a zone)
         """
-        # TODO: Implement Prophet or LSTM training
+        return self.fit_columns(**history_to_columns(historical_data))
+
+    def fit_columns(self, group, timestamp, moisture, temperature, humidity, irrigated=None, ridge: float = 1e-3) -> bool:
+        """Columnar training entry point (NumPy arrays of equal length)"""
         logger.info("Training irrigation model...")
+        if irrigated is None:
+            irrigated = np.zeros(len(timestamp), dtype=bool)
+        order = np.lexsort((timestamp, group))
+        group, timestamp, moisture, temperature, humidity, irrigated = (
+            np.asarray(a)[order] for a in (group, timestamp, moisture, temperature, humidity, irrigated)
+        )
+
+        # Consecutive pairs within a group -> hourly rate from the earlier reading's state
+        dt = np.diff(timestamp) / 3600
+        rate = np.diff(moisture) / np.where(dt > 0, dt, np.nan)
+        valid = (
+            (group[1:] == group[:-1]) & (dt > 0) & (dt <= MAX_GAP_HOURS)
+            & ~irrigated[1:] & (np.diff(moisture) <= IRRIGATION_JUMP)
+            & ~np.isnan(rate) & ~np.isnan(moisture[:-1])
+        )
+        if valid.sum() < 24:
+            logger.info("Not enough drying intervals to train irrigation model (%d)", valid.sum())
+            return False
+
+        x_moisture = moisture[:-1][valid]
+        x_temperature = temperature[:-1][valid]
+        x_humidity = humidity[:-1][valid]
+        y = rate[valid]
+        feature_means = [1.0, float(np.mean(x_moisture)),
+                         float(np.nanmean(x_temperature)) if np.any(~np.isnan(x_temperature)) else 28.0,
+                         float(np.nanmean(x_humidity)) if np.any(~np.isnan(x_humidity)) else 70.0]
+        X = np.column_stack([
+            np.ones(len(y)),
+            x_moisture,
+            np.where(np.isnan(x_temperature), feature_means[2], x_temperature),
+            np.where(np.isnan(x_humidity), feature_means[3], x_humidity)
+        ])
+
+        # Ridge-regularized least squares (intercept not penalized)
+        penalty = ridge * len(y) * np.diag([0.0, 1.0, 1.0, 1.0])
+        coef = np.linalg.solve(X.T @ X + penalty, X.T @ y)
+        rmse = float(np.sqrt(np.mean((X @ coef - y) ** 2)))
+
+        self.model = {
+            "features": list(FEATURES),
+            "coef": coef.tolist(),
+            "feature_means": feature_means,
+            "n_samples": int(len(y)),
+            "rmse": round(rmse, 4),
+            "trained_at": datetime.now().isoformat()
+        }
         self.is_trained = True
         logger.info("Irrigation model trained successfully")
-    
+        return True
+
     def save_model(self, path: str):
-        """Save trained model to disk"""
-        # TODO: Implement model persistence
-        pass
-    
-    def load_model(self, path: str):
+        """Save trained model to disk (a few hundred bytes of JSON)"""
+        if not self.is_trained:
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # Unique temp file: an API-triggered retrain can save alongside another worker's
+        write_atomic(path, json.dumps(self.model))
+
+    def load_model(self, path: str) -> bool:
         """Load trained model from disk"""
-        # TODO: Implement model loading
-        pass
+        try:
+            with open(path, encoding="utf-8") as f:
+                model = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Could not load irrigation model {path}: {e}")
+            return False
+        if model.get("features") != list(FEATURES):
+            print(f"⚠️ Irrigation model {path} has different features, ignoring")
+            return False
+        self.model = model
+        self.is_trained = True
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        if not self.is_trained:
+            return {"trained": False}
+        return {"trained": True, **{k: self.model[k] for k in ("n_samples", "rmse", "trained_at")}}
+
+
+def train_irrigation_model(path: str, columns: Union[Dict[str, np.ndarray], HistoryRef]) -> Dict[str, Any]:
+    """
+    Fit on columnar history (or a HistoryRef, read from disk in this process)
+    and save; module-level so it can run in a process pool worker
+    """
+    if isinstance(columns, HistoryRef):
+        columns = columns.load()
+    predictor = IrrigationPredictor()
+    if predictor.fit_columns(**columns):
+        predictor.save_model(path)
+    return predictor.stats()
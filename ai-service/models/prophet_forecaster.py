@@ -4,26 +4,58 @@ Uses Facebook Prophet for accurate multi-day moisture forecasting
 """
 import random
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Union
 
-# Pandas/Numpy import with fallback
+import numpy as np
+
+from utils.sensor_history import HistoryRef
+
+# Pandas import with fallback (numpy is a hard requirement)
 try:
     import pandas as pd
-    import numpy as np
     LIBS_AVAILABLE = True
 except ImportError:
     LIBS_AVAILABLE = False
-    print("⚠️ Pandas/Numpy not installed. Using pure Python fallback.")
+    print("⚠️ Pandas not installed. Using pure Python fallback.")
 
 # Prophet import with fallback
 try:
     from prophet import Prophet
+    from prophet.serialize import model_to_json, model_from_json
     PROPHET_AVAILABLE = True
 except ImportError:
     PROPHET_AVAILABLE = False
     print("⚠️ Prophet not installed. Using rule-based fallback.")
 
 
+# Rows, columnar arrays, or a pointer into the on-disk history store
+SensorHistory = Union[List[Dict[str, Any]], Dict[str, Any], HistoryRef]
+
+# Forecasts up to this many days ahead train on hourly means, longer ones on daily means
+DAILY_TRAINING_HORIZON_DAYS = 14
+
+PREDICTION_FIELDS = ["timestamp", "predicted_moisture", "lower_bound", "upper_bound", "confidence"]
+
+
+def training_resolution(days_ahead: int) -> str:
+    """
+    History rollup to train on for a horizon: hourly means match Prophet's
+    hourly output grid, multi-week horizons only need daily means
+    """
+    return "daily" if days_ahead > DAILY_TRAINING_HORIZON_DAYS else "hourly"
+
+
+def rows_to_columns(rows: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    """[{field: value}, ...] -> {field: [values]}"""
+    return {field: [row[field] for row in rows] for field in PREDICTION_FIELDS}
+
+
+def columns_to_rows(columns: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """{field: [values]} -> [{field: value}, ...]"""
+    fields = list(columns)
+    return [dict(zip(fields, values)) for values in zip(*(columns[f] for f in fields))]
+
+
 class ProphetForecaster:
     """
     Time-series forecaster using Facebook Prophet
@@ -34,11 +66,17 @@ class ProphetForecaster:
         self.model = None
         self.is_trained = False
         
-    def prepare_training_data(self, sensor_history: List[Dict[str, Any]]):
+    def prepare_training_data(self, sensor_history: SensorHistory):
         """
         Convert sensor history to Prophet-compatible format
         Prophet requires 'ds' (datestamp) and 'y' (value) columns
+        Accepts rows, {"timestamp": epoch seconds, "moisture": ...} arrays,
+        or a HistoryRef into the on-disk history store
         """
+        if isinstance(sensor_history, HistoryRef):
+            sensor_history = sensor_history.load()
+        if isinstance(sensor_history, dict):
+            return self._columns_to_frame(sensor_history) if LIBS_AVAILABLE else None
         if not sensor_history or not LIBS_AVAILABLE:
             return None
         
@@ -54,9 +92,21 @@ class ProphetForecaster:
         
         return df[['ds', 'y']]
     
-    def train(self, sensor_history: List[Dict[str, Any]]) -> bool:
+    @staticmethod
+    def _columns_to_frame(columns: Dict[str, Any]):
+        """Columnar history -> ds/y frame (local naive datetimes, like the ISO rows); missing readings dropped"""
+        if len(columns.get('timestamp', ())) == 0 or 'moisture' not in columns:
+            return pd.DataFrame(columns=['ds', 'y'])
+        timestamps = np.asarray(columns['timestamp'], dtype=float)
+        moisture = np.asarray(columns['moisture'], dtype=float)
+        present = ~np.isnan(moisture)
+        ds = pd.to_datetime(timestamps[present], unit='s', utc=True).tz_convert(datetime.now().astimezone().tzinfo).tz_localize(None)
+        return pd.DataFrame({'ds': ds, 'y': moisture[present]})
+    
+    def train(self, sensor_history: SensorHistory, init: Optional[Dict[str, Any]] = None) -> bool:
         """
         Train Prophet model on historical sensor data
+        init: fitted parameters of a previous model to warm-start from
         Returns True if training successful
         """
         if not PROPHET_AVAILABLE:
@@ -65,54 +115,98 @@ class ProphetForecaster:
         
         df = self.prepare_training_data(sensor_history)
         
-        if len(df) < 10:  # Need minimum data points
-            print(f"Insufficient data for training: {len(df)} points")
+        if df is None or len(df) < 10:  # Need minimum data points
+            print(f"Insufficient data for training: {0 if df is None else len(df)} points")
             return False
         
         try:
-            self.model = Prophet(
-                yearly_seasonality=True,
-                weekly_seasonality=True,
-                daily_seasonality=True,
-                changepoint_prior_scale=0.05
-            )
-            self.model.fit(df)
+            try:
+                self.model = self._new_model()
+                fit_kwargs = {"init": init} if init else {}
+                self.model.fit(df, **fit_kwargs)
+            except Exception as e:
+                if not init:
+                    raise
+                # Warm start only works if the parameter shapes still match
+                print(f"⚠️ Warm start failed ({e}), refitting from scratch")
+                self.model = self._new_model()
+                self.model.fit(df)
             self.is_trained = True
-            print(f"✅ Prophet model trained on {len(df)} data points")
+            print(f"✅ Prophet model trained on {len(df)} data points{' (warm start)' if init else ''}")
             return True
         except Exception as e:
             print(f"❌ Prophet training failed: {e}")
             return False
     
+    def _new_model(self):
+        return Prophet(
+            yearly_seasonality=True,
+            weekly_seasonality=True,
+            daily_seasonality=True,
+            changepoint_prior_scale=0.05
+        )
+    
+    def warm_start_params(self) -> Optional[Dict[str, Any]]:
+        """Fitted parameters in the form Prophet.fit(init=...) expects"""
+        if not (self.is_trained and self.model):
+            return None
+        params = self.model.params
+        init = {name: params[name][0][0] for name in ['k', 'm', 'sigma_obs']}
+        init.update({name: params[name][0] for name in ['delta', 'beta']})
+        return init
+    
+    def to_json(self) -> Optional[str]:
+        """Serialize the fitted model"""
+        if not (PROPHET_AVAILABLE and self.is_trained and self.model):
+            return None
+        return model_to_json(self.model)
+    
+    def load_json(self, serialized: str) -> bool:
+        """Restore a model serialized with to_json"""
+        if not PROPHET_AVAILABLE:
+            return False
+        try:
+            self.model = model_from_json(serialized)
+            self.is_trained = True
+            return True
+        except Exception as e:
+            print(f"❌ Could not load Prophet model: {e}")
+            return False
+    
     def predict(self, days_ahead: int = 7) -> List[Dict[str, Any]]:
         """
         Generate predictions for the next N days
         """
+        return columns_to_rows(self.predict_columns(days_ahead))
+    
+    def predict_columns(self, days_ahead: int = 7) -> Dict[str, List[Any]]:
+        """
+        Same predictions as predict(), as one list per field
+        {"timestamp": [...], "predicted_moisture": [...], "lower_bound": [...], ...}
+        """
         if PROPHET_AVAILABLE and LIBS_AVAILABLE and self.is_trained and self.model:
             return self._prophet_predict(days_ahead)
         else:
-            return self._fallback_predict(days_ahead)
+            return rows_to_columns(self._fallback_predict(days_ahead))
     
-    def _prophet_predict(self, days_ahead: int) -> List[Dict[str, Any]]:
-        """Use trained Prophet model for predictions"""
-        future = self.model.make_future_dataframe(periods=days_ahead * 24, freq='H')
-        forecast = self.model.predict(future)
+    def _prophet_predict(self, days_ahead: int) -> Dict[str, List[Any]]:
+        """Use trained Prophet model for predictions (future rows only, columnar)"""
+        future = self.model.make_future_dataframe(periods=days_ahead * 24, freq='h', include_history=False)
         
-        # Get only future predictions
-        now = datetime.now()
-        future_forecast = forecast[forecast['ds'] > now]
-        
-        predictions = []
-        for _, row in future_forecast.iterrows():
-            predictions.append({
-                "timestamp": row['ds'].isoformat(),
-                "predicted_moisture": max(0, min(100, row['yhat'])),
-                "lower_bound": max(0, row['yhat_lower']),
-                "upper_bound": min(100, row['yhat_upper']),
-                "confidence": 0.85
-            })
+        # Only predict what we return: future timestamps
+        future = future[future['ds'] > datetime.now()]
+        if len(future) == 0:
+            return rows_to_columns([])
+        forecast = self.model.predict(future)
         
-        return predictions
+        yhat = forecast['yhat'].to_numpy(dtype=float)
+        return {
+            "timestamp": np.datetime_as_string(forecast['ds'].to_numpy(), unit='s').tolist(),
+            "predicted_moisture": np.clip(yhat, 0, 100).tolist(),
+            "lower_bound": np.maximum(0, forecast['yhat_lower'].to_numpy(dtype=float)).tolist(),
+            "upper_bound": np.minimum(100, forecast['yhat_upper'].to_numpy(dtype=float)).tolist(),
+            "confidence": [0.85] * len(yhat)
+        }
     
     def _fallback_predict(self, days_ahead: int) -> List[Dict[str, Any]]:
         """Rule-based fallback when Prophet unavailable"""
@@ -140,23 +234,43 @@ class WeatherAwareMoisturePredictor:
     Advanced moisture predictor that incorporates weather forecasts
     """
     
-    def __init__(self, weather_service=None):
+    def __init__(self, weather_service=None, model_registry=None, forecast_pool=None):
         self.prophet_forecaster = ProphetForecaster()
         self.weather_service = weather_service
+        self.model_registry = model_registry
+        self.forecast_pool = forecast_pool
         
     async def predict_with_weather(
         self, 
-        sensor_history: List[Dict[str, Any]],
+        sensor_history: SensorHistory,
         lat: float,
         lon: float,
-        days_ahead: int = 7
+        days_ahead: int = 7,
+        zone_id: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Generate moisture predictions enhanced with weather data
+        With a model registry and zone_id, the zone's persisted model is
+        reused and only retrained when it is stale. With a forecast pool,
+        fitting and prediction run in a worker process (may raise PoolSaturated)
         """
         # Get base predictions
-        self.prophet_forecaster.train(sensor_history)
-        base_predictions = self.prophet_forecaster.predict(days_ahead)
+        if self.model_registry and zone_id and self.forecast_pool and PROPHET_AVAILABLE:
+            from models.prophet_registry import forecast_zone
+            registry = self.model_registry
+            result = await self.forecast_pool.run(
+                (zone_id, days_ahead), forecast_zone,
+                registry.model_dir, zone_id, sensor_history, days_ahead,
+                registry.min_new_points, registry.max_age_hours
+            )
+            base_predictions, is_trained = result["predictions"], result["is_trained"]
+        else:
+            if self.model_registry and zone_id:
+                forecaster = self.model_registry.get_trained(zone_id, sensor_history)
+            else:
+                forecaster = self.prophet_forecaster
+                forecaster.train(sensor_history)
+            base_predictions, is_trained = forecaster.predict_columns(days_ahead), forecaster.is_trained
         
         # Get weather forecast if available
         weather_data = None
@@ -164,42 +278,71 @@ class WeatherAwareMoisturePredictor:
             weather_data = await self.weather_service.get_forecast(lat, lon, days_ahead)
         
         # Adjust predictions based on weather
-        adjusted_predictions = self._adjust_for_weather(base_predictions, weather_data)
+        adjusted = self._adjust_for_weather(base_predictions, weather_data)
+        predictions = columns_to_rows({field: adjusted[field] for field in PREDICTION_FIELDS})
+        for flag in ('rain_boost', 'heat_stress'):
+            for i in np.flatnonzero(adjusted.get(flag, ())):
+                predictions[i][flag] = True
         
         return {
-            "predictions": adjusted_predictions,
+            "predictions": predictions,
             "weather_data": weather_data,
-            "model_type": "prophet" if self.prophet_forecaster.is_trained else "rule_based"
+            "model_type": "prophet" if is_trained else "rule_based"
         }
     
+    @staticmethod
+    def _weather_days(weather_forecast: List[Dict[str, Any]]):
+        """
+        Daily forecast -> ({"YYYY-MM-DD": position}, is_raining, temp_max) to
+        join predictions against; the first entry wins for a repeated date
+        """
+        day_index: Dict[str, int] = {}
+        raining, temp_max = [], []
+        for wx in weather_forecast:
+            date = str(wx.get('date') or '')[:10]
+            if date and date not in day_index:
+                day_index[date] = len(raining)
+                raining.append(bool(wx.get('is_raining', False)))
+                temp_max.append(28.0 if wx.get('temp_max') is None else float(wx['temp_max']))
+        return day_index, np.array(raining, dtype=bool), np.array(temp_max)
+    
     def _adjust_for_weather(
         self, 
-        predictions: List[Dict], 
+        predictions: Dict[str, List[Any]], 
         weather: Optional[Dict]
-    ) -> List[Dict]:
+    ) -> Dict[str, Any]:
         """
-        Adjust moisture predictions based on weather forecast
+        Adjust moisture predictions (columnar) based on weather forecast
         Rain increases predicted moisture, heat decreases it
+        Each prediction takes the weather of its own calendar day, so hourly
+        predictions all pick up their day's forecast; predictions on days
+        without a forecast are left as they are. Adds boolean 'rain_boost'
+        and 'heat_stress' columns
         """
-        if not weather or 'forecast' not in weather:
+        if not weather or 'forecast' not in weather or not len(predictions['timestamp']):
             return predictions
         
-        weather_forecast = weather['forecast']
-        
-        for i, pred in enumerate(predictions):
-            if i < len(weather_forecast):
-                wx = weather_forecast[i]
-                
-                # Rain adjustment: +15% moisture if raining
-                if wx.get('is_raining', False):
-                    pred['predicted_moisture'] = min(100, pred['predicted_moisture'] + 15)
-                    pred['rain_boost'] = True
-                
-                # Heat adjustment: -5% per degree above 30°C
-                temp_max = wx.get('temp_max', 28)
-                if temp_max > 30:
-                    heat_penalty = (temp_max - 30) * 5
-                    pred['predicted_moisture'] = max(10, pred['predicted_moisture'] - heat_penalty)
-                    pred['heat_stress'] = True
+        day_index, raining, temp_max = self._weather_days(weather['forecast'])
+        if not day_index:
+            return predictions
         
-        return predictions
+        # Join each prediction to the forecast for its date (-1 = no forecast that day)
+        timestamps = predictions['timestamp']
+        index = np.fromiter((day_index.get(ts[:10], -1) for ts in timestamps), dtype=int, count=len(timestamps))
+        matched = index >= 0
+        rain = matched & raining[index]
+        day_temp = np.where(matched, temp_max[index], 28.0)
+        
+        moisture = np.asarray(predictions['predicted_moisture'], dtype=float)
+        # Rain adjustment: +15% moisture if raining
+        moisture = np.where(rain, np.minimum(100, moisture + 15), moisture)
+        # Heat adjustment: -5% per degree above 30°C
+        heat = day_temp > 30
+        moisture = np.where(heat, np.maximum(10, moisture - (day_temp - 30) * 5), moisture)
+        
+        return {
+            **predictions,
+            'predicted_moisture': moisture.tolist(),
+            'rain_boost': rain,
+            'heat_stress': heat
+        }
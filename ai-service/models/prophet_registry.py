@@ -0,0 +1,184 @@
+"""
+Prophet Model Registry
+Keeps one fitted Prophet model per zone, persisted to disk and retrained
+only when enough new data has arrived or the model has gone stale
+"""
+import json
+import os
+import re
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+from models.prophet_forecaster import ProphetForecaster, PROPHET_AVAILABLE, SensorHistory
+from utils.atomic_file import write_atomic
+from utils.sensor_history import HistoryRef
+
+
+class ProphetModelRegistry:
+    """
+    Per-zone Prophet models
+
+    Layout in model_dir:
+        <zone>.prophet.json  serialized model (prophet.serialize)
+        <zone>.meta.json     {"trained_at", "n_points", "last_ds"}
+
+    Metadata is indexed at startup; the (larger) model files are only read
+    the first time a zone is used. Both files are replaced atomically (model
+    first), so concurrent writers never leave a torn file behind.
+    """
+
+    def __init__(self, model_dir: str, min_new_points: int = 48, max_age_hours: float = 24):
+        self.model_dir = model_dir
+        self.min_new_points = min_new_points
+        self.max_age_hours = max_age_hours
+        self._models: Dict[str, ProphetForecaster] = {}
+        self._meta: Dict[str, Dict[str, Any]] = {}
+        self.retrains = 0
+        self.reuses = 0
+        self._load_index()
+
+    def _paths(self, zone_id: str):
+        name = re.sub(r"[^A-Za-z0-9_.-]", "_", zone_id)
+        base = os.path.join(self.model_dir, name)
+        return f"{base}.prophet.json", f"{base}.meta.json"
+
+    def _load_index(self):
+        if not os.path.isdir(self.model_dir):
+            return
+        for filename in os.listdir(self.model_dir):
+            if not filename.endswith(".meta.json"):
+                continue
+            try:
+                with open(os.path.join(self.model_dir, filename), encoding="utf-8") as f:
+                    meta = json.load(f)
+                self._meta[meta["zone_id"]] = meta
+            except (OSError, ValueError, KeyError) as e:
+                print(f"⚠️ Skipping unreadable model metadata {filename}: {e}")
+        if self._meta:
+            print(f"✅ Indexed {len(self._meta)} saved Prophet models in {self.model_dir}")
+
+    def refresh(self, zone_id: str):
+        """Pick up a model another process saved since we last loaded it"""
+        _, meta_path = self._paths(zone_id)
+        try:
+            with open(meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return
+        current = self._meta.get(zone_id)
+        if not current or current.get("trained_at") != meta.get("trained_at"):
+            self._meta[zone_id] = meta
+            self._models.pop(zone_id, None)
+
+    def get(self, zone_id: str) -> Optional[ProphetForecaster]:
+        """Fitted forecaster for zone, loading it from disk on first use"""
+        forecaster = self._models.get(zone_id)
+        if forecaster is None and zone_id in self._meta:
+            model_path, _ = self._paths(zone_id)
+            try:
+                with open(model_path, encoding="utf-8") as f:
+                    forecaster = ProphetForecaster()
+                    if forecaster.load_json(f.read()):
+                        self._models[zone_id] = forecaster
+                    else:
+                        forecaster = None
+            except OSError as e:
+                print(f"⚠️ Could not read model for zone {zone_id}: {e}")
+                forecaster = None
+        return forecaster
+
+    def needs_retrain(self, zone_id: str, sensor_history: SensorHistory) -> bool:
+        meta = self._meta.get(zone_id)
+        if meta is None or self.get(zone_id) is None:
+            return True
+        age_hours = (datetime.now() - datetime.fromisoformat(meta["trained_at"])).total_seconds() / 3600
+        if age_hours > self.max_age_hours:
+            return True
+        return self._count_new_points(meta, sensor_history) >= self.min_new_points
+
+    def _count_new_points(self, meta: Dict[str, Any], sensor_history: SensorHistory) -> int:
+        df = ProphetForecaster().prepare_training_data(sensor_history)
+        if df is None or len(df) == 0:
+            return 0
+        if not meta.get("last_ds"):
+            return len(df)
+        return int((df["ds"] > datetime.fromisoformat(meta["last_ds"])).sum())
+
+    def get_trained(self, zone_id: str, sensor_history: SensorHistory) -> ProphetForecaster:
+        """
+        Return the zone's model, retraining (warm-started from the previous
+        fit) only when it is missing, too old, or enough new points arrived
+        """
+        if not PROPHET_AVAILABLE:
+            return ProphetForecaster()
+        if isinstance(sensor_history, HistoryRef):
+            sensor_history = sensor_history.load()  # map the chunks once for the check and the fit
+
+        if not self.needs_retrain(zone_id, sensor_history):
+            self.reuses += 1
+            return self._models[zone_id]
+
+        previous = self.get(zone_id)
+        forecaster = ProphetForecaster()
+        init = previous.warm_start_params() if previous else None
+        if forecaster.train(sensor_history, init=init):
+            self.retrains += 1
+            self._save(zone_id, forecaster)
+            return forecaster
+        # Not enough data to (re)fit - keep serving the previous model if any
+        return previous or forecaster
+
+    def _save(self, zone_id: str, forecaster: ProphetForecaster):
+        self._models[zone_id] = forecaster
+        history = forecaster.model.history
+        meta = {
+            "zone_id": zone_id,
+            "trained_at": datetime.now().isoformat(),
+            "n_points": int(len(history)),
+            "last_ds": history["ds"].max().isoformat()
+        }
+        self._meta[zone_id] = meta
+        model_path, meta_path = self._paths(zone_id)
+        try:
+            os.makedirs(self.model_dir, exist_ok=True)
+            write_atomic(model_path, forecaster.to_json())
+            write_atomic(meta_path, json.dumps(meta))
+        except OSError as e:
+            print(f"⚠️ Could not persist model for zone {zone_id}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model_dir": self.model_dir,
+            "zones": len(self._meta),
+            "loaded": len(self._models),
+            "retrains": self.retrains,
+            "reuses": self.reuses
+        }
+
+
+# Registries owned by forecast pool worker processes (one per model_dir)
+_worker_registries: Dict[str, ProphetModelRegistry] = {}
+
+
+def forecast_zone(
+    model_dir: str,
+    zone_id: str,
+    sensor_history: SensorHistory,
+    days_ahead: int,
+    min_new_points: int,
+    max_age_hours: float
+) -> Dict[str, Any]:
+    """
+    Fit-or-reuse the zone's model and predict (columnar). Module-level and
+    returning plain data so it can run in a process pool worker
+    """
+    registry = _worker_registries.get(model_dir)
+    if registry is None:
+        registry = ProphetModelRegistry(model_dir, min_new_points, max_age_hours)
+        _worker_registries[model_dir] = registry
+    registry.refresh(zone_id)
+    forecaster = registry.get_trained(zone_id, sensor_history)
+    return {
+        "predictions": forecaster.predict_columns(days_ahead),
+        "is_trained": forecaster.is_trained
+    }
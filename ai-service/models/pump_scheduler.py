@@ -0,0 +1,191 @@
+"""
+Pump Scheduler
+Turns zone water allocations into a non-overlapping pump timeline and an
+ordered command queue for the backend to dispatch
+"""
+import heapq
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def preferred_window(now: datetime, start_time: str, window_minutes: float):
+    """
+    (begin, end) of the preferred window ("HH:MM" + minutes): from now if we
+    are inside today's window, else its next occurrence
+    """
+    if window_minutes <= 0:
+        raise ValueError("window_minutes must be positive")
+    hour, minute = (int(part) for part in start_time.split(":"))
+    start = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    length = timedelta(minutes=window_minutes)
+    if start <= now and now >= start + length:
+        start += timedelta(days=1)
+    return max(start, now.replace(microsecond=0)), start + length
+
+
+class PumpScheduler:
+    """
+    List scheduling on a discrete-event clock
+
+    - a pump waters one zone at a time (zones sharing a pump run back to back)
+    - at most max_concurrent pumps run at once, and at most
+      circuits[c]["maxConcurrent"] on each power circuit
+    - runs start at the preferred window and must end inside it; zones that
+      don't fit are returned as deferred
+    - higher-priority zones start first whenever a slot frees up
+    """
+
+    def __init__(self, max_concurrent: int = 2, window_start: str = "06:00", window_minutes: float = 120):
+        self.max_concurrent = max_concurrent
+        self.window_start = window_start
+        self.window_minutes = window_minutes
+
+    def schedule(
+        self,
+        allocation: Dict[str, Dict[str, Any]],
+        zones: List[Dict[str, Any]],
+        pumps: Optional[Dict[str, Dict[str, Any]]] = None,
+        circuits: Optional[Dict[str, Dict[str, Any]]] = None,
+        busy_until: Optional[Dict[str, datetime]] = None,
+        max_concurrent: Optional[int] = None,
+        window_start: Optional[str] = None,
+        window_minutes: Optional[float] = None,
+        now: Optional[datetime] = None
+    ) -> Dict[str, Any]:
+        """
+        Args:
+            allocation: ZoneOptimizer allocation ({zoneId: {"duration", "waterAllocated", "priorityScore"}})
+            zones: zone data; pumpId defaults to the zoneId (one pump per zone)
+            pumps: {pumpId: {"circuit": name}}
+            circuits: {name: {"maxConcurrent": n}}
+            busy_until: {pumpId: datetime} pumps already running (e.g. a fertilizer dose)
+
+        Returns:
+            commands (ordered queue), timeline per pump, deferred zones, peakConcurrent
+        """
+        pumps = pumps or {}
+        circuits = circuits or {}
+        busy_until = busy_until or {}
+        max_concurrent = max_concurrent or self.max_concurrent
+        window_start = window_start or self.window_start
+        window_minutes = self.window_minutes if window_minutes is None else window_minutes
+
+        begin, end = preferred_window(now or datetime.now(), window_start, window_minutes)
+        horizon = (end - begin).total_seconds()
+
+        # Per-pump queues of (−priority, zone order, zoneId, duration), best first
+        pump_of = {zone.get('zoneId'): zone.get('pumpId') or zone.get('zoneId') for zone in zones}
+        queues: Dict[str, List] = {}
+        for order, (zone_id, plan) in enumerate(allocation.items()):
+            if plan.get('duration', 0) > 0:
+                pump_id = pump_of.get(zone_id, zone_id)
+                heapq.heappush(queues.setdefault(pump_id, []), (-plan.get('priorityScore', 0), order, zone_id, int(plan['duration'])))
+
+        circuit_of = {pump_id: pumps.get(pump_id, {}).get('circuit') for pump_id in queues}
+        circuit_limit = {name: int(c.get('maxConcurrent', max_concurrent)) for name, c in circuits.items()}
+        pump_free = {
+            pump_id: max(0.0, (busy_until[pump_id] - begin).total_seconds()) if pump_id in busy_until else 0.0
+            for pump_id in queues
+        }
+
+        running: List = []  # heap of (end offset, pump_id)
+        circuit_load: Dict[str, int] = {}
+        timeline: Dict[str, List[Dict[str, Any]]] = {}
+        runs: List[tuple] = []
+        deferred: List[Dict[str, Any]] = []
+        peak = 0
+        clock = 0.0
+
+        while any(queues.values()):
+            # Candidates: idle pumps with pending work whose circuit has room, best zone first
+            candidates = []
+            busy = {pump_id for _, pump_id in running}
+            for pump_id, queue in queues.items():
+                if not queue or pump_id in busy or pump_free[pump_id] > clock:
+                    continue
+                circuit = circuit_of[pump_id]
+                if circuit is not None and circuit_load.get(circuit, 0) >= circuit_limit.get(circuit, max_concurrent):
+                    continue
+                candidates.append((queue[0], pump_id))
+            candidates.sort()
+
+            started_or_deferred = False
+            for (neg_priority, _, zone_id, duration), pump_id in candidates:
+                if len(running) >= max_concurrent:
+                    break
+                circuit = circuit_of[pump_id]
+                if circuit is not None and circuit_load.get(circuit, 0) >= circuit_limit.get(circuit, max_concurrent):
+                    continue
+                heapq.heappop(queues[pump_id])
+                started_or_deferred = True
+                if clock + duration > horizon:
+                    deferred.append({"zoneId": zone_id, "pumpId": pump_id, "duration": duration,
+                                     "reason": "Does not fit in the irrigation window"})
+                    continue
+                heapq.heappush(running, (clock + duration, pump_id))
+                if circuit is not None:
+                    circuit_load[circuit] = circuit_load.get(circuit, 0) + 1
+                runs.append((clock, clock + duration, zone_id, pump_id, -neg_priority))
+                timeline.setdefault(pump_id, []).append({
+                    "zoneId": zone_id,
+                    "start": (begin + timedelta(seconds=clock)).isoformat(),
+                    "end": (begin + timedelta(seconds=clock + duration)).isoformat(),
+                    "duration": duration
+                })
+            peak = max(peak, len(running))
+            if started_or_deferred and len(running) < max_concurrent:
+                continue  # a deferral may have freed a slot at this same instant
+
+            # Advance to the next event: a run ending or a busy pump becoming free
+            next_times = [t for t in pump_free.values() if t > clock]
+            if running:
+                next_times.append(running[0][0])
+            if not next_times:
+                if any(queues.values()) and not running:
+                    # Nothing can ever start (e.g. a circuit limit of 0)
+                    for pump_id, queue in queues.items():
+                        while queue:
+                            _, _, zone_id, duration = heapq.heappop(queue)
+                            deferred.append({"zoneId": zone_id, "pumpId": pump_id, "duration": duration,
+                                             "reason": "No pump slot available"})
+                break
+            clock = min(next_times)
+            while running and running[0][0] <= clock:
+                _, pump_id = heapq.heappop(running)
+                circuit = circuit_of[pump_id]
+                if circuit is not None:
+                    circuit_load[circuit] -= 1
+
+        return {
+            "windowStart": begin.isoformat(),
+            "windowEnd": end.isoformat(),
+            "commands": self._command_queue(begin, runs),
+            "timeline": timeline,
+            "deferred": deferred,
+            "peakConcurrent": peak
+        }
+
+    @staticmethod
+    def _command_queue(begin: datetime, runs: List[tuple]) -> List[Dict[str, Any]]:
+        """ON/OFF commands in dispatch order; at equal times OFF goes first so limits hold during handover"""
+        events = []
+        for start, stop, zone_id, pump_id, priority in runs:
+            duration = int(stop - start)
+            events.append((stop, 0, -priority, zone_id, pump_id, "OFF", 0))
+            events.append((start, 1, -priority, zone_id, pump_id, "ON", duration))
+        events.sort(key=lambda e: e[:3])
+        return [
+            {
+                "sequence": sequence,
+                "at": (begin + timedelta(seconds=offset)).isoformat(),
+                "offsetSeconds": int(offset),
+                "type": "irrigation",
+                "deviceId": zone_id,
+                "pumpId": pump_id,
+                "command": {"type": "WATER", "status": status, "duration": duration}
+            }
+            for sequence, (offset, _, _, zone_id, pump_id, status, duration) in enumerate(events)
+        ]
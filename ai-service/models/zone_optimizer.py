@@ -3,18 +3,42 @@ Zone Optimizer
 Optimizes water and fertilizer distribution across multiple zones
 """
 import logging
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
+
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
 class ZoneOptimizer:
-    def __init__(self):
-        pass
-    
-    def optimize_allocation(self, zones: List[Dict[str, Any]]):
+    """
+    Water allocation as a linear program:
+
+        maximize    sum_i  value_i * water_i
+        subject to  0 <= water_i <= need_i
+                    sum_i water_i            <= water budget
+                    sum_(i on pump p) water_i <= flow_p * window   (per pump)
+
+    value_i is the zone's priority score per litre. Pump groups nest inside
+    the farm-wide budget (a laminar family), so filling zones in order of
+    value per litre is an exact LP optimum - no solver needed, and both
+    capacity passes are NumPy cumulative sums.
+    """
+
+    def __init__(self, water_budget: float = 1000, default_flow_rate: float = 5, window_minutes: Optional[float] = None):
+        self.water_budget = water_budget  # Liters per optimization run
+        self.default_flow_rate = default_flow_rate  # L/min of a pump with no configured limit
+        self.window_minutes = window_minutes  # Pump run time available (None = unlimited)
+
+    def optimize_allocation(
+        self,
+        zones: List[Dict[str, Any]],
+        water_budget: Optional[float] = None,
+        pumps: Optional[Dict[str, Dict[str, Any]]] = None,
+        window_minutes: Optional[float] = None
+    ):
         """
         Optimize resource allocation across zones
-        
+
         Args:
             zones: List of zone data with:
                 - zoneId
@@ -23,90 +47,105 @@ class ZoneOptimizer:
                 - area
                 - cropPriority (1-10)
                 - dryingRate
-        
+                - pumpId (optional; zones without one get their own pump)
+            water_budget: Liters available (defaults to the configured budget)
+            pumps: {pumpId: {"flowRate": L/min}} per-pump flow limits (0 = pump unavailable)
+            window_minutes: Run time each pump has available
+
         Returns:
             Optimized allocation plan for each zone
         """
-        total_water_available = 1000  # Liters (this should come from system config)
-        
-        # Calculate priority scores for each zone
-        priorities = []
-        for zone in zones:
-            zone_id = zone.get('zoneId')
-            current_moisture = zone.get('currentMoisture', 50)
-            target_moisture = zone.get('targetMoisture', 60)
-            area = zone.get('area', 100)  # m²
-            crop_priority = zone.get('cropPriority', 5)
-            drying_rate = zone.get('dryingRate', 1.0)
-            
-            # Calculate moisture deficit
-            deficit = max(0, target_moisture - current_moisture)
-            
-            # Calculate urgency based on deficit and drying rate
-            urgency = deficit * drying_rate
-            
-            # Combined priority score
-            priority_score = urgency * crop_priority
-            
-            # Calculate water needed
-            # Simplified: 1L per m² raises moisture by 1%
-            water_needed = deficit * area
-            
-            priorities.append({
-                'zoneId': zone_id,
-                'priorityScore': priority_score,
-                'waterNeeded': water_needed,
-                'deficit': deficit,
-                'area': area
-            })
-        
-        # Sort by priority (highest first)
-        priorities.sort(key=lambda x: x['priorityScore'], reverse=True)
-        
-        # Allocate water
+        total_water_available = self.water_budget if water_budget is None else water_budget
+        if not zones:
+            return {'allocation': {}, 'totalWaterUsed': 0, 'efficiency': 0.0}
+        window = self.window_minutes if window_minutes is None else window_minutes
+        pumps = pumps or {}
+
+        zone_ids = [zone.get('zoneId') for zone in zones]
+        current_moisture = self._column(zones, 'currentMoisture', 50)
+        target_moisture = self._column(zones, 'targetMoisture', 60)
+        area = self._column(zones, 'area', 100)  # m²
+        crop_priority = self._column(zones, 'cropPriority', 5)
+        drying_rate = self._column(zones, 'dryingRate', 1.0)
+
+        # Calculate moisture deficit
+        deficit = np.maximum(0, target_moisture - current_moisture)
+        # Combined priority score: urgency (deficit * drying rate) weighted by crop
+        priority_score = deficit * drying_rate * crop_priority
+        # Simplified: 1L per m² raises moisture by 1%
+        water_needed = deficit * area
+        with np.errstate(divide='ignore', invalid='ignore'):
+            value_per_liter = np.where(water_needed > 0, priority_score / water_needed, 0.0)
+
+        # Pump membership and capacity
+        pump_keys = [zone.get('pumpId') or f"zone:{zone_id}" for zone, zone_id in zip(zones, zone_ids)]
+        pump_names, pump_index = np.unique(np.array(pump_keys, dtype=str), return_inverse=True)
+        flow = np.array([
+            float(pumps.get(name, {}).get('flowRate', self.default_flow_rate)) for name in pump_names
+        ])
+        capacity = flow * window if window else np.full(len(pump_names), np.inf)
+        # A pump with no (or a negative) flow rate can't deliver anything; its zones are reported, not divided by zero
+        no_flow = flow <= 0
+        capacity[no_flow] = 0
+
+        # Fill in order of value per liter (ties: higher priority score first)
+        order = np.lexsort((-priority_score, -value_per_liter))
+        need = water_needed[order]
+        pump = pump_index[order]
+
+        # Pass 1: per-pump capacity (cumulative need within each pump, in fill order)
+        by_pump = np.argsort(pump, kind='stable')
+        cumulative = np.empty(len(order))
+        sorted_need = need[by_pump]
+        group_cumsum = np.cumsum(sorted_need)
+        group_start = np.searchsorted(pump[by_pump], pump[by_pump], side='left')
+        offsets = np.concatenate([[0.0], group_cumsum])[group_start]
+        cumulative[by_pump] = group_cumsum - offsets
+        pump_fit = np.minimum(need, np.maximum(0, capacity[pump] - (cumulative - need)))
+
+        # Pass 2: farm-wide budget, same order
+        spent_before = np.cumsum(pump_fit) - pump_fit
+        allocated = np.minimum(pump_fit, np.maximum(0, total_water_available - spent_before))
+
+        # Calculate irrigation duration at the pump's flow rate
+        duration = ((allocated / np.where(no_flow[pump], 1.0, flow[pump])) * 60).astype(int)  # seconds
+
+        water_out = np.empty(len(order))
+        water_out[order] = allocated
+        duration_out = np.empty(len(order), dtype=int)
+        duration_out[order] = duration
+        pump_limited = np.zeros(len(order), dtype=bool)
+        pump_limited[order] = pump_fit < need
+
+        # Report zones by priority (highest first)
         allocation = {}
-        remaining_water = total_water_available
-        
-        for zone_data in priorities:
-            zone_id = zone_data['zoneId']
-            water_needed = zone_data['waterNeeded']
-            
-            # Allocate water (proportional to need, limited by availability)
-            allocated = min(water_needed, remaining_water)
-            
-            # Calculate irrigation duration
-            # Assuming irrigation rate of 5L/min
-            irrigation_rate = 5  # L/min
-            duration = int((allocated / irrigation_rate) * 60)  # seconds
-            
-            allocation[zone_id] = {
-                'waterAllocated': round(allocated, 2),
-                'duration': duration,
-                'priorityScore': round(zone_data['priorityScore'], 2),
-                'rationale': self._get_rationale(zone_data['deficit'], zone_data['priorityScore'])
+        for i in np.argsort(-priority_score, kind='stable'):
+            if water_needed[i] > 0 and no_flow[pump_index[i]]:
+                rationale = f'Pump {pump_names[pump_index[i]]} has no flow rate - cannot irrigate'
+            elif water_needed[i] > 0 and water_out[i] == 0:
+                rationale = 'Pump capacity exhausted in this window' if pump_limited[i] else 'Insufficient water available - low priority'
+            else:
+                zone = zones[i]
+                raw_deficit = max(0, zone.get('targetMoisture', 60) - zone.get('currentMoisture', 50))
+                rationale = self._get_rationale(raw_deficit, float(priority_score[i]))
+            allocation[zone_ids[i]] = {
+                'waterAllocated': round(float(water_out[i]), 2),
+                'duration': int(duration_out[i]),
+                'priorityScore': round(float(priority_score[i]), 2),
+                'rationale': rationale
             }
-            
-            remaining_water -= allocated
-            
-            if remaining_water <= 0:
-                break
-        
-        # Zones that didn't get water
-        for zone_data in priorities:
-            if zone_data['zoneId'] not in allocation:
-                allocation[zone_data['zoneId']] = {
-                    'waterAllocated': 0,
-                    'duration': 0,
-                    'priorityScore': round(zone_data['priorityScore'], 2),
-                    'rationale': 'Insufficient water available - low priority'
-                }
-        
+
+        total_used = float(allocated.sum())
         return {
             'allocation': allocation,
-            'totalWaterUsed': round(total_water_available - remaining_water, 2),
-            'efficiency': round(((total_water_available - remaining_water) / total_water_available) * 100, 1)
+            'totalWaterUsed': round(total_used, 2),
+            'efficiency': round((total_used / total_water_available) * 100, 1) if total_water_available else 0.0
         }
-    
+
+    @staticmethod
+    def _column(zones: List[Dict[str, Any]], key: str, default: float) -> np.ndarray:
+        return np.array([float(zone.get(key, default)) for zone in zones], dtype=float)
+
     def _get_rationale(self, deficit, priority_score):
         """Generate human-readable rationale for allocation decision"""
         if deficit > 20:
@@ -0,0 +1,22 @@
+"""
+Atomic File Writes
+Whole-file replacement through a unique temp file, so several workers (or a
+crash mid-write) never leave a half-written file in place
+"""
+import os
+import tempfile
+
+
+def write_atomic(path: str, text: str):
+    """Write text to path through a unique temp file in the same directory, then rename over it"""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=os.path.basename(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
@@ -3,6 +3,15 @@ Data Processor Utility
 Handles sensor data analysis and interpretation
 """
 import logging
+from typing import Any, Dict, List, Tuple
+
+# Numpy import with fallback
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+    print("⚠️ Numpy not installed. Batch scoring uses the scalar path.")
 
 logger = logging.getLogger(__name__)
 
@@ -159,3 +168,137 @@ class SensorDataProcessor:
             return "លក្ខខណ្ឌដីត្រូវការការកែលម្អ។ ពិចារណាកែតម្រូវការស្រោចស្រព ឬការដាក់ជី។"
         else:
             return "រកឃើញលក្ខខណ្ឌដីមិនល្អ។ ណែនាំឱ្យមានការអន្តរាគមន៍ច្រើនយ៉ាង។"
+    
+    # ============================================
+    # ARRAY (BULK) SCORING
+    # Column-wise counterparts of the scalar methods above. Inputs are
+    # float arrays with NaN for missing values; results match the scalar
+    # methods element for element.
+    # ============================================
+    
+    def soil_health_scores_array(self, moisture, pH, nitrogen, phosphorus, potassium):
+        """
+        Average soil score (0-100+) per row, NaN where no parameter is present
+        Same per-parameter scoring as assess_soil_health
+        """
+        moisture, pH, nitrogen, phosphorus, potassium = (
+            np.asarray(c, dtype=float) for c in (moisture, pH, nitrogen, phosphorus, potassium)
+        )
+        m_lo, m_hi = self.optimal_ranges['moisture']
+        ph_lo, ph_hi = self.optimal_ranges['pH']
+        
+        moisture_score = np.where(
+            (moisture >= m_lo) & (moisture <= m_hi), 100.0,
+            np.where(moisture < m_lo,
+                     np.maximum(0, (moisture / m_lo) * 100),
+                     np.maximum(0, 100 - ((moisture - m_hi) * 2)))
+        )
+        deviation = np.minimum(np.abs(pH - ph_lo), np.abs(pH - ph_hi))
+        ph_score = np.where((pH >= ph_lo) & (pH <= ph_hi), 100.0, np.maximum(0, 100 - (deviation * 30)))
+        
+        def nutrient_score(values, nutrient, cap=False):
+            lo, hi = self.optimal_ranges[nutrient]
+            score = np.maximum(0, (values / lo) * 100)
+            if cap:
+                score = np.minimum(100, score)
+            return np.where((values >= lo) & (values <= hi), 100.0, score)
+        
+        # Accumulate in the scalar method's order so sums are bit-identical
+        total = np.zeros(moisture.shape)
+        count = np.zeros(moisture.shape)
+        for score in (moisture_score, ph_score,
+                      nutrient_score(nitrogen, 'nitrogen'),
+                      nutrient_score(phosphorus, 'phosphorus'),
+                      nutrient_score(potassium, 'potassium', cap=True)):
+            present = ~np.isnan(score)
+            total = total + np.where(present, score, 0.0)
+            count = count + present
+        
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(count > 0, total / count, np.nan)
+    
+    def assess_soil_health_array(self, moisture, pH, nitrogen, phosphorus, potassium):
+        """
+        Array counterpart of assess_soil_health
+        Returns an array of 'excellent' / 'good' / 'fair' / 'poor' / 'unknown'
+        """
+        avg_score = self.soil_health_scores_array(moisture, pH, nitrogen, phosphorus, potassium)
+        return np.select(
+            [np.isnan(avg_score), avg_score >= 85, avg_score >= 70, avg_score >= 50],
+            ['unknown', 'excellent', 'good', 'fair'],
+            default='poor'
+        )
+    
+    def calculate_stress_level_array(self, moisture, temperature, humidity):
+        """Array counterpart of calculate_stress_level (0-100 per row)"""
+        moisture, temperature, humidity = (np.asarray(c, dtype=float) for c in (moisture, temperature, humidity))
+        stress = (
+            np.select([moisture < 40, moisture < 50, moisture < self.optimal_ranges['moisture'][0]], [90, 60, 30], default=0)
+            + np.select([temperature > 33, temperature > 27, (temperature < 15) | (temperature > 25)], [90, 60, 25], default=0)
+            + np.select([humidity > 85, (humidity < 40) | (humidity > 75)], [70, 20], default=0)
+        )
+        count = (~np.isnan(moisture)).astype(int) + ~np.isnan(temperature) + ~np.isnan(humidity)
+        return np.minimum(100, stress / np.maximum(1, count))
+    
+    def estimate_moisture_loss_rate_array(self, temperature, humidity, light_intensity):
+        """Array counterpart of estimate_moisture_loss_rate (%/hour per row)"""
+        temperature, humidity, light_intensity = (
+            np.asarray(c, dtype=float) for c in (temperature, humidity, light_intensity)
+        )
+        rate = np.full(temperature.shape, 0.5)
+        rate = np.where(temperature > 25, rate + (temperature - 25) * 0.1,
+                        np.where(temperature < 15, rate - (15 - temperature) * 0.05, rate))
+        rate = np.where(humidity < 40, rate + (40 - humidity) * 0.02,
+                        np.where(humidity > 70, rate - (humidity - 70) * 0.01, rate))
+        rate = np.where(light_intensity > 50, rate + 0.3, rate)
+        return np.maximum(0, np.minimum(5, rate))
+    
+    @staticmethod
+    def readings_to_columns(readings: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """[{field: value}] -> {field: float array with NaN for missing}"""
+        fields = ('moisture', 'temperature', 'humidity', 'pH', 'nitrogen', 'phosphorus', 'potassium', 'lightIntensity')
+        return {
+            key: np.array([np.nan if r.get(key) is None else float(r.get(key)) for r in readings], dtype=float)
+            for key in fields
+        }
+    
+    def score_batch(self, readings: List[Dict[str, Any]]) -> List[Tuple[str, float, float]]:
+        """
+        Score many readings at once
+        Returns one (soil_health, stress_level, moisture_loss_rate) tuple per reading,
+        identical to calling the three scalar methods on each reading
+        """
+        if not readings:
+            return []
+        
+        if not NUMPY_AVAILABLE:
+            return [self._score_one(r) for r in readings]
+        
+        c = self.readings_to_columns(readings)
+        soil_health = self.assess_soil_health_array(c['moisture'], c['pH'], c['nitrogen'], c['phosphorus'], c['potassium'])
+        stress_level = self.calculate_stress_level_array(c['moisture'], c['temperature'], c['humidity'])
+        loss_rate = self.estimate_moisture_loss_rate_array(c['temperature'], c['humidity'], c['lightIntensity'])
+        
+        return list(zip(soil_health.tolist(), stress_level.tolist(), loss_rate.tolist()))
+    
+    def _score_one(self, reading: Dict[str, Any]) -> Tuple[str, float, float]:
+        """Scalar scoring of a single reading (fallback for score_batch)"""
+        return (
+            self.assess_soil_health(
+                moisture=reading.get('moisture'),
+                pH=reading.get('pH'),
+                nitrogen=reading.get('nitrogen'),
+                phosphorus=reading.get('phosphorus'),
+                potassium=reading.get('potassium')
+            ),
+            self.calculate_stress_level(
+                moisture=reading.get('moisture'),
+                temperature=reading.get('temperature'),
+                humidity=reading.get('humidity')
+            ),
+            self.estimate_moisture_loss_rate(
+                temperature=reading.get('temperature'),
+                humidity=reading.get('humidity'),
+                light_intensity=reading.get('lightIntensity')
+            )
+        )
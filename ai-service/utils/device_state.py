@@ -0,0 +1,222 @@
+"""
+Device State
+Bounded, array-backed rolling window of recent readings per device, fed by
+the streaming ingest endpoints
+"""
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+# Sensor fields kept per reading (column order of the ring buffer)
+WINDOW_FIELDS = (
+    'moisture', 'temperature', 'humidity', 'rain',
+    'nitrogen', 'phosphorus', 'potassium', 'pH', 'ec', 'lightIntensity'
+)
+MOISTURE_COLUMN = WINDOW_FIELDS.index('moisture')
+
+
+def to_epoch(value: Any) -> float:
+    """Reading timestamp (epoch seconds, ISO string or None) -> epoch seconds"""
+    if value is None:
+        return time.time()
+    if isinstance(value, (int, float)):
+        return float(value) / 1000 if value > 1e11 else float(value)  # accept ms
+    return datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp()
+
+
+class DryingRateEstimator:
+    """
+    Online, exponentially weighted least-squares slope of moisture over time
+
+    Keeps five decayed sums (weights halve every half_life_hours), with time
+    measured relative to the newest reading, so each update is O(1). A jump
+    up of more than reset_jump points (irrigation or rain) starts a new
+    drying segment.
+    """
+
+    def __init__(self, half_life_hours: float = 6.0, reset_jump: float = 5.0, min_points: int = 3, min_span_hours: float = 0.5):
+        self.half_life_hours = half_life_hours
+        self.reset_jump = reset_jump
+        self.min_points = min_points
+        self.min_span_hours = min_span_hours
+        self._reset()
+
+    def _reset(self):
+        self.last_ts: Optional[float] = None
+        self.last_value: Optional[float] = None
+        self.first_ts: Optional[float] = None
+        self.points = 0
+        self.sw = self.st = self.sy = self.stt = self.sty = 0.0
+
+    def update(self, timestamp: float, moisture: Optional[float]):
+        if moisture is None or np.isnan(moisture):
+            return
+        if self.last_ts is not None and timestamp <= self.last_ts:
+            return  # late or duplicate reading
+        if self.last_value is not None and moisture - self.last_value > self.reset_jump:
+            self._reset()
+        
+        if self.last_ts is not None:
+            dt = (timestamp - self.last_ts) / 3600
+            decay = 0.5 ** (dt / self.half_life_hours)
+            # Move the time origin to the new reading, then decay
+            self.stt = decay * (self.stt - 2 * dt * self.st + dt * dt * self.sw)
+            self.sty = decay * (self.sty - dt * self.sy)
+            self.st = decay * (self.st - dt * self.sw)
+            self.sy *= decay
+            self.sw *= decay
+        else:
+            self.first_ts = timestamp
+        
+        # New point sits at t = 0, so it adds nothing to st/stt/sty
+        self.sw += 1
+        self.sy += moisture
+        self.points += 1
+        self.last_ts = timestamp
+        self.last_value = moisture
+
+    def slope(self) -> Optional[float]:
+        """Moisture change in %/hour, or None until the segment has enough data"""
+        if self.points < self.min_points or (self.last_ts - self.first_ts) / 3600 < self.min_span_hours:
+            return None
+        denominator = self.sw * self.stt - self.st * self.st
+        if denominator <= 1e-12:
+            return None
+        return (self.sw * self.sty - self.st * self.sy) / denominator
+
+    def loss_rate(self) -> Optional[float]:
+        """Observed drying rate in %/hour (0 when moisture is flat or rising)"""
+        slope = self.slope()
+        return None if slope is None else round(max(0.0, -slope), 2)
+
+
+class DeviceRingBuffer:
+    """
+    Fixed-capacity ring buffer: timestamps plus one float column per field
+    (NaN = missing). Appends are O(1); reads return oldest-first copies
+    """
+
+    def __init__(self, capacity: int, drying: Optional[DryingRateEstimator] = None):
+        self.capacity = capacity
+        self.drying = drying or DryingRateEstimator()
+        self.timestamps = np.zeros(capacity)
+        self.values = np.full((capacity, len(WINDOW_FIELDS)), np.nan)
+        self.head = 0   # next write position
+        self.count = 0
+        self.total = 0  # readings ever appended
+
+    def append(self, reading: Dict[str, Any], timestamp: float):
+        self.timestamps[self.head] = timestamp
+        for i, field in enumerate(WINDOW_FIELDS):
+            value = reading.get(field)
+            self.values[self.head, i] = np.nan if value is None else float(value)
+        self.drying.update(timestamp, self.values[self.head, MOISTURE_COLUMN])
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+        self.total += 1
+
+    def _order(self) -> np.ndarray:
+        start = (self.head - self.count) % self.capacity
+        return (start + np.arange(self.count)) % self.capacity
+
+    def window(self, field: Optional[str] = None):
+        """(timestamps, values) oldest first; values is one column if field is given"""
+        order = self._order()
+        if field is None:
+            return self.timestamps[order], self.values[order]
+        return self.timestamps[order], self.values[order, WINDOW_FIELDS.index(field)]
+
+    def latest(self) -> Optional[Dict[str, Any]]:
+        """Most recent reading as a dict (None for missing fields)"""
+        if not self.count:
+            return None
+        row = self.values[(self.head - 1) % self.capacity]
+        return {field: (None if np.isnan(v) else float(v)) for field, v in zip(WINDOW_FIELDS, row)}
+
+    def means(self) -> Dict[str, Optional[float]]:
+        """Per-field mean over the window, ignoring missing values"""
+        _, values = self.window()
+        present = ~np.isnan(values)
+        counts = present.sum(axis=0)
+        sums = np.where(present, values, 0).sum(axis=0)
+        return {
+            field: (round(float(s / n), 2) if n else None)
+            for field, s, n in zip(WINDOW_FIELDS, sums, counts)
+        }
+
+    def to_history(self, field: str = 'moisture') -> List[Dict[str, Any]]:
+        """Window as [{"timestamp", field}] rows (what the forecasters expect)"""
+        timestamps, values = self.window(field)
+        present = ~np.isnan(values)
+        return [
+            {"timestamp": datetime.fromtimestamp(ts).isoformat(), field: float(v)}
+            for ts, v in zip(timestamps[present], values[present])
+        ]
+
+
+class DeviceStateStore:
+    """deviceId -> DeviceRingBuffer, evicting the least recently updated device when full"""
+
+    def __init__(self, window_size: int = 1440, max_devices: int = 5000, drying_half_life_hours: float = 6.0):
+        self.window_size = window_size
+        self.max_devices = max_devices
+        self.drying_half_life_hours = drying_half_life_hours
+        self._buffers: "OrderedDict[str, DeviceRingBuffer]" = OrderedDict()
+
+    def append(self, device_id: str, reading: Dict[str, Any], timestamp: Optional[float] = None) -> DeviceRingBuffer:
+        buffer = self._buffers.get(device_id)
+        if buffer is None:
+            buffer = DeviceRingBuffer(self.window_size, DryingRateEstimator(self.drying_half_life_hours))
+            self._buffers[device_id] = buffer
+            while len(self._buffers) > self.max_devices:
+                self._buffers.popitem(last=False)
+        else:
+            self._buffers.move_to_end(device_id)
+        buffer.append(reading, time.time() if timestamp is None else timestamp)
+        return buffer
+
+    def get(self, device_id: str) -> Optional[DeviceRingBuffer]:
+        return self._buffers.get(device_id)
+
+    def loss_rate(self, device_id: str) -> Optional[float]:
+        """Observed drying rate (%/hour) for a device, None if not yet known"""
+        buffer = self._buffers.get(device_id)
+        return buffer.drying.loss_rate() if buffer else None
+
+    def observations(self, device_ids: List[str]) -> Dict[str, List[Optional[float]]]:
+        """Latest moisture/temperature/humidity and drying rate (%/hour) per device, None where unknown"""
+        observed = {"moisture": [], "temperature": [], "humidity": [], "loss_rate": []}
+        for device_id in device_ids:
+            buffer = self._buffers.get(device_id)
+            latest = (buffer.latest() if buffer else None) or {}
+            for field in ("moisture", "temperature", "humidity"):
+                observed[field].append(latest.get(field))
+            observed["loss_rate"].append(buffer.drying.loss_rate() if buffer else None)
+        return observed
+
+    def training_columns(self, fields=('moisture', 'temperature', 'humidity')) -> Dict[str, np.ndarray]:
+        """All windows concatenated as columns (plus a 'group' device-id column) for model fitting"""
+        groups, timestamps, values = [], [], []
+        for device_id, buffer in self._buffers.items():
+            ts, vals = buffer.window()
+            groups.append(np.full(len(ts), device_id, dtype=object))
+            timestamps.append(ts)
+            values.append(vals)
+        if not timestamps:
+            return {"group": np.array([]), "timestamp": np.array([]), **{f: np.array([]) for f in fields}}
+        values = np.concatenate(values)
+        columns = {"group": np.concatenate(groups).astype(str), "timestamp": np.concatenate(timestamps)}
+        for field in fields:
+            columns[field] = values[:, WINDOW_FIELDS.index(field)]
+        return columns
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "devices": len(self._buffers),
+            "window_size": self.window_size,
+            "max_devices": self.max_devices,
+            "readings_held": sum(b.count for b in self._buffers.values())
+        }
@@ -0,0 +1,102 @@
+"""
+Forecast Pool
+Bounded process pool for CPU-heavy model fitting/prediction so the
+uvicorn event loop never blocks on Prophet
+"""
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class PoolSaturated(Exception):
+    """Raised when the pool and its queue are full; callers should retry later"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"Forecast pool saturated, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class ForecastPool:
+    """
+    Runs picklable functions in worker processes
+
+    - at most workers jobs run at once and max_queue more may wait; beyond
+      that run() raises PoolSaturated instead of letting callers time out
+    - jobs submitted with the same key while one is in flight share its result
+    """
+
+    def __init__(self, workers: Optional[int] = None, max_queue: int = 8):
+        self.workers = workers or min(2, os.cpu_count() or 1)
+        self.max_queue = max_queue
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self._avg_duration = 5.0  # seconds, exponentially weighted
+        self.submitted = 0
+        self.deduplicated = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn: forking a process that runs an event loop and threads is unsafe
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    @property
+    def pending(self) -> int:
+        return len(self._inflight)
+
+    def retry_after(self) -> int:
+        """Rough seconds until a slot frees up"""
+        waves = max(1, self.pending // self.workers)
+        return max(1, int(self._avg_duration * waves))
+
+    async def run(self, key: Hashable, fn: Callable[..., Any], *args) -> Any:
+        future = self._inflight.get(key)
+        if future is not None:
+            self.deduplicated += 1
+            return await asyncio.shield(future)
+
+        if self.pending >= self.workers + self.max_queue:
+            self.rejected += 1
+            raise PoolSaturated(self.retry_after())
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._get_executor(), fn, *args)
+        self._inflight[key] = future
+        self.submitted += 1
+        start = time.monotonic()
+        # Free the slot when the job ends, even if every caller was cancelled
+        future.add_done_callback(lambda f: self._finish(key, f, start))
+        return await asyncio.shield(future)
+
+    def _finish(self, key: Hashable, future: asyncio.Future, start: float):
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        if future.cancelled() or future.exception() is not None:
+            self.failed += 1
+        else:
+            self._avg_duration = 0.8 * self._avg_duration + 0.2 * (time.monotonic() - start)
+
+    def shutdown(self):
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "pending": self.pending,
+            "submitted": self.submitted,
+            "deduplicated": self.deduplicated,
+            "rejected": self.rejected,
+            "failed": self.failed,
+            "avg_job_seconds": round(self._avg_duration, 2)
+        }
@@ -0,0 +1,76 @@
+"""
+HTTP Client Pool
+Long-lived, keep-alive httpx clients shared across the AI service,
+one per upstream with its own connection limits and timeouts
+"""
+import os
+from typing import Dict, Any, Optional
+
+import httpx
+
+# HTTP/2 needs the optional 'h2' package (pip install httpx[http2])
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+# Per-upstream defaults; each value can be overridden with
+# HTTP_<NAME>_TIMEOUT / HTTP_<NAME>_MAX_CONNECTIONS / HTTP_<NAME>_MAX_KEEPALIVE
+UPSTREAMS = {
+    "gemini": {"timeout": 30.0, "connect_timeout": 5.0, "max_connections": 10, "max_keepalive": 5},
+    "backend": {"timeout": 5.0, "connect_timeout": 2.0, "max_connections": 20, "max_keepalive": 10},
+    "open_meteo": {"timeout": 10.0, "connect_timeout": 3.0, "max_connections": 5, "max_keepalive": 2},
+}
+
+
+class HttpClientPool:
+    """
+    Lazily creates one httpx.AsyncClient per upstream and reuses it, so
+    repeated calls share TCP/TLS connections instead of reconnecting
+    """
+
+    def __init__(self, upstreams: Optional[Dict[str, Dict[str, Any]]] = None):
+        self.upstreams = upstreams or UPSTREAMS
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    def _config(self, name: str) -> Dict[str, Any]:
+        config = dict(self.upstreams.get(name, UPSTREAMS["backend"]))
+        prefix = f"HTTP_{name.upper()}_"
+        config["timeout"] = float(os.getenv(prefix + "TIMEOUT", config["timeout"]))
+        config["max_connections"] = int(os.getenv(prefix + "MAX_CONNECTIONS", config["max_connections"]))
+        config["max_keepalive"] = int(os.getenv(prefix + "MAX_KEEPALIVE", config["max_keepalive"]))
+        return config
+
+    def get(self, name: str) -> httpx.AsyncClient:
+        """Return the shared client for an upstream, creating it on first use"""
+        client = self._clients.get(name)
+        if client is None or client.is_closed:
+            config = self._config(name)
+            client = httpx.AsyncClient(
+                http2=HTTP2_AVAILABLE,
+                timeout=httpx.Timeout(config["timeout"], connect=config["connect_timeout"]),
+                limits=httpx.Limits(
+                    max_connections=config["max_connections"],
+                    max_keepalive_connections=config["max_keepalive"],
+                    keepalive_expiry=60.0
+                )
+            )
+            self._clients[name] = client
+        return client
+
+    async def aclose(self):
+        """Close every client (called on app shutdown)"""
+        for client in self._clients.values():
+            await client.aclose()
+        self._clients.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "http2": HTTP2_AVAILABLE,
+            "open_clients": sorted(name for name, c in self._clients.items() if not c.is_closed)
+        }
+
+
+# Process-wide pool used by the app, WeatherService and check_gemini
+http_clients = HttpClientPool()
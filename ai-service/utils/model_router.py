@@ -0,0 +1,219 @@
+"""
+Model Router
+Sticky model/version selection with a per-endpoint circuit breaker for
+the Gemini API, plus latency/error histograms per endpoint
+"""
+import asyncio
+import json
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+# Upper bounds (seconds) of the latency histogram buckets
+LATENCY_BUCKETS = [0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0, float("inf")]
+
+Endpoint = Tuple[str, str]  # (model, api_version)
+
+STICKY_KEY = "gemini:sticky"
+BREAKER_PREFIX = "gemini:breaker:"
+
+# Failures a model-metadata probe can vouch for; a 429 or a failing
+# generateContent still looks healthy to it, so those wait for live traffic
+PROBED_OUTCOMES = ("not_found", "exception")
+
+
+class EndpointState:
+    """Circuit breaker + metrics for one model/version endpoint"""
+
+    def __init__(self):
+        self.failures = 0           # consecutive failures (reset on a real success)
+        self.open_until = 0.0       # monotonic time the breaker stays open until
+        self.last_error: Optional[str] = None
+        self.last_outcome: Optional[str] = None  # outcome that opened the breaker
+        self.latency_counts = [0] * len(LATENCY_BUCKETS)
+        self.outcomes: Dict[str, int] = {}
+
+    def observe(self, outcome: str, latency: float):
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if latency <= bound:
+                self.latency_counts[i] += 1
+                break
+
+
+class ModelRouter:
+    """
+    Orders Gemini endpoints for each call:
+    - the last working endpoint is tried first
+    - endpoints that failed are skipped while their breaker is open; the
+      cooldown doubles with each consecutive failure (capped)
+    - a background probe re-checks endpoints that failed as not found or
+      with an exception, closing the breaker early if they are back
+
+    With a shared store the sticky endpoint and breaker state are shared by
+    every worker (re-read at most every sync_interval seconds); latency and
+    outcome histograms stay per worker
+    """
+
+    def __init__(
+        self,
+        models: List[str],
+        api_versions: List[str],
+        base_cooldown: float = 30.0,
+        max_cooldown: float = 1800.0,
+        shared=None,
+        sync_interval: float = 1.0
+    ):
+        self.endpoints: List[Endpoint] = [(m, v) for m in models for v in api_versions]
+        self.base_cooldown = base_cooldown
+        self.max_cooldown = max_cooldown
+        self.sticky: Optional[Endpoint] = None
+        self.states: Dict[Endpoint, EndpointState] = {e: EndpointState() for e in self.endpoints}
+        self.shared = shared
+        self.sync_interval = sync_interval
+        self._synced_at = float("-inf")
+
+    @staticmethod
+    def _breaker_key(endpoint: Endpoint) -> str:
+        return f"{BREAKER_PREFIX}{endpoint[0]}|{endpoint[1]}"
+
+    def _read_shared(self) -> Tuple[Optional[str], Dict[Endpoint, Optional[str]]]:
+        return self.shared.get(STICKY_KEY), {e: self.shared.get(self._breaker_key(e)) for e in self.endpoints}
+
+    async def sync(self, force: bool = False):
+        """Adopt the shared sticky endpoint and breaker states (no-op without a shared store)"""
+        if self.shared is None:
+            return
+        if not force and time.monotonic() - self._synced_at < self.sync_interval:
+            return
+        self._synced_at = time.monotonic()
+        sticky, breakers = await self.shared.run(self._read_shared)
+        self.sticky = tuple(sticky.split("|", 1)) if sticky else None
+        if self.sticky not in self.states:
+            self.sticky = None
+        now, wall = time.monotonic(), time.time()
+        for endpoint, state in self.states.items():
+            raw = breakers.get(endpoint)
+            if raw is None:
+                # Never failed, recovered on another worker, or forgotten after max_cooldown
+                state.failures, state.open_until, state.last_error, state.last_outcome = 0, 0.0, None, None
+                continue
+            breaker = json.loads(raw)
+            state.failures = breaker["failures"]
+            state.open_until = now + max(0.0, breaker["open_until"] - wall)
+            state.last_error = breaker.get("error")
+            state.last_outcome = breaker.get("outcome")
+
+    def is_open(self, endpoint: Endpoint) -> bool:
+        return time.monotonic() < self.states[endpoint].open_until
+
+    async def candidates(self) -> List[Endpoint]:
+        """
+        Endpoints to try, in order: the sticky endpoint, then healthy ones,
+        then half-open ones (cooldown expired, not yet succeeded again).
+        Endpoints with an open breaker are skipped
+        """
+        await self.sync()
+        ordered = sorted(self.endpoints, key=lambda e: (e != self.sticky, self.states[e].failures > 0))
+        return [e for e in ordered if not self.is_open(e)]
+
+    def observe(self, endpoint: Endpoint, outcome: str, latency: float):
+        """Record an outcome that says nothing about endpoint health"""
+        self.states[endpoint].observe(outcome, latency)
+
+    async def record_success(self, endpoint: Endpoint, latency: float, sticky: bool = True):
+        """Close the breaker for endpoint; sticky=False (probes) leaves the sticky endpoint alone"""
+        state = self.states[endpoint]
+        state.observe("ok", latency)
+        state.failures = 0
+        state.open_until = 0.0
+        state.last_error = None
+        state.last_outcome = None
+        if sticky:
+            self.sticky = endpoint
+        if self.shared is not None:
+            await self.shared.run(self._publish_success, endpoint, sticky)
+
+    def _publish_success(self, endpoint: Endpoint, sticky: bool):
+        self.shared.set(self._breaker_key(endpoint), None)
+        if sticky:
+            self.shared.set(STICKY_KEY, f"{endpoint[0]}|{endpoint[1]}")
+
+    async def record_failure(self, endpoint: Endpoint, outcome: str, latency: float, error: Optional[str] = None):
+        """Open the breaker for endpoint with exponential backoff"""
+        await self.sync(force=True)
+        state = self.states[endpoint]
+        state.observe(outcome, latency)
+        state.failures += 1
+        state.last_error = error or outcome
+        state.last_outcome = outcome
+        cooldown = min(self.max_cooldown, self.base_cooldown * (2 ** (state.failures - 1)))
+        if outcome == "not_found":
+            # Model missing on this API version - won't fix itself soon
+            cooldown = self.max_cooldown
+        state.open_until = time.monotonic() + cooldown
+        if self.sticky == endpoint:
+            self.sticky = None
+        if self.shared is not None:
+            breaker = {"failures": state.failures, "open_until": time.time() + cooldown,
+                       "error": state.last_error, "outcome": outcome}
+            await self.shared.run(self._publish_failure, endpoint, json.dumps(breaker), cooldown)
+
+    def _publish_failure(self, endpoint: Endpoint, breaker: str, cooldown: float):
+        # Kept past the cooldown so the next failure keeps backing off
+        self.shared.set(self._breaker_key(endpoint), breaker, ttl=cooldown + self.max_cooldown)
+        self.shared.compare_and_set(STICKY_KEY, f"{endpoint[0]}|{endpoint[1]}", None)
+
+    async def probe_loop(self, probe: Callable[[Endpoint], Awaitable[Optional[bool]]], interval: float = 60.0):
+        """
+        Background task: probe every endpoint whose last failure was
+        not_found or an exception and that has not succeeded since, breaker
+        open or not. probe returns True (healthy - the breaker closes at
+        once), False (model not found, classified as live requests classify
+        a 404) or None (inconclusive - leave to live traffic); a probe that
+        raises counts as an "exception" failure. Endpoints that were rate
+        limited or failed generation keep their breaker and failure count,
+        so repeated failures keep backing off
+        """
+        while True:
+            await asyncio.sleep(interval)
+            if self.shared is not None:
+                # One worker probes per interval
+                if not await self.shared.acompare_and_set("gemini:probe", None, "1", ttl=interval * 0.9):
+                    continue
+                await self.sync(force=True)
+            for endpoint in self.endpoints:
+                state = self.states[endpoint]
+                if state.failures == 0 or state.last_outcome not in PROBED_OUTCOMES:
+                    continue
+                start = time.monotonic()
+                try:
+                    healthy = await probe(endpoint)
+                except Exception as e:
+                    # Still dead - reopen so live traffic doesn't pay for it
+                    await self.record_failure(endpoint, "exception", time.monotonic() - start, str(e)[:100])
+                    continue
+                if healthy:
+                    # Back before its cooldown ran out - usable again right away
+                    await self.record_success(endpoint, time.monotonic() - start, sticky=False)
+                elif healthy is False:
+                    await self.record_failure(endpoint, "not_found", time.monotonic() - start, "model not found (probe)")
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-endpoint breaker state and latency/outcome histograms (as of the last sync())"""
+        now = time.monotonic()
+        labels = [f"le_{b:g}" if b != float("inf") else "le_inf" for b in LATENCY_BUCKETS]
+        return {
+            "sticky": f"{self.sticky[0]}@{self.sticky[1]}" if self.sticky else None,
+            "shared": self.shared is not None,
+            "endpoints": {
+                f"{model}@{version}": {
+                    "state": "open" if now < state.open_until else ("half_open" if state.failures else "closed"),
+                    "retry_in": round(max(0.0, state.open_until - now), 1),
+                    "consecutive_failures": state.failures,
+                    "last_error": state.last_error,
+                    "outcomes": state.outcomes,
+                    "latency_histogram": dict(zip(labels, state.latency_counts))
+                }
+                for (model, version), state in self.states.items()
+            }
+        }
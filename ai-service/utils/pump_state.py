@@ -0,0 +1,53 @@
+"""
+Pump State
+Shared record of which pumps are running, built on the shared store's
+compare-and-set and TTL expiry, so several workers (or a restarted one)
+never double-start a pump
+"""
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+from utils.shared_state import SharedStore
+
+
+class PumpStateStore:
+    """Pump start/stop on top of any SharedStore backend"""
+
+    def __init__(self, store: SharedStore):
+        self.store = store
+
+    @property
+    def backend(self) -> str:
+        return self.store.backend
+
+    @staticmethod
+    def pump_key(device_id: str, pump: str) -> str:
+        return f"pump:{device_id}:{pump}"
+
+    def running_until(self, device_id: str, pump: str) -> Optional[float]:
+        """Epoch seconds the pump runs until, or None if it is off"""
+        raw = self.store.get(self.pump_key(device_id, pump))
+        if raw is None:
+            return None
+        end = json.loads(raw)["end"]
+        return end if end > time.time() else None
+
+    def try_start(self, device_id: str, pump: str, duration: float) -> bool:
+        """Claim the pump for duration seconds; False if it is already running"""
+        now = time.time()
+        state = json.dumps({"start": now, "end": now + duration, "pid": os.getpid()})
+        return self.store.compare_and_set(self.pump_key(device_id, pump), None, state, ttl=duration)
+
+    def stop(self, device_id: str, pump: str) -> bool:
+        """Clear a running pump; False if it was not running"""
+        key = self.pump_key(device_id, pump)
+        current = self.store.get(key)
+        return current is not None and self.store.compare_and_set(key, current, None)
+
+    def close(self):
+        self.store.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.backend, "running": self.store.count("pump:")}
@@ -0,0 +1,133 @@
+"""
+Chat Response Cache
+LRU + TTL cache for chatbot answers keyed on the normalized question and
+bucketed sensor readings, with optional JSON persistence across restarts
+"""
+import json
+import os
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from utils.atomic_file import write_atomic
+
+# Bucket width per sensor field - readings in the same bucket share answers
+SENSOR_BUCKETS = {
+    'moisture': 5,
+    'temperature': 1,
+    'humidity': 5,
+    'nitrogen': 5,
+    'phosphorus': 5,
+    'potassium': 10,
+    'pH': 0.2,
+    'ec': 100,
+}
+
+
+def normalize_message(message: str) -> str:
+    """
+    NFC, lowercase, replace punctuation and symbols with spaces and collapse
+    whitespace. Combining marks (Khmer vowel signs, coeng) are kept, so
+    questions that differ only in their vowels get different keys
+    """
+    text = unicodedata.normalize("NFC", message).lower()
+    text = "".join(" " if unicodedata.category(ch)[0] in "PS" else ch for ch in text)
+    return " ".join(text.split())
+
+
+def bucket(value: Any, width: float) -> Optional[float]:
+    try:
+        return round(round(float(value) / width) * width, 2)
+    except (TypeError, ValueError):
+        return None
+
+
+class ResponseCache:
+    """
+    Maps (normalized message, bucketed sensor context) -> reply
+
+    Entries expire after ttl seconds; when full the least recently used entry
+    is evicted. With a path, entries are loaded at startup and written back
+    every persist_every inserts and on save()
+    """
+
+    def __init__(self, max_entries: int = 500, ttl_seconds: float = 6 * 3600,
+                 path: Optional[str] = None, persist_every: int = 20):
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.path = path
+        self.persist_every = persist_every
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (stored_at, value)
+        self._dirty = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if path:
+            self._load()
+
+    def make_key(self, message: str, sensor_data: Dict[str, Any], expenses: List[Dict[str, Any]]) -> str:
+        sensors = {field: bucket(sensor_data.get(field), width) for field, width in SENSOR_BUCKETS.items()}
+        total_expenses = bucket(sum(float(e.get('amount', 0)) for e in expenses), 10)
+        return json.dumps([normalize_message(message), sensors, total_expenses], ensure_ascii=False, sort_keys=True)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None or time.time() - entry[0] > self.ttl:
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: str, value: Dict[str, Any]):
+        self._entries[key] = (time.time(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        self._dirty += 1
+        if self.path and self._dirty >= self.persist_every:
+            self.save()
+
+    def save(self):
+        """Write unexpired entries to disk (atomic replace)"""
+        if not self.path or not self._dirty:
+            return
+        now = time.time()
+        data = [[k, stored_at, v] for k, (stored_at, v) in self._entries.items() if now - stored_at <= self.ttl]
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            write_atomic(self.path, json.dumps(data, ensure_ascii=False))
+            self._dirty = 0
+        except OSError as e:
+            print(f"⚠️ Could not persist chat cache: {e}")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            now = time.time()
+            for key, stored_at, value in data[-self.max_entries:]:
+                if now - stored_at <= self.ttl:
+                    self._entries[key] = (stored_at, value)
+            print(f"✅ Loaded {len(self._entries)} cached chat replies")
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Could not load chat cache: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "persistent": bool(self.path),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None
+        }
@@ -0,0 +1,340 @@
+"""
+Rule Engine
+Declarative threshold rules for sensor interpretation (moisture, rain, pH,
+EC/NPK), compiled once per crop into a Python function and hot-reloaded
+from disk
+"""
+import json
+import operator
+import os
+import string
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional
+
+OPERATORS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+# Facts supplied by the caller rather than read from the sensor reading
+INPUT_FACTS = ("stress_level", "rain_probability")
+
+# Template fields computed once per fired rule besides facts: name -> source
+SPECIAL_FIELDS = {
+    "deficiencies": "_deficiencies(sensor_data)",
+    "time": "_time_label()",
+}
+
+_formatter = string.Formatter()
+
+
+class RuleError(ValueError):
+    """The rule table is malformed (the previous rules stay active)"""
+
+
+def _time_label() -> str:
+    return datetime.now().strftime("%I:%M %p")
+
+
+class CropPlan:
+    """
+    The rule table compiled for one crop: params are baked in as constants
+    and every group becomes an if/elif chain in one generated function
+    """
+
+    def __init__(self, crop: str, table: Dict[str, Any], params: Dict[str, Any]):
+        self.crop = crop
+        self.params = params
+        self.fields = {name: (spec["field"], spec.get("default")) for name, spec in table.get("facts", {}).items()}
+        self.derived = table.get("derived", {})
+        self.report = list(table.get("report", []))
+        self.groups = table.get("groups", [])
+        self.rule_count = sum(len(group["rules"]) for group in self.groups)
+        self._templates: Dict[str, str] = {}
+        self._expanding: List[str] = []
+        self._specials = set()
+
+        lines = self._deficiency_source(table.get("deficiencies", []), table.get("deficiency_fallback", ""))
+        lines += self._evaluate_source(table)
+        self.source = "\n".join(lines) + "\n"
+        namespace = {"_time_label": _time_label, **self._templates}
+        try:
+            exec(compile(self.source, f"<rules:{crop}>", "exec"), namespace)
+        except SyntaxError as e:
+            raise RuleError(f"Rules for crop '{crop}' did not compile: {e}")
+        self.evaluate = namespace["evaluate"]
+
+    # ---- expressions ----
+
+    def _param(self, value: Any) -> Any:
+        """Resolve "$name" to the crop's param value; anything else is a literal"""
+        if isinstance(value, str) and value.startswith("$"):
+            name = value[1:]
+            if name not in self.params:
+                raise RuleError(f"Unknown param '{name}' for crop '{self.crop}'")
+            return self.params[name]
+        return value
+
+    @staticmethod
+    def _literal(value: Any) -> str:
+        if value is None or isinstance(value, (bool, int, float, str)):
+            return repr(value)
+        raise RuleError(f"Unsupported constant {value!r}")
+
+    def _fact(self, name: str) -> str:
+        """Source expression for a fact (derived facts are inlined)"""
+        if name in INPUT_FACTS:
+            return name
+        if name in self.fields:
+            return f"fact_{name}"
+        if name in self.derived:
+            if name in self._expanding:
+                raise RuleError(f"Derived fact '{name}' refers to itself")
+            self._expanding.append(name)
+            try:
+                return self._condition(self.derived[name])
+            finally:
+                self._expanding.pop()
+        raise RuleError(f"Unknown fact '{name}'")
+
+    def _condition(self, spec: Dict[str, Any]) -> str:
+        # all/any use & and | on bools: every child is evaluated (like the
+        # and/or chains of plain comparisons they replace), so a missing
+        # value fails the same way
+        if "all" in spec:
+            return "(" + " & ".join(self._condition(c) for c in spec["all"]) + ")"
+        if "any" in spec:
+            return "(" + " | ".join(self._condition(c) for c in spec["any"]) + ")"
+        if "not" in spec:
+            return f"(not {self._condition(spec['not'])})"
+        if "param" in spec:
+            return repr(bool(self._param("$" + spec["param"])))
+        if "fact" not in spec:
+            raise RuleError(f"Condition needs all/any/not/param/fact: {spec}")
+        fact = self._fact(spec["fact"])
+        if "op" not in spec:
+            return fact if spec["fact"] in self.derived else f"(not not {fact})"
+        if spec["op"] not in OPERATORS:
+            raise RuleError(f"Unknown operator '{spec['op']}'")
+        return f"({fact} {spec['op']} {self._literal(self._param(spec.get('value')))})"
+
+    def _template(self, text: str, extra: Optional[Dict[str, str]] = None) -> str:
+        """
+        Source expression for a message: params are substituted now, facts and
+        the special fields (plus extra: name -> source) at evaluation time
+        """
+        extra = extra or {}
+        pieces, runtime = [], {}
+        for literal, field, spec, conversion in _formatter.parse(text):
+            pieces.append(literal.replace("{", "{{").replace("}", "}}"))
+            if field is None:
+                continue
+            if field in extra:
+                runtime[field] = extra[field]
+            elif field in SPECIAL_FIELDS:
+                runtime[field] = field
+                self._specials.add(field)
+            elif field in INPUT_FACTS or field in self.fields or field in self.derived:
+                runtime[field] = self._fact(field)
+            elif field in self.params:
+                value = _formatter.convert_field(self.params[field], conversion)
+                pieces.append(format(value, spec).replace("{", "{{").replace("}", "}}"))
+                continue
+            else:
+                raise RuleError(f"Unknown template field '{field}' in '{text}'")
+            pieces.append("{" + field + ("!" + conversion if conversion else "") + (":" + spec if spec else "") + "}")
+        compiled = "".join(pieces)
+        if not runtime:
+            return repr(compiled.format())
+        name = f"_t{len(self._templates)}"
+        self._templates[name] = compiled
+        return f"{name}.format(" + ", ".join(f"{field}={source}" for field, source in runtime.items()) + ")"
+
+    # ---- generated functions ----
+
+    def _deficiency_source(self, checks: List[Dict[str, Any]], fallback: str) -> List[str]:
+        lines = ["def _deficiencies(sensor_data):", "    labels = []"]
+        for check in checks:
+            field, below = check["field"], self._literal(self._param(check["below"]))
+            label = self._template(check["label"], extra={
+                "value": f"sensor_data.get({field!r})",
+                "threshold": repr(str(self._param(check["below"])))
+            })
+            lines.append(f"    if sensor_data.get({field!r}, {self._literal(check.get('default'))}) < {below}:")
+            lines.append(f"        labels.append({label})")
+        lines.append(f"    return ', '.join(labels) if labels else {fallback!r}")
+        return lines
+
+    def _evaluate_source(self, table: Dict[str, Any]) -> List[str]:
+        lines = [
+            "def evaluate(device_id, sensor_data, stress_level, rain_probability, pumps=None):",
+            "    alerts = []",
+            "    actions = []",
+            "    recommend_action = False",
+            "    fired = []",
+        ]
+        # Field reads can't fail, so read them all up front into locals
+        for name, (field, default) in self.fields.items():
+            if not name.isidentifier():
+                raise RuleError(f"Fact name '{name}' is not an identifier")
+            lines.append(f"    fact_{name} = sensor_data.get({field!r}, {self._literal(default)})")
+        for group in self.groups:
+            indent = "    "
+            if "when" in group:
+                lines.append(f"    if {self._condition(group['when'])}:")
+                indent = "        "
+            # First matching rule ends the group (an if/elif chain)
+            for position, rule in enumerate(group["rules"]):
+                keyword = "if" if position == 0 else "elif"
+                lines.append(f"{indent}{keyword} {self._condition(rule['when'])}:")
+                lines += self._rule_body(rule, indent + "    ")
+        facts = ", ".join(f"{name!r}: {self._fact(name)}" for name in self.report)
+        lines.append("    return {'alerts': alerts, 'actions': actions, 'recommend_action': recommend_action, "
+                     f"'facts': {{{facts}}}, 'rules': fired}}")
+        return lines
+
+    def _rule_body(self, rule: Dict[str, Any], indent: str) -> List[str]:
+        lines = []
+        pump = rule.get("pump", {})
+        if "claim" in pump:
+            # Atomic claim; if the pump is already running the rule stays silent
+            duration = self._literal(self._param(pump.get("duration", 0)))
+            lines.append(f"{indent}if pumps is None or pumps.try_start(device_id, {pump['claim']!r}, {duration}):")
+            indent += "    "
+        lines.append(f"{indent}fired.append({rule.get('id')!r})")
+        if "alert" in rule:
+            self._specials.clear()
+            alert = ", ".join(f"{key!r}: {self._template(str(value))}" for key, value in rule["alert"].items())
+            for field in sorted(self._specials):
+                lines.append(f"{indent}{field} = {SPECIAL_FIELDS[field]}")
+            lines.append(f"{indent}alerts.append({{{alert}}})")
+        if "action" in rule:
+            action = rule["action"]
+            command = ", ".join(f"{key!r}: {self._literal(self._param(value))}" for key, value in action["command"].items())
+            lines.append(f"{indent}actions.append({{'type': {action['type']!r}, 'deviceId': device_id, 'command': {{{command}}}}})")
+        if "stop" in pump:
+            lines.append(f"{indent}if pumps is not None:")
+            lines.append(f"{indent}    pumps.stop(device_id, {pump['stop']!r})")
+        if "recommend" in rule:
+            lines.append(f"{indent}recommend_action = {bool(rule['recommend'])!r}")
+        return lines
+
+
+class RuleEngine:
+    """
+    Loads a JSON rule table, compiles it per crop and evaluates readings
+
+    The table has shared params (thresholds, durations, message fragments)
+    with per-crop overrides, facts read from the reading, derived facts,
+    and ordered groups of rules; within a group the first matching rule
+    fires. The file is re-checked at most every reload_interval seconds
+    and recompiled when it changes; a table that fails to compile is
+    reported and the previous one stays active.
+    """
+
+    def __init__(self, path: str, reload_interval: float = 5.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.plans: Dict[str, CropPlan] = {}
+        self.default_crop: Optional[str] = None
+        self.version = None
+        self.loaded_at: Optional[str] = None
+        self.last_error: Optional[str] = None
+        self.reloads = 0
+        self.unknown_crops = 0
+        self._mtime: Optional[float] = None
+        self._checked_at = time.monotonic()
+        if not self.reload():
+            raise RuleError(f"Could not load rules from {path}: {self.last_error}")
+
+    def reload(self) -> bool:
+        """Recompile the rule file; keeps the current rules and returns False on error"""
+        mtime = None
+        try:
+            mtime = os.path.getmtime(self.path)
+            with open(self.path, encoding="utf-8") as f:
+                table = json.load(f)
+            base = table.get("params", {})
+            crops = table.get("crops") or {"default": {}}
+            plans = {crop: CropPlan(crop, table, {**base, **overrides}) for crop, overrides in crops.items()}
+            default_crop = table.get("default_crop") or next(iter(plans))
+            if default_crop not in plans:
+                raise RuleError(f"default_crop '{default_crop}' is not in crops")
+        except Exception as e:  # any malformed table (wrong shapes included) keeps the current rules
+            self.last_error = f"{type(e).__name__}: {e}"
+            self._mtime = mtime if mtime is not None else self._mtime  # don't retry until it changes again
+            print(f"⚠️ Rules not reloaded from {self.path}: {self.last_error}")
+            return False
+        self.plans, self.default_crop, self.version = plans, default_crop, table.get("version")
+        self._mtime = mtime
+        self.loaded_at = datetime.now().isoformat()
+        self.last_error = None
+        self.reloads += 1
+        return True
+
+    def maybe_reload(self):
+        """Hot reload: recompile if the file changed (stat at most every reload_interval)"""
+        now = time.monotonic()
+        if self.reload_interval <= 0 or now - self._checked_at < self.reload_interval:
+            return
+        self._checked_at = now
+        try:
+            changed = os.path.getmtime(self.path) != self._mtime
+        except OSError:
+            return
+        if changed and self.reload():
+            print(f"✅ Reloaded rules from {self.path} (version {self.version})")
+
+    def plan(self, crop: Optional[str] = None) -> CropPlan:
+        plan = self.plans.get(crop or self.default_crop)
+        if plan is None:
+            self.unknown_crops += 1
+            plan = self.plans[self.default_crop]
+        return plan
+
+    def evaluate(self, device_id: str, sensor_data: Dict[str, Any], stress_level: float,
+                 rain_probability: float, crop: Optional[str] = None, pumps=None) -> Dict[str, Any]:
+        """
+        Decision for one reading: alerts, actions, recommend_action, the
+        table's reported facts and the ids of the rules that fired.
+        pumps (a PumpStateStore) handles pump claims/stops
+        """
+        self.maybe_reload()
+        return self.plan(crop).evaluate(device_id, sensor_data, stress_level, rain_probability, pumps)
+
+    def evaluate_batch(self, items: Iterable[Dict[str, Any]], pumps=None) -> List[Any]:
+        """
+        Evaluate many readings against one snapshot of the rules. items are
+        dicts with deviceId, sensorData, stressLevel, rainProbability and
+        optionally crop; a reading that fails yields its exception in its slot
+        """
+        self.maybe_reload()
+        results = []
+        for item in items:
+            try:
+                results.append(self.plan(item.get("crop")).evaluate(
+                    item["deviceId"], item["sensorData"], item["stressLevel"], item["rainProbability"], pumps
+                ))
+            except Exception as e:
+                results.append(e)
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        plan = self.plans[self.default_crop]
+        return {
+            "path": self.path,
+            "version": self.version,
+            "crops": sorted(self.plans),
+            "default_crop": self.default_crop,
+            "groups": len(plan.groups),
+            "rules": plan.rule_count,
+            "loaded_at": self.loaded_at,
+            "reloads": self.reloads,
+            "unknown_crops": self.unknown_crops,
+            "last_error": self.last_error
+        }
@@ -0,0 +1,566 @@
+"""
+Sensor History
+Append-only, columnar on-disk history of every ingested reading per device.
+Chunks are .npy files of shape (columns, rows) - one contiguous float64
+column per field - read back memory-mapped, so range queries return views
+into the page cache instead of re-parsed JSON. Hourly and daily
+min/max/mean/count rollups are kept alongside, updated as readings arrive
+"""
+import math
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Sequence
+from urllib.parse import quote, unquote
+
+import numpy as np
+
+from utils.device_state import WINDOW_FIELDS
+
+# Column order of every chunk (row 0 of a chunk is the timestamp column)
+HISTORY_COLUMNS = ('timestamp',) + WINDOW_FIELDS
+SCHEMA_FILE = "columns.txt"
+
+# Rollups maintained on ingest: name -> bucket width in seconds (days start at local midnight)
+ROLLUP_RESOLUTIONS = {"hourly": 3600, "daily": 86400}
+# Rollup entry layout: bucket start, then one row per field for each stat
+ROLLUP_WIDTH = 1 + 4 * len(WINDOW_FIELDS)
+
+
+def device_dirname(device_id: str) -> str:
+    """Reversible directory name for a device ID: percent-encoded, a leading dot escaped"""
+    name = quote(device_id, safe="")
+    if name.startswith("."):
+        name = "%2E" + name[1:]
+    return name or "%"
+
+
+def dirname_device(name: str) -> str:
+    """Device ID stored in a directory named by device_dirname"""
+    return "" if name == "%" else unquote(name)
+
+
+class _Pending:
+    """Readings appended since the last flush, one column each (grows by doubling)"""
+
+    def __init__(self, width: int, capacity: int = 64):
+        self.data = np.empty((width, capacity))
+        self.rows = 0
+
+    def append(self, row: List[float]):
+        if self.rows == self.data.shape[1]:
+            grown = np.empty((self.data.shape[0], self.rows * 2))
+            grown[:, :self.rows] = self.data
+            self.data = grown
+        self.data[:, self.rows] = row
+        self.rows += 1
+
+    def block(self) -> np.ndarray:
+        return self.data[:, :self.rows]
+
+
+def _merge_rollups(block: np.ndarray) -> np.ndarray:
+    """Rollup entries sorted by bucket, with entries for the same bucket combined"""
+    block = _sorted(block)
+    starts = np.flatnonzero(np.r_[True, block[0, 1:] != block[0, :-1]]) if block.shape[1] else np.array([], dtype=int)
+    if len(starts) == block.shape[1]:
+        return block
+    n = len(WINDOW_FIELDS)
+    merged = np.empty((ROLLUP_WIDTH, len(starts)))
+    merged[0] = block[0, starts]
+    merged[1:1 + 2 * n] = np.add.reduceat(block[1:1 + 2 * n], starts, axis=1)
+    merged[1 + 2 * n:1 + 3 * n] = np.minimum.reduceat(block[1 + 2 * n:1 + 3 * n], starts, axis=1)
+    merged[1 + 3 * n:] = np.maximum.reduceat(block[1 + 3 * n:], starts, axis=1)
+    return merged
+
+
+def _sorted(block: np.ndarray) -> np.ndarray:
+    """Columns ordered by row 0 (late readings are rare, so usually the block itself)"""
+    if block.shape[1] > 1 and np.any(block[0, 1:] < block[0, :-1]):
+        return block[:, np.argsort(block[0], kind="stable")]
+    return block
+
+
+class SensorHistoryStore:
+    """
+    Layout under root:
+        columns.txt                                column names, one per line
+        <device>/<first_ts>-<writer>-<seq>.tail    raw float64 rows, appended on flush
+        <device>/<first_ts>-<writer>-<seq>.npy     sealed chunk, float64 array (columns, rows)
+        <device>/rollup-<hourly|daily>/...         same scheme for rollup entries
+
+    Readings wait in memory until flush() appends them to the writer's tail
+    file (O(new readings), however many devices); once a tail holds
+    chunk_rows readings it is sorted by timestamp and sealed into a columnar
+    .npy chunk that is never modified again. Every writer owns its file
+    names, so several workers can share one root and read each other's data.
+
+    Rollups are maintained by the same flush: the new readings are reduced
+    to per-bucket [count, sum, min, max] entries for every resolution and
+    appended to the rollup tail. Those stats merge by addition and min/max,
+    so entries from every flush and writer are combined when read; every
+    rollup_chunk entries the tail is compacted and, once that leaves at
+    least rollup_chunk / 2 buckets, sealed.
+
+    append() only takes a short lock on the in-memory buffers, never the
+    lock held while files are written, so it is safe to call on an event
+    loop while a flush runs in a thread.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        chunk_rows: int = 4096,
+        rollup_chunk: int = 256,
+        max_mapped: int = 512,
+        utc_offset: Optional[float] = None
+    ):
+        self.root = root
+        self.chunk_rows = chunk_rows
+        self.rollup_chunk = rollup_chunk
+        self.max_mapped = max_mapped
+        # Seconds east of UTC that daily buckets are aligned to (default: this host's zone)
+        self.utc_offset = datetime.now().astimezone().utcoffset().total_seconds() if utc_offset is None else utc_offset
+        self.writer = f"{os.getpid()}{uuid.uuid4().hex[:6]}"
+        self._seq = 0
+        self._pending: Dict[str, _Pending] = {}
+        self._writing: Dict[str, _Pending] = {}  # taken from _pending, not yet on disk
+        self._pending_lock = threading.Lock()
+        # (device, kind) -> [tail file stem, entries in it]; kind "" is raw readings, "rollup-<name>" a rollup
+        self._tails: Dict[tuple, list] = {}
+        self._mapped: "OrderedDict[str, tuple]" = OrderedDict()  # path -> ((mtime_ns, size), array)
+        self._lock = threading.RLock()
+        self.appended = 0
+        self.sealed = 0
+        os.makedirs(root, exist_ok=True)
+        self._check_schema()
+
+    def _check_schema(self):
+        path = os.path.join(self.root, SCHEMA_FILE)
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                columns = tuple(f.read().split())
+            if columns != HISTORY_COLUMNS:
+                raise ValueError(f"History at {self.root} has columns {columns}, expected {HISTORY_COLUMNS}")
+        else:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("\n".join(HISTORY_COLUMNS) + "\n")
+
+    def bucket_starts(self, timestamps: np.ndarray, seconds: float) -> np.ndarray:
+        """Start (epoch seconds) of the rollup bucket holding each timestamp"""
+        return np.floor((timestamps + self.utc_offset) / seconds) * seconds - self.utc_offset
+
+    def aggregate(self, block: np.ndarray, seconds: float) -> np.ndarray:
+        """
+        Readings (HISTORY_COLUMNS x rows) -> rollup entries, one column per
+        bucket: [bucket start, count x fields, sum x fields, min x fields, max x fields]
+        """
+        buckets = self.bucket_starts(block[0], seconds)
+        order = np.argsort(buckets, kind="stable")
+        buckets, values = buckets[order], block[1:, order]
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        present = ~np.isnan(values)
+        n = len(WINDOW_FIELDS)
+        entries = np.empty((ROLLUP_WIDTH, len(starts)))
+        entries[0] = buckets[starts]
+        entries[1:1 + n] = np.add.reduceat(present, starts, axis=1)
+        entries[1 + n:1 + 2 * n] = np.add.reduceat(np.where(present, values, 0.0), starts, axis=1)
+        entries[1 + 2 * n:1 + 3 * n] = np.minimum.reduceat(np.where(present, values, np.inf), starts, axis=1)
+        entries[1 + 3 * n:] = np.maximum.reduceat(np.where(present, values, -np.inf), starts, axis=1)
+        return entries
+
+    # ---------- writing ----------
+
+    def append(self, device_id: str, reading: Dict[str, Any], timestamp: float) -> bool:
+        """
+        Add one reading (missing or non-numeric fields are stored as NaN).
+        True once the device holds chunk_rows unsaved readings: the caller
+        should flush(device_id), off the event loop, to bound memory
+        """
+        row = [timestamp]
+        for field in WINDOW_FIELDS:
+            value = reading.get(field)
+            row.append(float(value) if isinstance(value, (int, float)) else np.nan)
+        name = device_dirname(device_id)
+        with self._pending_lock:
+            pending = self._pending.get(name)
+            if pending is None:
+                pending = self._pending[name] = _Pending(len(HISTORY_COLUMNS))
+            pending.append(row)
+            self.appended += 1
+            return pending.rows == self.chunk_rows
+
+    def _flush_device(self, name: str):
+        """Append the device's pending readings to its raw tail and their rollup entries to the rollup tails"""
+        # Caller holds self._lock; readers see the readings in _writing until they are on disk
+        with self._pending_lock:
+            pending = self._pending.pop(name, None)
+            if pending is None or not pending.rows:
+                return
+            self._writing[name] = pending
+        try:
+            block = pending.block()
+            self._append_tail(name, "", block)
+            for label, seconds in ROLLUP_RESOLUTIONS.items():
+                self._append_tail(name, "rollup-" + label, self.aggregate(block, seconds))
+        finally:
+            with self._pending_lock:
+                self._writing.pop(name, None)
+
+    def _append_tail(self, name: str, kind: str, block: np.ndarray):
+        directory = os.path.join(self.root, name, kind)
+        os.makedirs(directory, exist_ok=True)
+        tail = self._tails.get((name, kind))
+        if tail is None:
+            self._seq += 1
+            tail = self._tails[(name, kind)] = [f"{int(block[0].min()):010d}-{self.writer}-{self._seq:06d}", 0]
+        path = os.path.join(directory, tail[0])
+        with open(path + ".tail", "ab") as f:
+            f.write(np.ascontiguousarray(block.T).tobytes())
+        tail[1] += block.shape[1]
+
+        if not kind and tail[1] >= self.chunk_rows:
+            self._seal(path, _sorted(self._read_tail(path + ".tail", len(HISTORY_COLUMNS))))
+            del self._tails[(name, kind)]
+        elif kind and tail[1] >= self.rollup_chunk:
+            # Every flush re-appends the buckets still filling: merge them,
+            # and seal once the tail holds enough distinct buckets
+            entries = _merge_rollups(self._read_tail(path + ".tail", ROLLUP_WIDTH))
+            if entries.shape[1] >= self.rollup_chunk // 2:
+                self._seal(path, entries)
+                del self._tails[(name, kind)]
+            else:
+                with open(path + ".tail.tmp", "wb") as f:
+                    f.write(np.ascontiguousarray(entries.T).tobytes())
+                os.replace(path + ".tail.tmp", path + ".tail")
+                tail[1] = entries.shape[1]
+
+    def _seal(self, path: str, block: np.ndarray):
+        """Tail file -> columnar chunk (written before the tail is removed)"""
+        with open(path + ".npy.tmp", "wb") as f:
+            np.save(f, np.ascontiguousarray(block))
+        os.replace(path + ".npy.tmp", path + ".npy")
+        os.remove(path + ".tail")
+        self.sealed += 1
+
+    def flush(self, device_id: Optional[str] = None):
+        """Append unsaved readings to the tail files (all devices, or one)"""
+        with self._lock:
+            with self._pending_lock:
+                names = list(self._pending) if device_id is None else [device_dirname(device_id)]
+            for name in names:
+                try:
+                    self._flush_device(name)
+                except OSError as e:
+                    print(f"⚠️ Could not write history for {name}: {e}")
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._mapped.clear()
+
+    # ---------- reading ----------
+
+    def _cached(self, path: str, load) -> Optional[np.ndarray]:
+        """File contents via load(path), reused until the file changes"""
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        stamp = (st.st_mtime_ns, st.st_size)
+        cached = self._mapped.get(path)
+        if cached and cached[0] == stamp:
+            self._mapped.move_to_end(path)
+            return cached[1]
+        try:
+            array = load(path)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Skipping unreadable history file {path}: {e}")
+            return None
+        self._mapped[path] = (stamp, array)
+        while len(self._mapped) > self.max_mapped:
+            self._mapped.popitem(last=False)
+        return array
+
+    @staticmethod
+    def _read_tail(path: str, width: int) -> np.ndarray:
+        raw = np.fromfile(path, dtype=np.float64)
+        # A row being appended right now may be incomplete - leave it for the next read
+        return raw[:len(raw) // width * width].reshape(-1, width).T
+
+    def _chunks(self, device_id: str, kind: str = "") -> List[np.ndarray]:
+        """
+        Every chunk of a device's readings (or of one rollup series): sealed
+        (mapped), tails, then unsaved entries. Reading chunks are sorted by timestamp
+        """
+        name = device_dirname(device_id)
+        directory = os.path.join(self.root, name, kind)
+        if kind:
+            read_tail = lambda p: self._read_tail(p, ROLLUP_WIDTH)
+        else:
+            read_tail = lambda p: _sorted(self._read_tail(p, len(HISTORY_COLUMNS)))
+        with self._lock:
+            try:
+                files = os.listdir(directory)
+            except OSError:
+                files = []
+            sealed = sorted(f[:-4] for f in files if f.endswith(".npy"))
+            tails = sorted(f[:-5] for f in files if f.endswith(".tail") and f[:-5] not in sealed)
+            chunks = [self._cached(os.path.join(directory, s + ".npy"), lambda p: np.load(p, mmap_mode="r")) for s in sealed]
+            for stem in tails:
+                block = self._cached(os.path.join(directory, stem + ".tail"), read_tail)
+                if block is None:  # sealed since the listing
+                    block = self._cached(os.path.join(directory, stem + ".npy"), lambda p: np.load(p, mmap_mode="r"))
+                chunks.append(block)
+            with self._pending_lock:
+                blocks = [p.block().copy() for p in (self._writing.get(name), self._pending.get(name)) if p is not None and p.rows]
+            for block in blocks:
+                chunks.append(self.aggregate(block, ROLLUP_RESOLUTIONS[kind[len("rollup-"):]]) if kind else _sorted(block))
+        return [c for c in chunks if c is not None and c.shape[1]]
+
+    def has_device(self, device_id: str) -> bool:
+        name = device_dirname(device_id)
+        with self._pending_lock:
+            if name in self._pending:
+                return True
+        return os.path.isdir(os.path.join(self.root, name))
+
+    def devices(self) -> List[str]:
+        """IDs of devices with a directory on disk or only unsaved readings"""
+        with self._pending_lock:
+            names = set(self._pending)
+        try:
+            names.update(n for n in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, n)))
+        except OSError:
+            pass
+        return sorted(dirname_device(n) for n in names)
+
+    def query(
+        self,
+        device_id: str,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        fields: Sequence[str] = WINDOW_FIELDS
+    ) -> Dict[str, np.ndarray]:
+        """
+        {"timestamp", field...} arrays for start <= timestamp <= end (epoch
+        seconds, either bound optional), oldest first. A range inside one
+        chunk is returned as read-only views of the mapped file
+        """
+        rows = [HISTORY_COLUMNS.index(f) for f in fields]
+        parts = []
+        for chunk in self._chunks(device_id):
+            timestamps = chunk[0]
+            if (start is not None and timestamps[-1] < start) or (end is not None and timestamps[0] > end):
+                continue
+            lo = 0 if start is None else int(np.searchsorted(timestamps, start, "left"))
+            hi = len(timestamps) if end is None else int(np.searchsorted(timestamps, end, "right"))
+            if hi > lo:
+                parts.append(chunk[:, lo:hi])
+        if not parts:
+            return {"timestamp": np.array([]), **{f: np.array([]) for f in fields}}
+        if len(parts) == 1:
+            block = parts[0]
+        else:
+            block = np.concatenate(parts, axis=1)
+            # Chunks from several writers can interleave in time
+            if np.any(block[0, 1:] < block[0, :-1]):
+                block = block[:, np.argsort(block[0], kind="stable")]
+        return {"timestamp": block[0], **{f: block[r] for f, r in zip(fields, rows)}}
+
+    def downsample(
+        self,
+        device_id: str,
+        resolution: float,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        fields: Sequence[str] = WINDOW_FIELDS
+    ) -> Dict[str, np.ndarray]:
+        """
+        Per-bucket means (NaN ignored) over resolution-second buckets aligned
+        to the epoch; "timestamp" is the bucket start, "count" the readings in it
+        """
+        columns = self.query(device_id, start, end, fields)
+        timestamps = columns["timestamp"]
+        if len(timestamps) == 0:
+            return {**columns, "count": np.array([], dtype=int)}
+        buckets = np.floor(timestamps / resolution) * resolution
+        starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+        result = {"timestamp": buckets[starts], "count": np.diff(np.r_[starts, len(timestamps)])}
+        for field in fields:
+            values = columns[field]
+            present = ~np.isnan(values)
+            sums = np.add.reduceat(np.where(present, values, 0.0), starts)
+            counts = np.add.reduceat(present.astype(int), starts)
+            result[field] = np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+        return result
+
+    def rollup(
+        self,
+        device_id: str,
+        resolution: str,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        fields: Sequence[str] = WINDOW_FIELDS
+    ) -> Dict[str, Any]:
+        """
+        {"timestamp": bucket starts, field: {"count", "mean", "min", "max"}}
+        for the buckets overlapping [start, end]; mean/min/max are NaN where
+        a bucket has no value for the field
+        """
+        if resolution not in ROLLUP_RESOLUTIONS:
+            raise ValueError(f"Unknown resolution {resolution!r}; available: {list(ROLLUP_RESOLUTIONS)}")
+        seconds = ROLLUP_RESOLUTIONS[resolution]
+        chunks = self._chunks(device_id, "rollup-" + resolution)
+        block = np.concatenate(chunks, axis=1) if chunks else np.empty((ROLLUP_WIDTH, 0))
+        keep = np.ones(block.shape[1], dtype=bool)
+        if start is not None:
+            keep &= block[0] + seconds > start
+        if end is not None:
+            keep &= block[0] <= end
+        block = _merge_rollups(block[:, keep])
+
+        n = len(WINDOW_FIELDS)
+        result: Dict[str, Any] = {"timestamp": block[0]}
+        for field in fields:
+            i = WINDOW_FIELDS.index(field)
+            count = block[1 + i]
+            empty = count == 0
+            result[field] = {
+                "count": count.astype(int),
+                "mean": np.where(empty, np.nan, block[1 + n + i] / np.maximum(count, 1)),
+                "min": np.where(empty, np.nan, block[1 + 2 * n + i]),
+                "max": np.where(empty, np.nan, block[1 + 3 * n + i])
+            }
+        return result
+
+    def rollup_means(
+        self,
+        device_id: str,
+        resolution: str,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        fields: Sequence[str] = WINDOW_FIELDS
+    ) -> Dict[str, np.ndarray]:
+        """Bucket means in query() layout: {"timestamp": bucket starts, field: mean}"""
+        rollup = self.rollup(device_id, resolution, start, end, fields)
+        return {"timestamp": rollup["timestamp"], **{f: rollup[f]["mean"] for f in fields}}
+
+    def training_columns(
+        self,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        fields: Sequence[str] = ('moisture', 'temperature', 'humidity'),
+        resolution: Optional[str] = None
+    ) -> Dict[str, np.ndarray]:
+        """
+        Every device's readings (or rollup means at resolution) concatenated,
+        with a 'group' column (same shape as DeviceStateStore.training_columns)
+        """
+        groups, parts = [], []
+        for name in self.devices():
+            if resolution:
+                columns = self.rollup_means(name, resolution, start, end, fields)
+            else:
+                columns = self.query(name, start, end, fields)
+            if len(columns["timestamp"]):
+                groups.append(np.full(len(columns["timestamp"]), name))
+                parts.append(columns)
+        if not parts:
+            return {"group": np.array([]), "timestamp": np.array([]), **{f: np.array([]) for f in fields}}
+        result = {"group": np.concatenate(groups)}
+        for key in ("timestamp",) + tuple(fields):
+            result[key] = np.concatenate([p[key] for p in parts])
+        return result
+
+    def reference(
+        self,
+        device_id: Optional[str] = None,
+        start: Optional[float] = None,
+        end: Optional[float] = None,
+        fields: Sequence[str] = ('moisture',),
+        resolution: Optional[str] = None
+    ) -> "HistoryRef":
+        """
+        Flush and return a picklable pointer to one device's range (or every
+        device's, for training) that a pool worker can read from disk itself;
+        with a resolution it points at that rollup's means instead of raw readings
+        """
+        self.flush(device_id)
+        return HistoryRef(self.root, device_id, start, end, tuple(fields), resolution)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._pending_lock:
+            pending_readings = sum(p.rows for p in self._pending.values())
+        with self._lock:
+            return {
+                "root": self.root,
+                "devices": len(self.devices()),
+                "appended": self.appended,
+                "sealed_chunks": self.sealed,
+                "open_tails": len(self._tails),
+                "pending_readings": pending_readings,
+                "cached_files": len(self._mapped),
+                "chunk_rows": self.chunk_rows,
+                "rollups": list(ROLLUP_RESOLUTIONS)
+            }
+
+
+def _json_values(values, decimals: int):
+    if isinstance(values, dict):
+        return {key: _json_values(v, decimals) for key, v in values.items()}
+    if values.dtype.kind == "f":
+        return [None if v != v else v for v in np.round(values, decimals).tolist()]
+    return values.tolist()
+
+
+def columns_to_json(columns: Dict[str, Any], decimals: int = 3) -> Dict[str, Any]:
+    """Query/downsample/rollup result -> JSON lists: ISO timestamps, rounded values, None for NaN"""
+    result = {"timestamp": [datetime.fromtimestamp(ts).isoformat() for ts in columns["timestamp"].tolist()]}
+    for key, values in columns.items():
+        if key != "timestamp":
+            result[key] = _json_values(values, decimals)
+    return result
+
+
+# Read-side stores opened by pool worker processes (one per root)
+_readers: Dict[str, SensorHistoryStore] = {}
+
+
+class HistoryRef:
+    """
+    Where to find a slice of history rather than the data itself, so it can
+    be handed to a process pool for the cost of a few strings. load() maps
+    the chunks in whichever process calls it
+    """
+
+    def __init__(
+        self,
+        root: str,
+        device_id: Optional[str],
+        start: Optional[float],
+        end: Optional[float],
+        fields: tuple,
+        resolution: Optional[str] = None
+    ):
+        self.root = root
+        self.device_id = device_id
+        self.start = start
+        self.end = end
+        self.fields = fields
+        self.resolution = resolution
+
+    def load(self) -> Dict[str, np.ndarray]:
+        """One device: {"timestamp", field...}; all devices: training columns with 'group'"""
+        store = _readers.get(self.root)
+        if store is None:
+            store = _readers[self.root] = SensorHistoryStore(self.root)
+        if self.device_id is None:
+            return store.training_columns(self.start, self.end, self.fields, self.resolution)
+        if self.resolution:
+            return store.rollup_means(self.device_id, self.resolution, self.start, self.end, self.fields)
+        return store.query(self.device_id, self.start, self.end, self.fields)
@@ -0,0 +1,282 @@
+"""
+Shared State
+Small key/value store with atomic compare-and-set and TTL expiry, shared by
+every worker process (pump state, Gemini quota/routing, weather cache)
+"""
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlparse
+
+try:
+    import redis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+
+class SharedStore:
+    """
+    Backend interface: string values per key, each with an optional TTL
+
+    Subclasses implement get(), set() and compare_and_set(); anything that
+    must not race between workers is built on compare_and_set.
+
+    Async code uses aget()/aset()/acompare_and_set(), or run() for a
+    synchronous call that touches the store: with a blocking backend
+    (blocking = True, e.g. SQLite waiting on another worker's write lock)
+    they run in a worker thread, so the event loop never stalls.
+    """
+
+    backend = "base"
+    blocking = False
+
+    def get(self, key: str) -> Optional[str]:
+        raise NotImplementedError
+
+    def set(self, key: str, value: Optional[str], ttl: Optional[float] = None):
+        """Unconditional write; value None deletes the key"""
+        raise NotImplementedError
+
+    def compare_and_set(self, key: str, expected: Optional[str], value: Optional[str], ttl: Optional[float] = None) -> bool:
+        """
+        Atomically replace key's value if it currently equals expected
+        (None = absent or expired). value None deletes the key
+        """
+        raise NotImplementedError
+
+    def count(self, prefix: str = "") -> int:
+        """Live keys starting with prefix"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.backend, "keys": self.count()}
+
+    async def run(self, fn, *args, **kwargs):
+        """Call fn (which uses this store) off the event loop if the backend can block"""
+        if self.blocking:
+            return await asyncio.to_thread(fn, *args, **kwargs)
+        return fn(*args, **kwargs)
+
+    async def aget(self, key: str) -> Optional[str]:
+        return await self.run(self.get, key)
+
+    async def aset(self, key: str, value: Optional[str], ttl: Optional[float] = None):
+        await self.run(self.set, key, value, ttl)
+
+    async def acompare_and_set(self, key: str, expected: Optional[str], value: Optional[str], ttl: Optional[float] = None) -> bool:
+        return await self.run(self.compare_and_set, key, expected, value, ttl)
+
+
+class MemorySharedStore(SharedStore):
+    """Single-process store: lost on restart, not shared between workers"""
+
+    backend = "memory"
+
+    def __init__(self):
+        self._data: Dict[str, tuple] = {}  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+
+    def _live(self, key: str) -> Optional[str]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            del self._data[key]
+            return None
+        return value
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            return self._live(key)
+
+    def _write(self, key, value, ttl):
+        if value is None:
+            self._data.pop(key, None)
+        else:
+            self._data[key] = (value, time.time() + ttl if ttl else None)
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._write(key, value, ttl)
+
+    def compare_and_set(self, key, expected, value, ttl=None) -> bool:
+        with self._lock:
+            if self._live(key) != expected:
+                return False
+            self._write(key, value, ttl)
+            return True
+
+    def count(self, prefix: str = "") -> int:
+        with self._lock:
+            now = time.time()
+            return sum(
+                1 for key, (_, expires_at) in self._data.items()
+                if key.startswith(prefix) and (expires_at is None or expires_at > now)
+            )
+
+
+class SqliteSharedStore(SharedStore):
+    """
+    SQLite in WAL mode: survives restarts and is shared by every worker on
+    the host. compare_and_set runs in a BEGIN IMMEDIATE transaction, which
+    takes the write lock before reading. Writes can wait up to the 5 s busy
+    timeout on another worker, so the store is blocking
+    """
+
+    backend = "sqlite"
+    blocking = True
+
+    def __init__(self, path: str):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        self._writes = 0
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS shared_state (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)"
+            )
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM shared_state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                (key, time.time())
+            ).fetchone()
+        return row[0] if row else None
+
+    def _write(self, key, value, ttl, now):
+        if value is None:
+            self._conn.execute("DELETE FROM shared_state WHERE key = ?", (key,))
+        else:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO shared_state (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, value, now + ttl if ttl else None)
+            )
+        self._writes += 1
+        if self._writes % 200 == 0:
+            self._conn.execute("DELETE FROM shared_state WHERE expires_at <= ?", (now,))
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._write(key, value, ttl, time.time())  # autocommit
+
+    def compare_and_set(self, key, expected, value, ttl=None) -> bool:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute(
+                    "SELECT value FROM shared_state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                    (key, now)
+                ).fetchone()
+                if (row[0] if row else None) != expected:
+                    self._conn.execute("ROLLBACK")
+                    return False
+                self._write(key, value, ttl, now)
+                self._conn.execute("COMMIT")
+                return True
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def count(self, prefix: str = "") -> int:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM shared_state WHERE key LIKE ? ESCAPE '\\' AND (expires_at IS NULL OR expires_at > ?)",
+                (prefix.replace("%", "\\%").replace("_", "\\_") + "%", time.time())
+            ).fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RedisSharedStore(SharedStore):
+    """
+    Any Redis-protocol server (Redis, Valkey, KeyDB, or a local stand-in
+    such as fakeredis passed in as client). Compare-and-set uses
+    WATCH/MULTI/EXEC, expiry uses PX, so no server-side scripting is needed.
+    The client is synchronous (its connection pool is thread-safe), so the
+    store is blocking and async callers run it in a worker thread
+    """
+
+    backend = "redis"
+    blocking = True
+
+    def __init__(self, url: Optional[str] = None, client=None, prefix: str = "agri:"):
+        if client is None:
+            if not REDIS_AVAILABLE:
+                raise RuntimeError("redis package not installed (pip install redis)")
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key: str) -> Optional[str]:
+        value = self.client.get(self.prefix + key)
+        return value.decode() if isinstance(value, bytes) else value
+
+    def set(self, key, value, ttl=None):
+        if value is None:
+            self.client.delete(self.prefix + key)
+        elif ttl:
+            self.client.set(self.prefix + key, value, px=max(1, int(ttl * 1000)))
+        else:
+            self.client.set(self.prefix + key, value)
+
+    def compare_and_set(self, key, expected, value, ttl=None) -> bool:
+        key = self.prefix + key
+        with self.client.pipeline() as pipe:
+            try:
+                pipe.watch(key)
+                current = pipe.get(key)
+                if isinstance(current, bytes):
+                    current = current.decode()
+                if current != expected:
+                    pipe.unwatch()
+                    return False
+                pipe.multi()
+                if value is None:
+                    pipe.delete(key)
+                elif ttl:
+                    pipe.set(key, value, px=max(1, int(ttl * 1000)))
+                else:
+                    pipe.set(key, value)
+                pipe.execute()
+                return True
+            except Exception as e:
+                if type(e).__name__ == "WatchError":
+                    return False  # another worker changed it first
+                raise
+
+    def count(self, prefix: str = "") -> int:
+        return sum(1 for _ in self.client.scan_iter(match=f"{self.prefix}{prefix}*", count=500))
+
+    def close(self):
+        try:
+            self.client.close()
+        except Exception:
+            pass
+
+
+def create_shared_store(url: str = "memory://") -> SharedStore:
+    """memory:// | sqlite:///path/to/shared_state.db | redis://host:6379/0"""
+    parsed = urlparse(url)
+    if parsed.scheme in ("", "memory"):
+        return MemorySharedStore()
+    if parsed.scheme == "sqlite":
+        return SqliteSharedStore(url[len("sqlite:///"):] if url.startswith("sqlite:///") else parsed.path)
+    if parsed.scheme in ("redis", "rediss", "unix"):
+        return RedisSharedStore(url)
+    raise ValueError(f"Unsupported shared store URL scheme: {parsed.scheme}")
@@ -0,0 +1,172 @@
+"""
+Weather Cache
+Process-wide TTL cache for weather forecasts with single-flight
+deduplication and stale-while-revalidate
+"""
+import asyncio
+import json
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+class WeatherCache:
+    """
+    Async TTL cache keyed by an arbitrary hashable key
+
+    - Fresh entries (younger than ttl) are returned directly
+    - Stale entries (younger than ttl + stale) are returned immediately while
+      one background refresh runs
+    - Misses wait on a single shared fetch per key, so concurrent callers
+      never hit the upstream more than once
+    - A failed fetch (None or exception) is never cached; the last good value
+      is kept and served while it is within the stale window, and None is
+      returned once it is older than ttl + stale
+
+    With a shared store, values must be JSON-serializable: a worker whose
+    copy is missing or stale first adopts a newer one written by another
+    worker, and stale refreshes take a short shared lock so only one worker
+    refreshes each key
+    """
+
+    def __init__(self, ttl_seconds: float = 900, stale_seconds: float = 3600, shared=None, lock_seconds: float = 30):
+        self.ttl = ttl_seconds
+        self.stale = stale_seconds
+        self.shared = shared
+        self.lock_seconds = lock_seconds
+        self._entries: Dict[Any, tuple] = {}  # key -> (stored_at, value)
+        self._inflight: Dict[Any, asyncio.Task] = {}
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0  # misses that joined an in-flight fetch
+        self.refreshes = 0
+        self.errors = 0
+        self.adopted = 0  # entries taken from another worker's fetch
+
+    @staticmethod
+    def _shared_key(key: Any) -> str:
+        return f"weather:{key}"
+
+    async def _adopt(self, key: Any, entry: Optional[tuple]) -> Optional[tuple]:
+        """Replace a missing/stale local entry with a newer shared one"""
+        if self.shared is None:
+            return entry
+        raw = await self.shared.aget(self._shared_key(key))
+        if raw is None:
+            return entry
+        shared = json.loads(raw)
+        stored_at = time.monotonic() - max(0.0, time.time() - shared["stored_at"])
+        if entry is not None and entry[0] >= stored_at:
+            return entry
+        self.adopted += 1
+        self._entries[key] = entry = (stored_at, shared["value"])
+        return entry
+
+    async def _claim_refresh(self, key: Any) -> bool:
+        """True if this worker should refresh key (always, without a shared store)"""
+        if self.shared is None or key in self._inflight:
+            return True
+        return await self.shared.acompare_and_set(
+            f"{self._shared_key(key)}:lock", None, str(os.getpid()), ttl=self.lock_seconds
+        )
+
+    async def get(self, key: Any, fetcher: Callable[[], Awaitable[Optional[Any]]]) -> Optional[Any]:
+        """Return the cached value for key, fetching it with fetcher when needed"""
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[0] >= self.ttl:
+            entry = await self._adopt(key, entry)
+        if entry:
+            age = time.monotonic() - entry[0]
+            if age < self.ttl:
+                self.hits += 1
+                return entry[1]
+            if age < self.ttl + self.stale:
+                self.stale_hits += 1
+                if await self._claim_refresh(key):
+                    self._refresh(key, fetcher)
+                return entry[1]
+
+        if key in self._inflight:
+            self.coalesced += 1
+        else:
+            self.misses += 1
+        # An entry that got here is past the stale window, so a failed fetch returns None
+        return await asyncio.shield(self._refresh(key, fetcher))
+
+    def peek(self, key: Any) -> Optional[Any]:
+        """Return the cached value for key (fresh or stale) without fetching"""
+        entry = self._entries.get(key)
+        if entry and time.monotonic() - entry[0] < self.ttl + self.stale:
+            return entry[1]
+        return None
+
+    async def age(self, key: Any) -> Optional[float]:
+        """Seconds since key's value was fetched (here or, with a shared store, by another worker); None if absent"""
+        entry = self._entries.get(key)
+        if entry is None or time.monotonic() - entry[0] >= self.ttl:
+            entry = await self._adopt(key, entry)
+        return None if entry is None else time.monotonic() - entry[0]
+
+    async def is_fresh(self, key: Any) -> bool:
+        """True if key has an entry younger than ttl"""
+        age = await self.age(key)
+        return age is not None and age < self.ttl
+
+    async def prefetch(self, key: Any, fetcher: Callable[[], Awaitable[Optional[Any]]]) -> Optional[Any]:
+        """Refetch key now (joining an in-flight fetch), whatever the age of its entry"""
+        return await asyncio.shield(self._refresh(key, fetcher))
+
+    async def store(self, key: Any, value: Any):
+        """Record a freshly fetched value, as a successful fetcher would (e.g. from a bulk fetch)"""
+        self._entries[key] = (time.monotonic(), value)
+        if self.shared is not None:
+            await self.shared.aset(
+                self._shared_key(key), json.dumps({"stored_at": time.time(), "value": value}),
+                ttl=self.ttl + self.stale
+            )
+
+    def put(self, key: Any, value: Any, stored_at: Optional[float] = None):
+        """Insert a value directly (e.g. restored from disk)"""
+        self._entries[key] = (time.monotonic() if stored_at is None else stored_at, value)
+
+    def _refresh(self, key: Any, fetcher: Callable[[], Awaitable[Optional[Any]]]) -> asyncio.Task:
+        """Start (or join) the single in-flight fetch for key"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(key, fetcher))
+            self._inflight[key] = task
+        return task
+
+    async def _fetch(self, key: Any, fetcher: Callable[[], Awaitable[Optional[Any]]]) -> Optional[Any]:
+        self.refreshes += 1
+        try:
+            value = await fetcher()
+            if value is None:
+                self.errors += 1
+            else:
+                await self.store(key, value)
+            return value
+        except Exception as e:
+            self.errors += 1
+            print(f"⚠️ Weather refresh failed for {key}: {e}")
+            return None
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for /api/health"""
+        lookups = self.hits + self.stale_hits + self.misses + self.coalesced
+        return {
+            "ttl_seconds": self.ttl,
+            "stale_seconds": self.stale,
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "refreshes": self.refreshes,
+            "errors": self.errors,
+            "adopted": self.adopted,
+            "hit_rate": round((self.hits + self.stale_hits) / lookups, 3) if lookups else None
+        }
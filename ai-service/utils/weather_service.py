@@ -1,70 +1,385 @@
-import httpx
-from typing import Dict, Any, Optional
+from collections import OrderedDict
+from typing import Dict, Any, List, Optional, Tuple
+import asyncio
+import json
 import os
-from datetime import datetime
+import time
+from datetime import datetime, date, timedelta
+
+from utils.atomic_file import write_atomic
+from utils.http_clients import HttpClientPool, http_clients
+from utils.weather_cache import WeatherCache
+
+# Open-Meteo's maximum; every fetch asks for all of it so any horizon shares one entry
+FORECAST_DAYS = 16
+
+DAILY_VARIABLES = "temperature_2m_max,temperature_2m_min,precipitation_sum,rain_sum,showers_sum,snowfall_sum"
+
+
+def parse_locations(value: str) -> List[Tuple[float, float]]:
+    """'lat,lon;lat,lon' (e.g. from WEATHER_LOCATIONS) -> [(lat, lon), ...]"""
+    locations = []
+    for pair in filter(None, (p.strip() for p in (value or "").split(";"))):
+        lat, lon = pair.split(",")
+        locations.append((float(lat), float(lon)))
+    return locations
+
 
 class WeatherService:
     """
     Service to fetch real-world weather data for specific locations
     Uses Open-Meteo for free, key-less weather data
+
+    Coordinates are snapped to a grid of grid_degrees (0.05° is about 5 km),
+    so nearby farms share one cached forecast per cell; entries age out by
+    TTL (past days are dropped when served), never all at once at midnight.
+    get_forecasts fetches many cells in one multi-coordinate request. With a
+    forecast_dir, the last good forecast of each cell is kept on disk: it is
+    reused after a restart while still fresh, and served (past days dropped)
+    when Open-Meteo is unreachable, before falling back to dummy data
+
+    Cells asked for are remembered so a background task can keep them fresh
+    with prefetch: at most max_cells, least recently requested dropped first,
+    and each forgotten once nobody has asked for it in idle_seconds. Cells of
+    the configured locations are always kept. Saved forecasts carry the time
+    their cell was last requested, so other workers pick up recently used
+    cells from forecast_dir, and files of idle cells are deleted. Disk reads
+    and writes run in a worker thread; a file is only re-read when its mtime
+    changes
     """
-    
-    def __init__(self):
+
+    def __init__(self, client_pool: Optional[HttpClientPool] = None, cache: Optional[WeatherCache] = None,
+                 grid_degrees: float = 0.05, forecast_dir: Optional[str] = None, bulk_size: int = 100,
+                 locations: Optional[List[Tuple[float, float]]] = None, max_cells: int = 2000,
+                 idle_seconds: float = 3 * 86400):
         self.base_url = "https://api.open-meteo.com/v1/forecast"
-        
+        self.client_pool = client_pool or http_clients
+        self.cache = cache or WeatherCache(ttl_seconds=3600)
+        self.grid = grid_degrees
+        self.forecast_dir = forecast_dir
+        self.bulk_size = max(1, bulk_size)
+        self.requests = 0  # HTTP requests to Open-Meteo
+        self.locations_fetched = 0
+        self.errors = 0
+        self.disk_hits = 0  # fresh forecasts reused from disk instead of fetching
+        self.saved_served = 0  # saved forecasts served while Open-Meteo was unreachable
+        self.fallbacks = 0
+        self.prefetched = 0  # cells refreshed ahead of expiry by refresh()
+        self.max_cells = max_cells
+        self.idle_seconds = idle_seconds
+        self.cells_dropped = 0  # cells forgotten as idle or over max_cells
+        self._pinned = set(self.cell(lat, lon) for lat, lon in locations or ())
+        self._known: "OrderedDict[Tuple[float, float], float]" = OrderedDict()  # cell -> last requested (epoch)
+        self._scanned: Dict[str, Tuple[int, float]] = {}  # forecast_dir file -> (mtime_ns, requested_at)
+
+    def cell(self, lat: float, lon: float) -> Tuple[float, float]:
+        """Grid cell (rounded lat, lon) a coordinate belongs to"""
+        if self.grid <= 0:
+            return (round(lat, 4), round(lon, 4))
+        return (round(round(lat / self.grid) * self.grid, 4), round(round(lon / self.grid) * self.grid, 4))
+
+    def _touch(self, cell: Tuple[float, float], requested_at: Optional[float] = None):
+        """Record a request for cell (most recent last), dropping the least recent past max_cells"""
+        if cell in self._pinned:
+            return
+        requested_at = time.time() if requested_at is None else requested_at
+        if requested_at < self._known.get(cell, 0.0):
+            return
+        if cell not in self._known and len(self._known) >= self.max_cells and requested_at <= next(iter(self._known.values())):
+            return  # older than everything kept
+        self._known[cell] = requested_at
+        self._known.move_to_end(cell)
+        while len(self._known) > self.max_cells:
+            self._known.popitem(last=False)
+            self.cells_dropped += 1
+
+    async def known_cells(self) -> List[Tuple[float, float]]:
+        """Configured cells plus those requested within idle_seconds, here or (via forecast_dir) by another worker"""
+        now = time.time()
+        if self.forecast_dir:
+            skip = self._pinned | set(self._known)
+            for cell, requested_at in await asyncio.to_thread(self._scan_saved, skip, now):
+                self._touch(cell, requested_at)
+        for cell in [cell for cell, requested_at in self._known.items() if now - requested_at >= self.idle_seconds]:
+            del self._known[cell]
+            self.cells_dropped += 1
+        return list(self._pinned) + list(self._known)
+
+    def _scan_saved(self, skip: set, now: float) -> List[Tuple[Tuple[float, float], float]]:
+        """
+        (cell, requested_at) of saved forecasts, other than skip, requested
+        within idle_seconds; files of idle cells are deleted (blocking)
+        """
+        try:
+            entries = list(os.scandir(self.forecast_dir))
+        except OSError:
+            return []
+        found, listed = [], set()
+        for entry in entries:
+            name = entry.name
+            if not name.endswith(".json"):
+                continue
+            lat, _, lon = name[:-len(".json")].partition("_")
+            try:
+                cell = (float(lat), float(lon))
+                mtime = entry.stat().st_mtime_ns
+            except (ValueError, OSError):
+                continue
+            listed.add(name)
+            if cell in skip:
+                continue
+            scanned = self._scanned.get(name)
+            if scanned is None or scanned[0] != mtime:
+                saved = self._load(cell)
+                scanned = self._scanned[name] = (mtime, saved.get("requested_at", 0.0) if saved else 0.0)
+            if now - scanned[1] < self.idle_seconds:
+                found.append((cell, scanned[1]))
+            else:
+                self._remove(cell)
+                listed.discard(name)
+        for name in set(self._scanned) - listed:
+            del self._scanned[name]
+        return found
+
+    async def refresh(self, cells: List[Tuple[float, float]]) -> int:
+        """Fetch cells now, bulk_size per request, whatever their cache age; returns how many were refreshed"""
+        refreshed = 0
+        for i in range(0, len(cells), self.bulk_size):
+            batch = cells[i:i + self.bulk_size]
+            for cell, forecast in zip(batch, await self._request(batch) or ()):
+                if forecast and forecast["forecast"]:
+                    await self.cache.store(self._key(cell), forecast)
+                    refreshed += 1
+        self.prefetched += refreshed
+        return refreshed
+
+    async def prefetch(self, interval: float) -> int:
+        """
+        One pass of a prefetch task run every interval seconds. Known cells
+        with nothing cached are restored from a fresh copy on disk, or else
+        fetched at once. Cells that could expire before the pass after next
+        are refreshed oldest first, one bulk request at a time spread over
+        the first half of the interval, so a large farm list never reaches
+        Open-Meteo in one burst
+        """
+        missing, expiring = [], []
+        for cell in await self.known_cells():
+            age = await self.cache.age(self._key(cell))
+            if age is None:
+                saved = await asyncio.to_thread(self._load, cell)
+                if not self._is_fresh(saved):
+                    missing.append(cell)
+                    continue
+                self.disk_hits += 1
+                age = time.time() - saved["fetched_at"]
+                self.cache.put(self._key(cell), saved["forecast"], stored_at=time.monotonic() - age)
+            if age + 2 * interval >= self.cache.ttl:
+                expiring.append((age, cell))
+        refreshed = await self.refresh(missing)
+        expiring = [cell for _, cell in sorted(expiring, reverse=True)]
+        batches = [expiring[i:i + self.bulk_size] for i in range(0, len(expiring), self.bulk_size)]
+        for i, batch in enumerate(batches):
+            if i:
+                await asyncio.sleep(interval / 2 / len(batches))
+            refreshed += await self.refresh(batch)
+        return refreshed
+
+    @staticmethod
+    def _key(cell: Tuple[float, float]) -> str:
+        return f"open_meteo:{cell[0]},{cell[1]}"
+
     async def get_forecast(self, lat: float, lon: float, days: int = 7) -> Dict[str, Any]:
         """
         Fetch weather forecast for a specific coordinate
         """
+        cell = self.cell(lat, lon)
+        self._touch(cell)
+        cached = await self.cache.get(self._key(cell), lambda: self._fetch_cell(cell))
+        return self._for_days(cached, days)
+
+    async def get_forecasts(self, locations: List[Tuple[float, float]], days: int = 7) -> List[Dict[str, Any]]:
+        """
+        Forecasts for many (lat, lon) pairs, in order; cells without a fresh
+        cached forecast are fetched bulk_size at a time in single requests
+        """
+        cells = [self.cell(lat, lon) for lat, lon in locations]
+        for cell in dict.fromkeys(cells):
+            self._touch(cell)
+        missing = [cell for cell in dict.fromkeys(cells) if not await self.cache.is_fresh(self._key(cell))]
+        for i in range(0, len(missing), self.bulk_size):
+            batch = missing[i:i + self.bulk_size]
+            fetched = await self._request(batch)
+            for cell, forecast in zip(batch, fetched or [None] * len(batch)):
+                forecast = forecast or self._saved_forecast(cell, await asyncio.to_thread(self._load, cell))
+                if forecast:
+                    await self.cache.store(self._key(cell), forecast)
+        return [self._for_days(self.cache.peek(self._key(cell)), days) for cell in cells]
+
+    async def _fetch_cell(self, cell: Tuple[float, float]) -> Optional[Dict[str, Any]]:
+        """Cache fetcher: fresh copy on disk, else Open-Meteo, else the last saved copy"""
+        saved = await asyncio.to_thread(self._load, cell)
+        if self._is_fresh(saved):
+            self.disk_hits += 1
+            return saved["forecast"]
+        fetched = await self._request([cell])
+        if fetched and fetched[0]:
+            return fetched[0]
+        return self._saved_forecast(cell, saved)
+
+    async def _request(self, cells: List[Tuple[float, float]]) -> Optional[List[Optional[Dict[str, Any]]]]:
+        """One Open-Meteo request for all cells (comma-separated coordinates); None on failure"""
         params = {
-            "latitude": lat,
-            "longitude": lon,
-            "daily": "temperature_2m_max,temperature_2m_min,precipitation_sum,rain_sum,showers_sum,snowfall_sum",
+            "latitude": ",".join(str(lat) for lat, _ in cells),
+            "longitude": ",".join(str(lon) for _, lon in cells),
+            "daily": DAILY_VARIABLES,
             "timezone": "auto",
-            "forecast_days": days
+            "forecast_days": FORECAST_DAYS
         }
-        
-        async with httpx.AsyncClient() as client:
+
+        self.requests += 1
+        try:
+            client = self.client_pool.get("open_meteo")
+            response = await client.get(self.base_url, params=params)
+            response.raise_for_status()
+            data = response.json()
+        except Exception as e:
+            self.errors += 1
+            print(f"Error fetching weather: {e}")
+            return None
+
+        # A single location comes back as an object, several as a list in request order
+        results = data if isinstance(data, list) else [data]
+        forecasts, to_save = [], []
+        for cell, result in zip(cells, results):
             try:
-                response = await client.get(self.base_url, params=params)
-                response.raise_for_status()
-                data = response.json()
-                return self._process_forecast_data(data)
-            except Exception as e:
-                print(f"Error fetching weather: {e}")
-                # Return dummy/fallback data if API fails
-                return self._get_fallback_forecast(days)
+                forecast = self._process_forecast_data(result)
+            except (KeyError, TypeError, IndexError) as e:
+                print(f"Error processing weather for {cell}: {e}")
+                forecast = None
+            if forecast and forecast["forecast"]:
+                self.locations_fetched += 1
+                requested_at = time.time() if cell in self._pinned else self._known.get(cell, 0.0)
+                to_save.append((cell, forecast, requested_at))
+            forecasts.append(forecast)
+        if self.forecast_dir and to_save:
+            await asyncio.to_thread(self._save_all, to_save)
+        return forecasts + [None] * (len(cells) - len(forecasts))
 
     def _process_forecast_data(self, data: Dict[str, Any]) -> Dict[str, Any]:
         """Process Raw Open-Meteo data into a simpler format"""
         daily = data.get('daily', {})
         forecast = []
-        
+
         for i in range(len(daily.get('time', []))):
             forecast.append({
                 "date": daily['time'][i],
                 "temp_max": daily['temperature_2m_max'][i],
                 "temp_min": daily['temperature_2m_min'][i],
                 "precipitation": daily['precipitation_sum'][i],
-                "is_raining": daily['rain_sum'][i] > 0.5
+                "is_raining": (daily['rain_sum'][i] or 0) > 0.5
             })
-            
+
         return {
             "source": "Open-Meteo",
+            "fetched_at": datetime.now().isoformat(timespec="seconds"),
             "forecast": forecast
         }
 
+    def _for_days(self, cached: Optional[Dict[str, Any]], days: int) -> Dict[str, Any]:
+        """Today onwards, at most days entries, from a cached forecast (fallback if none left)"""
+        today = date.today().isoformat()
+        forecast = [wx for wx in (cached or {}).get("forecast", []) if str(wx.get("date", ""))[:10] >= today][:days]
+        if not forecast:
+            self.fallbacks += 1
+            # Return dummy/fallback data if API fails
+            return self._get_fallback_forecast(days)
+        return {**cached, "forecast": forecast}
+
+    # ==========================================
+    # Last good forecast per cell, on disk
+    # ==========================================
+
+    def _path(self, cell: Tuple[float, float]) -> str:
+        return os.path.join(self.forecast_dir, f"{cell[0]}_{cell[1]}.json")
+
+    def _load(self, cell: Tuple[float, float]) -> Optional[Dict[str, Any]]:
+        if not self.forecast_dir:
+            return None
+        try:
+            with open(self._path(cell), encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            print(f"⚠️ Could not read saved forecast for {cell}: {e}")
+            return None
+
+    def _is_fresh(self, saved: Optional[Dict[str, Any]]) -> bool:
+        """True for a saved forecast younger than the cache TTL"""
+        return bool(saved) and time.time() - saved["fetched_at"] < self.cache.ttl
+
+    def _save_all(self, items: List[Tuple[Tuple[float, float], Dict[str, Any], float]]):
+        for cell, forecast, requested_at in items:
+            self._save(cell, forecast, requested_at)
+
+    def _save(self, cell: Tuple[float, float], forecast: Dict[str, Any], requested_at: float):
+        """Write the cell's forecast (atomic replace)"""
+        if not self.forecast_dir:
+            return
+        saved = {"fetched_at": time.time(), "requested_at": requested_at, "forecast": forecast}
+        try:
+            os.makedirs(self.forecast_dir, exist_ok=True)
+            # Unique temp file: a prefetch and a request thread may save the same cell
+            write_atomic(self._path(cell), json.dumps(saved))
+        except OSError as e:
+            print(f"⚠️ Could not save forecast for {cell}: {e}")
+
+    def _remove(self, cell: Tuple[float, float]):
+        """Delete the saved forecast of an idle cell"""
+        try:
+            os.remove(self._path(cell))
+        except OSError:
+            pass
+
+    def _saved_forecast(self, cell: Tuple[float, float], saved: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        """The last good forecast for cell (as loaded) while Open-Meteo is unreachable, if it still covers today"""
+        if not saved:
+            return None
+        today = date.today().isoformat()
+        forecast = [wx for wx in saved["forecast"].get("forecast", []) if str(wx.get("date", ""))[:10] >= today]
+        if not forecast:
+            return None
+        self.saved_served += 1
+        return {**saved["forecast"], "source": "Open-Meteo (saved)", "forecast": forecast}
+
     def _get_fallback_forecast(self, days: int) -> Dict[str, Any]:
         """Fallback forecast data in case of API error"""
         return {
             "source": "Fallback",
             "forecast": [
                 {
-                    "date": datetime.now().strftime("%Y-%m-%d"),
+                    "date": (datetime.now() + timedelta(days=day)).strftime("%Y-%m-%d"),
                     "temp_max": 30.0,
                     "temp_min": 24.0,
                     "precipitation": 0.0,
                     "is_raining": False
-                } for _ in range(days)
+                } for day in range(days)
             ]
         }
+
+    def stats(self) -> Dict[str, Any]:
+        """Counters for /api/health"""
+        return {
+            "grid_degrees": self.grid,
+            "persistent": bool(self.forecast_dir),
+            "requests": self.requests,
+            "locations_fetched": self.locations_fetched,
+            "errors": self.errors,
+            "disk_hits": self.disk_hits,
+            "saved_served": self.saved_served,
+            "fallbacks": self.fallbacks,
+            "known_cells": len(self._pinned) + len(self._known),
+            "cells_dropped": self.cells_dropped,
+            "prefetched": self.prefetched,
+            "cache": self.cache.stats()
+        }